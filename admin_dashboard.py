@@ -0,0 +1,204 @@
+"""
+Admin dashboard for browsing consent submissions.
+
+Lists consentsamc_results one page at a time. Filtering, ordering, paging
+and counting all happen in Postgres: each page is one PostgREST request for
+the selected columns of one page of rows (the first with an estimated
+total), so the table is never fetched into the app or the browser. Pages
+are keyset-paged on (created_at, pdf_file_path), so a deep page costs no
+more than the first, and are cached for RESULT_TTL seconds. The indexes
+these queries rely on are in sql/consentsamc_results_indexes.sql.
+
+Monthly volume comes from the rollups kept by parquet_mirror.py, when a
+mirror has been synced, so reports never scan the table.
+
+Usage:
+    streamlit run admin_dashboard.py
+
+Needs ADMIN_PASSWORD in st.secrets next to the Supabase keys.
+"""
+import hmac
+import math
+
+import pandas as pd
+import streamlit as st
+
+import keyset
+import main_case
+import parquet_mirror
+from consent_queries import ORDER, TABLE, apply_filters
+from overlay import is_overlay_path, pdf_name
+
+# Seconds a fetched page is reused before asking Supabase again
+RESULT_TTL = 30
+PAGE_SIZES = (25, 50, 100)
+
+# Columns that can be shown; pdf_file_path, pdf_sha256 and created_at are always fetched
+COLUMNS = (
+    "Medical Record Number", "First Name", "Last Name", "Date of Birth",
+    "Case Category", "Case Study Diagnosis", "Employee First Name",
+    "Employee Last Name", "Employee Email", "Employee Department",
+    "Signature Date", "Verbal Auth Date", "Verbal Authorization",
+    "Authorized Person", "Email", "Phone", "Address", "City", "State", "ZIP Code",
+)
+DEFAULT_COLUMNS = (
+    "Medical Record Number", "Last Name", "Case Category",
+    "Employee Last Name", "Employee Department", "Case Study Diagnosis",
+)
+def check_password():
+    """Ask for ADMIN_PASSWORD once per session. Returns True when signed in."""
+    if st.session_state.get("admin_signed_in"):
+        return True
+    expected = st.secrets.get("ADMIN_PASSWORD")
+    if not expected:
+        st.error("ADMIN_PASSWORD is not set in the app secrets.")
+        return False
+    password = st.text_input("Admin password", type="password")
+    if password and hmac.compare_digest(password.encode(), str(expected).encode()):
+        st.session_state.admin_signed_in = True
+        st.rerun()
+    elif password:
+        st.error("Incorrect password")
+    return False
+
+@st.cache_data(ttl=RESULT_TTL, max_entries=256, show_spinner=False)
+def fetch_page(filters, columns, cursor, page_size):
+    """
+    One page of submissions, newest first, keyset-paged: the page starts
+    after cursor rather than at an OFFSET, so every page is one index range
+    scan however deep it is
+    Args: filters (dict): see consent_queries.apply_filters
+          columns (tuple): columns to fetch besides pdf_file_path, pdf_sha256 and created_at
+          cursor (tuple): (created_at, pdf_file_path) of the previous page's last row,
+                          None for the first page
+    Returns: tuple: (rows, has_more, total) where total is Postgres' estimate of
+             the matching row count (exact for small results), first page only
+    """
+    wanted = list(dict.fromkeys((*columns, "pdf_file_path", "pdf_sha256", "created_at")))
+    query = main_case.init_supabase().table(TABLE).select(
+        ",".join(f'"{c}"' for c in wanted), count="estimated" if cursor is None else None
+    )
+    query = apply_filters(query, filters)
+    if cursor is not None:
+        query = query.or_(keyset.after(dict(zip(("created_at", "pdf_file_path"), cursor)), ORDER))
+    for column, desc in ORDER:
+        query = query.order(column, desc=desc)
+    # One row more than shown, to tell whether there is a next page
+    result = query.limit(page_size + 1).execute()
+    rows = result.data or []
+    return rows[:page_size], len(rows) > page_size, result.count
+
+def pdf_link(file_path):
+    """Public URL of a stored PDF; overlays have none and are rebuilt on request"""
+    if not file_path or is_overlay_path(file_path):
+        return None
+    return main_case.get_public_url(file_path)
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def load_rollups():
+    return parquet_mirror.load_rollups(parquet_mirror.MIRROR_DIR)
+
+def volume_report():
+    """Monthly submission counts from the Parquet mirror's rollups, if there is a mirror"""
+    rollups = load_rollups()
+    if rollups is None:
+        return
+    with st.expander("Monthly volume"):
+        by = st.radio("Break down by", parquet_mirror.ROLLUP_KEYS[1:], horizontal=True)
+        volume = parquet_mirror.monthly_volume(rollups, by)
+        st.bar_chart(volume)
+        st.dataframe(volume, use_container_width=True)
+
+def sidebar_filters():
+    """Filter, page size and column widgets. Returns: tuple: (filters, columns, page_size)"""
+    with st.sidebar:
+        st.header("Filters")
+        mrn = st.text_input("MRN").strip()
+        category = st.selectbox("Case Category", [""] + main_case.CASE_CATEGORIES)
+        department = st.text_input("Department contains").strip()
+        dates = st.date_input("Submitted between", value=(), format="MM/DD/YYYY")
+        start = dates[0] if len(dates) > 0 else None
+        end = dates[1] if len(dates) > 1 else start
+        st.header("Display")
+        columns = st.multiselect("Columns", COLUMNS, default=DEFAULT_COLUMNS)
+        page_size = st.selectbox("Rows per page", PAGE_SIZES)
+    filters = {"mrn": mrn, "category": category, "department": department, "start": start, "end": end}
+    return filters, tuple(columns), page_size
+
+def main():
+    st.set_page_config(page_title="Consent submissions", layout="wide")
+    st.title("Consent submissions")
+    if not check_password():
+        return
+
+    volume_report()
+    filters, columns, page_size = sidebar_filters()
+
+    # Start over at the first page whenever the query changes. admin_cursors
+    # holds the cursor of every page up to the current one, for Previous.
+    query_key = (tuple(sorted(filters.items())), page_size)
+    if st.session_state.get("admin_query") != query_key:
+        st.session_state.admin_query = query_key
+        st.session_state.admin_cursors = [None]
+    cursors = st.session_state.admin_cursors
+    page = len(cursors) - 1
+
+    try:
+        rows, has_more, total = fetch_page(filters, columns, cursors[-1], page_size)
+    except Exception as e:
+        st.error(f"Could not load submissions: {e}")
+        return
+    if total is not None:
+        st.session_state.admin_total = total
+    total = st.session_state.get("admin_total", 0)
+    pages = max(page + 1 + has_more, math.ceil(total / page_size))
+
+    if not rows:
+        st.info("No submissions match these filters.")
+    else:
+        frame = pd.DataFrame(rows, columns=list(dict.fromkeys((*columns, "created_at", "pdf_file_path"))))
+        frame["created_at"] = pd.to_datetime(frame["created_at"], utc=True, errors="coerce")
+        frame.insert(0, "PDF", [pdf_link(path) for path in frame["pdf_file_path"]])
+        selection = st.dataframe(
+            frame,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "PDF": st.column_config.LinkColumn("PDF", display_text="Open"),
+                "created_at": st.column_config.DatetimeColumn("Submitted", format="MM/DD/YYYY hh:mm a"),
+            },
+            on_select="rerun",
+            selection_mode="single-row",
+            key=f"admin_rows_{page}",
+        )
+        # Overlay-only submissions have no stored PDF to link to
+        for index in selection.selection.rows:
+            file_path = frame["pdf_file_path"].iloc[index]
+            if not is_overlay_path(file_path):
+                continue
+            try:
+                pdf_bytes = main_case.rebuild_pdf(file_path, rows[index].get("pdf_sha256"))
+            except Exception as e:
+                st.error(f"Could not rebuild {pdf_name(file_path)}: {e}")
+                continue
+            st.download_button(
+                f"Download {pdf_name(file_path)}",
+                data=pdf_bytes,
+                file_name=pdf_name(file_path),
+                mime="application/pdf",
+            )
+
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        if st.button("Previous", disabled=page == 0):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {page + 1} of about {pages:,} · about {total:,} submissions")
+    with col3:
+        if st.button("Next", disabled=not has_more):
+            cursors.append((rows[-1]["created_at"], rows[-1]["pdf_file_path"]))
+            st.rerun()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Bulk consent generation for paper and phone consents.
+
+Reads submissions from a CSV or JSONL file (columns named like the form's
+submitted_data keys), validates each record with the same validators as the
+Streamlit form and renders the consent PDF across a process pool.
+
+Usage:
+    python batch_consent.py submissions.csv --out consents.zip
+    python batch_consent.py submissions.jsonl --out consents/ --workers 8
+
+Records are verbal consents unless a "Signature Image" column points to a
+PNG of the patient's signature.
+
+    python batch_consent.py submissions.csv --validate-only
+
+checks every record's form fields at once with main_case.validate_frame and
+reports the invalid rows without rendering anything (signature images are
+not checked in this mode). Both modes report a record that repeats an
+earlier one, since it would render to the same PDF filename.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import PIL.Image as Image
+
+import main_case
+
+DATE_FORMATS = ("%m/%d/%Y", "%Y-%m-%d")
+TRUE_VALUES = {"yes", "y", "true", "1"}
+
+def read_records(path):
+    """Yield submission dicts one at a time from a CSV or JSONL file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def normalize_date(value):
+    """
+    Convert ISO or US dates to the MM/DD/YYYY format used on the form. Other
+    values are returned unchanged for the Date of Birth checks to reject.
+    """
+    if not value:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).strftime("%m/%d/%Y")
+        except ValueError:
+            continue
+    return value
+
+def build_submission(record):
+    """
+    Turn one raw record into (submitted_data, errors) using the form validators
+    """
+    fields = {key: (value.strip() if isinstance(value, str) else value) for key, value in record.items()}
+    verbal = str(fields.get("Verbal Authorization") or "").strip().lower() in TRUE_VALUES
+
+    signature = None
+    image_path = fields.pop("Signature Image", None)
+    if image_path and not verbal:
+        try:
+            signature = np.array(Image.open(image_path).convert("RGBA"))
+        except OSError as e:
+            return None, [f"Could not read signature image {image_path}: {e}"]
+
+    fields["Date of Birth"] = normalize_date(fields.get("Date of Birth"))
+    validations = main_case.collect_validations(fields, SimpleNamespace(image_data=signature), verbal)
+    errors = [message for valid, message in validations if not valid]
+    if errors:
+        return None, errors
+
+    submission_date = normalize_date(fields.get("Signature Date") or fields.get("Verbal Auth Date")) or main_case.today_str
+    submitted_data = {key: fields.get(key) for key in (
+        "First Name", "Last Name", "Email", "Phone", "Medical Record Number",
+        "Date of Birth", "Address", "City", "State", "ZIP Code", "Authorized Person",
+    )}
+    submitted_data.update({
+        "Verbal Authorization": "Yes" if verbal else None,
+        "Verbal Auth Date": submission_date if verbal else None,
+        "Signature": "Verbal Authorization" if verbal else signature,
+        "Signature Date": None if verbal else submission_date,
+        "Employee First Name": fields.get("Employee First Name"),
+        "Employee Last Name": fields.get("Employee Last Name"),
+        "Employee Email": fields.get("Employee Email"),
+        "Employee Department": fields.get("Employee Department"),
+        "Case Category": fields.get("Case Category"),
+        "Case Study Diagnosis": fields.get("Case Study Diagnosis"),
+    })
+    return submitted_data, []
+
+def validate_file(input_path, report=sys.stderr):
+    """
+    Audit every record's form fields in one vectorized pass
+    Returns: dict: counts of valid and invalid records
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(list(read_records(input_path)), dtype=object)
+    if "Date of Birth" in frame:
+        frame["Date of Birth"] = frame["Date of Birth"].map(normalize_date)
+    # JSONL values can be numbers or null next to strings; strip only the strings
+    frame = frame.apply(lambda column: column.map(lambda value: value.strip() if isinstance(value, str) else value))
+    errors = main_case.validate_frame(frame)
+    # Identical records would render to the same PDF filename
+    keys = pd.util.hash_pandas_object(frame.astype(str), index=False)
+    first = pd.Series(frame.index, index=frame.index).groupby(keys.to_numpy()).transform("first")
+    duplicate = first != frame.index
+    errors["Duplicate"] = np.where(duplicate, "same record as row " + (first + 1).astype(str), "")
+    errors["valid"] &= ~duplicate
+    invalid = errors[~errors["valid"]].drop(columns="valid")
+    for row_number, messages in zip(invalid.index + 1, invalid.itertuples(index=False)):
+        print(f"row {row_number}: " + "; ".join(m for m in messages if m), file=report)
+    return {"records": len(frame), "valid": int(errors["valid"].sum()), "invalid": len(invalid)}
+
+def process_record(row_number, record):
+    """Validate and render one record. Runs inside a pool worker."""
+    submitted_data, errors = build_submission(record)
+    if errors:
+        return row_number, None, None, errors
+    pdf_bytes = main_case.create_pdf(**submitted_data)
+    if not pdf_bytes:
+        return row_number, None, None, ["Failed to generate PDF"]
+    return row_number, main_case.pdf_filename(submitted_data), pdf_bytes, []
+
+def _warm_worker():
+    # Prepare the template once per worker instead of on the first record
+    main_case.init_consent_template().base_bytes(main_case.OUTPUT_PROFILE)
+
+class DirectorySink:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, filename, pdf_bytes):
+        with open(os.path.join(self.path, filename), "wb") as f:
+            f.write(pdf_bytes)
+
+    def close(self):
+        pass
+
+class ZipSink:
+    def __init__(self, path):
+        # PDF streams are already compressed, so store them as-is
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+
+    def write(self, filename, pdf_bytes):
+        self.zip.writestr(filename, pdf_bytes)
+
+    def close(self):
+        self.zip.close()
+
+def run_batch(input_path, out, workers=None, max_pending=None, report=sys.stderr):
+    """
+    Validate and render every record in input_path into out (directory or .zip).
+    At most max_pending records are in flight, so memory stays bounded
+    regardless of input size.
+    Returns: dict: counts and throughput
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    sink = ZipSink(out) if out.lower().endswith(".zip") else DirectorySink(out)
+    rendered = failed = 0
+    # Identical records render to the same filename; keep the first one written
+    written = {}
+    started = time.perf_counter()
+
+    def drain(done):
+        nonlocal rendered, failed
+        for future in done:
+            row_number, filename, pdf_bytes, errors = future.result()
+            if not errors and filename in written:
+                errors = [f"same record as row {written[filename]} ({filename})"]
+            if errors:
+                failed += 1
+                print(f"row {row_number}: " + "; ".join(errors), file=report)
+            else:
+                sink.write(filename, pdf_bytes)
+                written[filename] = row_number
+                rendered += 1
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker) as pool:
+            pending = set()
+            for row_number, record in enumerate(read_records(input_path), 1):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    drain(done)
+                pending.add(pool.submit(process_record, row_number, record))
+            drain(wait(pending).done)
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - started
+    total = rendered + failed
+    return {
+        "records": total,
+        "rendered": rendered,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "forms_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate and render consent PDFs in bulk")
+    parser.add_argument("input", help="CSV or JSONL file of submissions")
+    parser.add_argument("--out", default=None, help="output directory or .zip file")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=None, help="records in flight at once (default: 4 x workers)")
+    parser.add_argument("--validate-only", action="store_true", help="only check the form fields of every record")
+    args = parser.parse_args(argv)
+
+    if args.validate_only:
+        stats = validate_file(args.input)
+        print(f"{stats['valid']} valid, {stats['invalid']} invalid of {stats['records']} records")
+        return 1 if stats["invalid"] else 0
+    if not args.out:
+        parser.error("--out is required unless --validate-only is given")
+
+    stats = run_batch(args.input, args.out, workers=args.workers, max_pending=args.max_pending)
+    print(
+        f"{stats['rendered']} rendered, {stats['failed']} failed in {stats['seconds']}s "
+        f"({stats['forms_per_second']} forms/s)"
+    )
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Benchmarks for the consent submission hot path.
+
+Times create_pdf (verbal, raster and vector signature), validate_signature on a
+realistic canvas array and on canvas strokes, decoding the canvas PNG, the
+full form validator list, bulk validation of a 10,000-row DataFrame,
+signature PNG encoding and upload_and_submit_to_supabase against
+FakeSupabase with a configurable round-trip latency.
+
+Usage:
+    python bench_case.py                          # run and compare to bench_baseline.json
+    python bench_case.py --json results.json      # also save results
+    python bench_case.py --update-baseline        # store results as the new baseline
+    python bench_case.py --only create_pdf        # run benchmarks whose name contains text
+    python bench_case.py --profiles --only pdf    # add bytes/ms per output profile (* = OUTPUT_PROFILE)
+
+Exits with status 1 when any benchmark's median is slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+import main_case
+from fake_supabase import FakeSupabase
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+def sample_signature(width=600, height=150, seed=0):
+    """
+    RGBA array shaped like st_canvas image_data: transparent background with
+    a few 2 px black strokes roughly where people sign.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 4), dtype=np.uint8)
+    xs = np.arange(int(width * 0.15), int(width * 0.7))
+    for stroke in range(3):
+        phase = rng.uniform(0, np.pi)
+        ys = (height / 2 + (height / 5) * np.sin(xs / (12 + 6 * stroke) + phase)).astype(int)
+        for dy in (0, 1):
+            image[np.clip(ys + dy, 0, height - 1), xs, 3] = 255
+    return image
+
+def sample_strokes(width=600, height=150, seed=0):
+    """
+    st_canvas freedraw strokes (fabric.js path commands) tracing the same
+    curves as sample_signature
+    """
+    rng = np.random.default_rng(seed)
+    strokes = []
+    xs = np.arange(int(width * 0.15), int(width * 0.7), 4)
+    for stroke in range(3):
+        phase = rng.uniform(0, np.pi)
+        ys = height / 2 + (height / 5) * np.sin(xs / (12 + 6 * stroke) + phase)
+        path = [["M", float(xs[0]), float(ys[0])]]
+        for i in range(1, len(xs) - 1, 2):
+            path.append(["Q", float(xs[i]), float(ys[i]), float(xs[i + 1]), float(ys[i + 1])])
+        path.append(["L", float(xs[-1]), float(ys[-1])])
+        strokes.append(path)
+    return strokes
+
+def sample_canvas_value(width=600, height=150, seed=0):
+    """
+    Component value the canvas sends on submit: the canvas as a PNG data URL
+    plus its fabric.js JSON, with the same strokes as sample_signature
+    """
+    import base64
+    import io
+
+    from PIL import Image
+
+    png = io.BytesIO()
+    Image.fromarray(sample_signature(width, height, seed)).save(png, format="PNG")
+    objects = [
+        {"type": "path", "version": "4.4.0", "originX": "left", "originY": "top", "stroke": "#000000",
+         "strokeWidth": 2, "strokeLineCap": "round", "strokeLineJoin": "round", "fill": None, "path": path}
+        for path in sample_strokes(width, height, seed)
+    ]
+    return {
+        "data": "data:image/png;base64," + base64.b64encode(png.getvalue()).decode("ascii"),
+        "width": width,
+        "height": height,
+        "raw": {"version": "4.4.0", "objects": objects, "background": "#00000000"},
+    }
+
+def sample_submission(mrn="1234567", signature=None, strokes=None):
+    """A submitted_data dict as built by main() for a valid form"""
+    verbal = signature is None
+    return {
+        "First Name": "Jane",
+        "Last Name": "Doe",
+        "Email": "jane.doe@example.com",
+        "Phone": "559-555-0100",
+        "Medical Record Number": mrn,
+        "Date of Birth": "01/02/1980",
+        "Address": "1303 E Herndon Ave",
+        "City": "Fresno",
+        "State": "CA",
+        "ZIP Code": "93720",
+        "Authorized Person": "",
+        "Verbal Authorization": "Yes" if verbal else None,
+        "Verbal Auth Date": main_case.today_str if verbal else None,
+        "Signature": "Verbal Authorization" if verbal else signature,
+        "Signature Strokes": None if verbal else strokes,
+        "Signature Date": None if verbal else main_case.today_str,
+        "Employee First Name": "Phillip",
+        "Employee Last Name": "Kim",
+        "Employee Email": "phillip.kim@samc.com",
+        "Employee Department": "Internal Medicine",
+        "Case Category": "Cardiology",
+        "Case Study Diagnosis": "Takotsubo cardiomyopathy",
+    }
+
+def measure(func, repeat, warmup=2):
+    """Run func repeatedly and return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+    }
+
+def build_benchmarks(latency):
+    """Return {name: zero-argument callable} for every benchmark"""
+    signature = sample_signature()
+    canvas_result = SimpleNamespace(image_data=signature)
+    signed = sample_submission(signature=signature)
+    signed_vector = sample_submission(signature=signature, strokes=sample_strokes())
+    verbal = sample_submission()
+    form_fields = dict(signed, **{"Date of Birth": "01/02/1980"})
+    canvas_value = sample_canvas_value()
+    import pandas as pd
+    frame = pd.DataFrame([dict(verbal, **{"Medical Record Number": str(i)}) for i in range(10000)])
+
+    fake = FakeSupabase(latency=latency)
+    main_case.init_supabase = lambda: fake
+    main_case.OUTBOX_DIR = tempfile.mkdtemp(prefix="bench-outbox-")
+    mrns = iter(range(10**9))
+
+    def submit():
+        # A distinct patient each time, or the similar-patient check stops
+        # the submission before the PDF is rendered
+        n = next(mrns)
+        data = dict(verbal, **{
+            "Medical Record Number": str(n),
+            "Date of Birth": (date(1940, 1, 1) + timedelta(days=n % 30000)).strftime("%m/%d/%Y"),
+            "Email": f"patient.{n}@example.com",
+            "Phone": f"559-{n // 10000 % 1000:03d}-{n % 10000:04d}",
+        })
+        result = main_case.upload_and_submit_to_supabase(data)
+        assert result.success and result.pdf_bytes, result.message
+
+    return {
+        "create_pdf_verbal": lambda: main_case.create_pdf(**verbal),
+        "create_pdf_signature": lambda: main_case.create_pdf(**signed),
+        "create_pdf_vector_signature": lambda: main_case.create_pdf(**signed_vector),
+        "validate_signature": lambda: main_case.validate_signature(canvas_result, False),
+        # Per rerun once something is drawn: st_canvas always decodes the PNG,
+        # SignatureCanvas only when the image is used
+        "canvas_decode_image": lambda: main_case.SignatureCanvas(canvas_value["data"], canvas_value["raw"]).image_data,
+        "validate_signature_strokes": lambda: main_case.validate_signature(
+            main_case.SignatureCanvas(canvas_value["data"], canvas_value["raw"]), False
+        ),
+        "validators_full_form": lambda: main_case.collect_validations(form_fields, canvas_result, False),
+        "validate_frame_10k": lambda: main_case.validate_frame(frame),
+        "signature_png_encode": lambda: main_case.encode_signature_png(signature),
+        "upload_and_submit": submit,
+    }
+
+def profile_report(repeat):
+    """
+    Output size and render time of every form kind under every output profile
+    Returns: dict: {profile: {form: {"bytes", "median_ms"}}}
+    """
+    signature = sample_signature()
+    forms = {
+        "verbal": sample_submission(),
+        "signature": sample_submission(signature=signature),
+        "vector_signature": sample_submission(signature=signature, strokes=sample_strokes()),
+    }
+    report = {}
+    for profile in main_case.OUTPUT_PROFILES:
+        # Template preparation happens once per process, outside the timings
+        main_case.init_consent_template().base_bytes(profile)
+        report[profile] = {}
+        for form, data in forms.items():
+            size = len(main_case.create_pdf(output_profile=profile, **data))
+            timing = measure(lambda: main_case.create_pdf(output_profile=profile, **data), repeat)
+            report[profile][form] = {"bytes": size, "median_ms": timing["median_ms"]}
+    return report
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression descriptions against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        limit = base["median_ms"] * (1 + tolerance)
+        if result["median_ms"] > limit:
+            regressions.append(
+                f"{name}: median {result['median_ms']:.3f} ms > baseline "
+                f"{base['median_ms']:.3f} ms (+{tolerance:.0%} allowed)"
+            )
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the consent submission hot path")
+    parser.add_argument("--repeat", type=int, default=30, help="timed runs per benchmark")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake Supabase round-trip latency")
+    parser.add_argument("--only", default=None, help="run only benchmarks whose name contains this text")
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with these results")
+    parser.add_argument("--profiles", action="store_true", help="also report PDF bytes and render time per output profile")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, func in build_benchmarks(args.latency_ms / 1000).items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        r = results[name]
+        print(f"{name:<24} median {r['median_ms']:>9.3f} ms   p95 {r['p95_ms']:>9.3f} ms   min {r['min_ms']:>9.3f} ms")
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "latency_ms": args.latency_ms,
+        "results": results,
+    }
+    if args.profiles:
+        report["output_profiles"] = profile_report(args.repeat)
+        for profile, forms in report["output_profiles"].items():
+            marker = "*" if profile == main_case.OUTPUT_PROFILE else " "
+            for form, r in forms.items():
+                print(f"{marker}{profile:<9} {form:<17} {r['bytes']:>8} bytes   median {r['median_ms']:>7.3f} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+PostgREST query helpers for consentsamc_results, shared by the admin
+dashboard and export_consents.py. Plain functions over a query builder, so
+batch tools can use them without importing the Streamlit pages.
+"""
+from datetime import timedelta
+
+TABLE = "consentsamc_results"
+
+# Newest first; pdf_file_path breaks ties between rows inserted in one batch
+ORDER = (("created_at", True), ("pdf_file_path", True))
+
+def like_literal(text):
+    """
+    text matched literally inside a LIKE pattern: % and _ are escaped. PostgREST
+    reads * as % and has no escape for it, so * matches any one character instead.
+    """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "_")
+
+def apply_filters(query, filters):
+    """
+    Add the dashboard filters to a PostgREST query
+    Args: filters (dict): mrn, category, department (substring, any case),
+          start and end (dates, inclusive, on created_at)
+    """
+    if filters.get("mrn"):
+        query = query.eq("Medical Record Number", filters["mrn"])
+    if filters.get("category"):
+        query = query.eq("Case Category", filters["category"])
+    if filters.get("department"):
+        query = query.ilike("Employee Department", f"%{like_literal(filters['department'])}%")
+    if filters.get("start"):
+        query = query.gte("created_at", filters["start"].isoformat())
+    if filters.get("end"):
+        query = query.lt("created_at", (filters["end"] + timedelta(days=1)).isoformat())
+    return query
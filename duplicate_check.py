@@ -0,0 +1,378 @@
+"""
+Duplicate check for consent submissions.
+
+Looks up earlier submissions for a Medical Record Number, fetching only the
+columns the duplicate warning shows. An in-process index of every known MRN
+is warmed at startup and updated on each local submission, so the common
+case (an MRN never seen before) needs no round trip.
+
+The same warm-up builds a blocking index for the same patient entered under
+a different MRN (e.g. a typo). Each row is filed under normalized keys:
+
+    name_dob:<soundex(last name)>:<date of birth>
+    email:<lowercased email>
+    phone:<last 10 digits>
+
+each mapping to the MRN seen with it (a set once there is more than one;
+most keys have one, which keeps the index small). Keys are stored as 8-byte
+hashes, so the index holds no names, dates of birth, emails or phone
+numbers, only MRNs. find_similar() looks up the keys of a new submission
+(a few dict lookups, whatever the table size), drops MRNs whose shared keys
+can't reach MATCH_THRESHOLD whatever their rows hold, fetches the rows of
+the rest, scores every one with MATCH_WEIGHTS and reports the best
+MAX_MATCHES.
+
+Refreshes are incremental. The first one reads the whole table; later ones
+read only the rows created since the newest created_at already seen (less
+REFRESH_OVERLAP, for rows committed after later ones). Both page by keyset
+on (created_at, pdf_file_path), so no page costs more than the first.
+
+Stale-cache safety: the index only ever answers "definitely new". It is
+trusted for `ttl` seconds after the refresh it was last brought up to date
+by started; after that every lookup goes to Supabase until a background
+refresh completes. Refreshes merge into the existing set, so a row inserted
+during a refresh is never dropped, and an MRN found in the index is always
+confirmed against Supabase before anything is reported. The blocking index
+has no such fallback (phone and email formats vary, so Supabase can't be
+asked for normalized matches); while stale it is used as it is and
+refreshed in the background.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import keyset
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TABLE = "consentsamc_results"
+MRN_COLUMN = "Medical Record Number"
+
+# Columns shown in the duplicate warning and used to sort it, plus the PDF
+# path that identifies a row
+WARNING_COLUMNS = (
+    MRN_COLUMN,
+    "pdf_file_path",
+    "Employee First Name",
+    "Employee Last Name",
+    "Employee Department",
+    "Employee Email",
+    "Case Category",
+    "Signature Date",
+    "Verbal Auth Date",
+)
+
+# Patient columns that blocking keys and match scores are computed from
+MATCH_COLUMNS = (MRN_COLUMN, "First Name", "Last Name", "Date of Birth", "Email", "Phone")
+
+# Score contributions; a candidate is reported at MATCH_THRESHOLD or above,
+# so a sound-alike last name with the same DOB is enough on its own but an
+# email or phone (often shared within a family) is not
+MATCH_WEIGHTS = {
+    "name_dob": 0.5,
+    "first_name": 0.2,
+    "first_name_sound": 0.1,
+    "email": 0.3,
+    "phone": 0.3,
+}
+MATCH_THRESHOLD = 0.5
+MATCH_REASONS = {
+    "name_dob": "last name sounds alike, same DOB",
+    "first_name": "same first name",
+    "first_name_sound": "first name sounds alike",
+    "email": "same email",
+    "phone": "same phone",
+}
+
+# Most score a key kind can lead to: name_dob also lets the first name count
+KEY_WEIGHTS = {
+    "name_dob": MATCH_WEIGHTS["name_dob"] + MATCH_WEIGHTS["first_name"],
+    "email": MATCH_WEIGHTS["email"],
+    "phone": MATCH_WEIGHTS["phone"],
+}
+
+# Candidate MRNs per query, and scored matches reported per check
+CANDIDATES_PER_QUERY = 50
+MAX_MATCHES = 20
+
+# Refresh order; pdf_file_path is unique, so it makes the keyset unique
+REFRESH_ORDER = (("created_at", False), ("pdf_file_path", False))
+# created_at is when the inserting transaction started, so a row can become
+# visible after rows created later; each refresh re-reads this far back
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+SOUNDEX_CODES = {
+    letter: digit
+    for digit, letters in (("1", "BFPV"), ("2", "CGJKQSXZ"), ("3", "DT"), ("4", "L"), ("5", "MN"), ("6", "R"))
+    for letter in letters
+}
+
+def soundex(name):
+    """American Soundex code of a name, e.g. "Robert" and "Rupert" -> "R163"; "" if it has no letters"""
+    letters = re.sub(r"[^A-Z]", "", str(name or "").upper())
+    if not letters:
+        return ""
+    code, previous = letters[0], SOUNDEX_CODES.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W don't separate letters with the same code; vowels do
+        if letter not in "HW":
+            previous = digit
+    return code.ljust(4, "0")
+
+def normalize_email(email):
+    return str(email or "").strip().lower()
+
+def normalize_phone(phone):
+    """Last 10 digits, so "(555) 123-4567" and "+1 555.123.4567" match; "" if shorter"""
+    digits = re.sub(r"\D", "", str(phone or ""))
+    return digits[-10:] if len(digits) >= 10 else ""
+
+def blocking_keys(row):
+    """Normalized keys a row is filed under in the blocking index"""
+    keys = []
+    last_name = soundex(row.get("Last Name"))
+    dob = str(row.get("Date of Birth") or "").strip()
+    if last_name and dob:
+        keys.append(f"name_dob:{last_name}:{dob}")
+    email = normalize_email(row.get("Email"))
+    if email:
+        keys.append(f"email:{email}")
+    phone = normalize_phone(row.get("Phone"))
+    if phone:
+        keys.append(f"phone:{phone}")
+    return keys
+
+def _key_hash(key):
+    """What the index stores for a blocking key: 8 bytes, not the key's PHI"""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+def _file_under(blocks, key, mrns):
+    """Add mrns (a str or set) to blocks[key], keeping a single MRN as a bare str"""
+    existing = blocks.get(key)
+    if existing is None:
+        blocks[key] = mrns
+        return
+    if isinstance(existing, str):
+        existing = {existing}
+    existing |= {mrns} if isinstance(mrns, str) else mrns
+    blocks[key] = next(iter(existing)) if len(existing) == 1 else existing
+
+def _created_at(row):
+    try:
+        return datetime.fromisoformat(str(row.get("created_at")))
+    except ValueError:
+        return None
+
+def match_score(submission, row):
+    """
+    How likely row is the same patient as submission
+    Returns: tuple: (score between 0 and 1, list of reasons)
+    """
+    matched = []
+    last_name = soundex(submission.get("Last Name"))
+    dob = str(submission.get("Date of Birth") or "").strip()
+    if last_name and last_name == soundex(row.get("Last Name")) and dob == str(row.get("Date of Birth") or "").strip():
+        matched.append("name_dob")
+        first_name = str(submission.get("First Name") or "").strip().lower()
+        if first_name and first_name == str(row.get("First Name") or "").strip().lower():
+            matched.append("first_name")
+        elif soundex(first_name) and soundex(first_name) == soundex(row.get("First Name")):
+            matched.append("first_name_sound")
+    email = normalize_email(submission.get("Email"))
+    if email and email == normalize_email(row.get("Email")):
+        matched.append("email")
+    phone = normalize_phone(submission.get("Phone"))
+    if phone and phone == normalize_phone(row.get("Phone")):
+        matched.append("phone")
+    score = min(1.0, sum(MATCH_WEIGHTS[m] for m in matched))
+    return round(score, 2), [MATCH_REASONS[m] for m in matched]
+
+class DuplicateChecker:
+    def __init__(self, client_factory, ttl=60.0, page_size=1000, executor=None, clock=time.monotonic):
+        """
+        Args: client_factory (callable): returns a Supabase client
+              ttl (float): seconds a warmed index is trusted to rule out duplicates
+              page_size (int): rows per request while refreshing (PostgREST caps at 1000 by default)
+              executor: pool for background refreshes; refreshes run inline if None
+        """
+        self.client_factory = client_factory
+        self.ttl = ttl
+        self.page_size = page_size
+        self.executor = executor
+        self.clock = clock
+        self._mrns = set()
+        self._blocks = {}  # _key_hash(blocking key) -> MRN, or set of MRNs
+        self._snapshot_started = None
+        self._high_water = None  # newest created_at read so far
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.stats = {
+            "skipped": 0, "queried": 0, "refreshes": 0, "rows_read": 0,
+            "similar_skipped": 0, "similar_queried": 0,
+        }
+
+    @property
+    def is_fresh(self):
+        started = self._snapshot_started
+        return started is not None and self.clock() - started < self.ttl
+
+    def warm(self):
+        """
+        Bring the index up to date: every row in the table the first time,
+        then the rows created since the last refresh (MATCH_COLUMNS only,
+        keyset-paged)
+        Returns: int: rows read
+        """
+        started = self.clock()
+        client = self.client_factory()
+        columns = ",".join(f'"{c}"' for c in dict.fromkeys((*MATCH_COLUMNS, "created_at", "pdf_file_path")))
+        since = self._high_water
+        high_water = since
+        mrns = set()
+        blocks = {}
+        last = None
+        read = 0
+        while True:
+            query = client.table(TABLE).select(columns)
+            if last is not None:
+                query = query.or_(keyset.after(last, REFRESH_ORDER))
+            elif since is not None:
+                query = query.gte("created_at", (since - REFRESH_OVERLAP).isoformat())
+            for column, desc in REFRESH_ORDER:
+                query = query.order(column, desc=desc)
+            rows = query.limit(self.page_size).execute().data or []
+            for row in rows:
+                mrn = str(row.get(MRN_COLUMN))
+                mrns.add(mrn)
+                for key in blocking_keys(row):
+                    _file_under(blocks, _key_hash(key), mrn)
+                created_at = _created_at(row)
+                if created_at is not None and (high_water is None or created_at > high_water):
+                    high_water = created_at
+            read += len(rows)
+            if len(rows) < self.page_size:
+                break
+            last = rows[-1]
+        with self._lock:
+            self._mrns |= mrns
+            for key, key_mrns in blocks.items():
+                _file_under(self._blocks, key, key_mrns)
+            self._snapshot_started = started
+            if high_water is not None:
+                self._high_water = high_water
+            self.stats["refreshes"] += 1
+            self.stats["rows_read"] += read
+        return read
+
+    def refresh_in_background(self):
+        """Start a warm() unless one is already running"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.warm()
+            except Exception as e:
+                logger.warning("MRN index refresh failed: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        if self.executor is None:
+            run()
+        else:
+            self.executor.submit(run)
+
+    def add(self, mrn, row=None):
+        """Record an MRN submitted by this process, and the blocking keys of its row if given"""
+        mrn = str(mrn)
+        with self._lock:
+            self._mrns.add(mrn)
+            for key in blocking_keys(row or {}):
+                _file_under(self._blocks, _key_hash(key), mrn)
+
+    def might_exist(self, mrn):
+        """False only when the index is fresh and has never seen this MRN"""
+        if not self.is_fresh:
+            self.refresh_in_background()
+            return True
+        with self._lock:
+            return str(mrn) in self._mrns
+
+    def find(self, mrn):
+        """
+        Return earlier submissions for mrn (projected to WARNING_COLUMNS)
+        Returns: list: matching rows, empty when the MRN is new
+        """
+        if not self.might_exist(mrn):
+            self.stats["skipped"] += 1
+            return []
+        self.stats["queried"] += 1
+        columns = ",".join(f'"{c}"' for c in WARNING_COLUMNS)
+        with metrics.span("mrn_query"):
+            result = self.client_factory().table(TABLE).select(columns).filter(MRN_COLUMN, "eq", mrn).execute()
+        rows = result.data or []
+        if rows:
+            self.add(mrn)
+        return rows
+
+    def similar_mrns(self, submission):
+        """
+        MRNs other than the submission's whose shared blocking keys could
+        reach MATCH_THRESHOLD, most shared evidence first
+        """
+        mrn = str(submission.get(MRN_COLUMN))
+        if not self.is_fresh:
+            self.refresh_in_background()
+        bounds = {}
+        with self._lock:
+            for key in blocking_keys(submission):
+                mrns = self._blocks.get(_key_hash(key), ())
+                weight = KEY_WEIGHTS[key.split(":", 1)[0]]
+                for found in (mrns,) if isinstance(mrns, str) else mrns:
+                    bounds[found] = bounds.get(found, 0) + weight
+        bounds.pop(mrn, None)
+        candidates = [found for found, bound in bounds.items() if round(bound, 2) >= MATCH_THRESHOLD]
+        return sorted(candidates, key=lambda found: (-bounds[found], found))
+
+    def find_similar(self, submission, pending_rows=None):
+        """
+        Earlier submissions that look like the same patient under another MRN
+        Args: submission (dict): the new submission's fields
+              pending_rows (callable): mrn -> rows not yet in Supabase (e.g. Outbox.pending_rows)
+        Returns: list: up to MAX_MATCHES rows (WARNING_COLUMNS and MATCH_COLUMNS)
+                 with "match_score" and "match_reasons", best match first
+        """
+        mrns = self.similar_mrns(submission)
+        if not mrns:
+            self.stats["similar_skipped"] += 1
+            return []
+        self.stats["similar_queried"] += 1
+        columns = ",".join(f'"{c}"' for c in dict.fromkeys(WARNING_COLUMNS + MATCH_COLUMNS))
+        client = self.client_factory()
+        rows = []
+        with metrics.span("similar_query"):
+            for start in range(0, len(mrns), CANDIDATES_PER_QUERY):
+                batch = mrns[start:start + CANDIDATES_PER_QUERY]
+                rows += client.table(TABLE).select(columns).in_(MRN_COLUMN, batch).execute().data or []
+        if pending_rows is not None:
+            seen = {row.get("pdf_file_path") for row in rows}
+            rows += [row for mrn in mrns for row in pending_rows(mrn) if row.get("pdf_file_path") not in seen]
+        candidates = []
+        for row in rows:
+            score, reasons = match_score(submission, row)
+            if score >= MATCH_THRESHOLD:
+                candidates.append(dict(row, match_score=score, match_reasons=reasons))
+        candidates.sort(key=lambda row: row["match_score"], reverse=True)
+        return candidates[:MAX_MATCHES]
@@ -0,0 +1,288 @@
+"""
+Bulk export of consent submissions for audits.
+
+Streams the consentsamc_results rows matching a date range, category,
+department or MRN, downloads each one's PDF from the completed_consent
+bucket and packs everything into a ZIP:
+
+    consents/<pdf filename>     one PDF per submission (overlays are rebuilt)
+    manifest.csv                every row plus its zip entry, size, sha256 and status
+    manifest.parquet            the same manifest for analysis
+
+Downloads run on a thread pool with at most --max-pending files in memory.
+Progress is kept in a work directory next to the output (<out>.parts/): the
+matching rows are listed once, and each PDF is written there with a line
+added to done.jsonl as it completes. Re-running the same command after an
+interruption continues where it stopped and retries failed files. A work
+directory left by an export with different filters is refused rather than
+mixed in; --restart discards it. The ZIP is assembled from the work
+directory at the end, which is then removed.
+
+Usage:
+    python export_consents.py --out audit.zip --since 2026-01-01 --until 2026-03-31
+    python export_consents.py --out cardiology.zip --category Cardiology --workers 16
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date
+
+import keyset
+import main_case
+from consent_queries import ORDER, TABLE, apply_filters
+from overlay import is_overlay_path, pdf_name
+
+BUCKET = "completed_consent"
+PAGE_SIZE = 1000
+ZIP_DIR = "consents/"
+MANIFEST_FIELDS = ("zip_path", "bytes", "sha256", "status")
+
+def fetch_rows(client, filters, page_size=PAGE_SIZE):
+    """Yield every matching row, oldest first, one keyset-paged request per page"""
+    order = tuple((column, not desc) for column, desc in ORDER)
+    last = None
+    while True:
+        query = apply_filters(client.table(TABLE).select("*"), filters)
+        if last is not None:
+            query = query.or_(keyset.after(last, order))
+        for column, desc in order:
+            query = query.order(column, desc=desc)
+        rows = query.limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+
+class ExportWork:
+    """The resumable state of one export: the row list, downloaded files and results"""
+
+    def __init__(self, out):
+        self.path = out + ".parts"
+        self.files = os.path.join(self.path, "files")
+        self.rows_path = os.path.join(self.path, "rows.jsonl")
+        self.done_path = os.path.join(self.path, "done.jsonl")
+        os.makedirs(self.files, exist_ok=True)
+
+    def list_rows(self, client, filters):
+        """
+        The rows to export. They are fetched once and saved, so a resumed
+        export covers the same submissions as the run that was interrupted.
+        Raises ValueError if they were saved for different filters.
+        """
+        listed = self.rows_path + ".complete"
+        saved_filters = {k: str(v) for k, v in filters.items()}
+        if os.path.exists(listed):
+            with open(listed, encoding="utf-8") as f:
+                previous = json.load(f)
+            if previous != saved_filters:
+                raise ValueError(
+                    f"{self.path} holds an interrupted export with other filters ({previous}); "
+                    "run it again with those filters to finish it, or with --restart to discard it"
+                )
+        else:
+            with open(self.rows_path, "w", encoding="utf-8") as f:
+                for row in fetch_rows(client, filters):
+                    f.write(json.dumps(row, default=str) + "\n")
+            with open(listed, "w", encoding="utf-8") as f:
+                f.write(json.dumps(saved_filters))
+        with open(self.rows_path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def results(self):
+        """pdf_file_path -> latest result recorded for it"""
+        try:
+            with open(self.done_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        # Drop a line torn by an interruption so new records start on a fresh line
+        complete = data[:data.rfind(b"\n") + 1]
+        if complete != data:
+            with open(self.done_path, "wb") as f:
+                f.write(complete)
+        results = {}
+        for line in complete.decode("utf-8").splitlines():
+            result = json.loads(line)
+            results[result["pdf_file_path"]] = result
+        return results
+
+    def file_path(self, zip_path):
+        return os.path.join(self.files, zip_path.replace("/", "__"))
+
+    def save(self, file_path, zip_path, pdf_bytes, log):
+        """Write one PDF, then record it; the record is what marks it done"""
+        tmp_path = self.file_path(zip_path) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, self.file_path(zip_path))
+        result = {
+            "pdf_file_path": file_path, "zip_path": zip_path, "bytes": len(pdf_bytes),
+            "sha256": hashlib.sha256(pdf_bytes).hexdigest(), "status": "ok",
+        }
+        log.write(json.dumps(result) + "\n")
+        log.flush()
+        return result
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+def fetch_pdf(client, file_path, pdf_sha256=None):
+    """
+    PDF bytes for a stored PDF or overlay path; a stored overlay is checked
+    against the row's pdf_sha256 before it is rebuilt. Runs on a pool thread.
+    """
+    from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+    for attempt in Retrying(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=5), reraise=True):
+        with attempt:
+            data = client.storage.from_(BUCKET).download(file_path)
+    if is_overlay_path(file_path):
+        data = main_case.render_overlay(data, pdf_sha256)
+    return data
+
+def write_manifests(zf, rows, results, formats):
+    """Add manifest.csv and/or manifest.parquet listing every row with its export result"""
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    records = []
+    for row in rows:
+        result = results.get(row.get("pdf_file_path"), {"status": "not exported"})
+        records.append({**{c: row.get(c) for c in columns}, **{f: result.get(f) for f in MANIFEST_FIELDS}})
+    fields = columns + list(MANIFEST_FIELDS)
+    if "csv" in formats:
+        with zf.open("manifest.csv", "w") as raw:
+            with io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(records)
+    if "parquet" in formats:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            field: pa.array([None if r[field] is None else str(r[field]) for r in records], pa.string())
+            for field in fields if field != "bytes"
+        })
+        table = table.append_column("bytes", pa.array([r["bytes"] for r in records], pa.int64()))
+        with zf.open("manifest.parquet", "w") as f:
+            pq.write_table(table, f)
+
+def run_export(out, filters, workers=8, max_pending=None, formats=("csv", "parquet"), report=sys.stderr,
+               restart=False):
+    """
+    Export every submission matching filters into the ZIP at out, resuming
+    any interrupted export to the same path with the same filters
+    Args: restart (bool): discard an interrupted export instead of resuming it
+    Returns: dict: counts and throughput of this run
+    """
+    max_pending = max_pending or workers * 2
+    client = main_case.init_supabase()
+    if restart:
+        ExportWork(out).remove()
+    work = ExportWork(out)
+    rows = list(work.list_rows(client, filters))
+    results = work.results()
+    todo = {
+        row["pdf_file_path"]: row for row in rows
+        if row.get("pdf_file_path") and results.get(row["pdf_file_path"], {}).get("status") != "ok"
+    }
+    print(f"{len(rows)} submissions match, {len(rows) - len(todo)} already exported", file=report)
+
+    downloaded = failed = downloaded_bytes = 0
+    started = last_report = time.perf_counter()
+
+    def drain(done, log):
+        nonlocal downloaded, failed, downloaded_bytes, last_report
+        for future in done:
+            file_path, zip_path = pending_paths.pop(future)
+            try:
+                results[file_path] = work.save(file_path, zip_path, future.result(), log)
+                downloaded += 1
+                downloaded_bytes += results[file_path]["bytes"]
+            except Exception as e:
+                failed += 1
+                results[file_path] = {"pdf_file_path": file_path, "status": f"failed: {e}"}
+                log.write(json.dumps(results[file_path]) + "\n")
+                print(f"{file_path}: {e}", file=report)
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            last_report = now
+            print(f"{downloaded + failed}/{len(todo)} files, {downloaded_bytes / (now - started) / 1e6:.2f} MB/s", file=report)
+
+    pending_paths = {}
+    with open(work.done_path, "a", encoding="utf-8") as log, ThreadPoolExecutor(max_workers=workers) as pool:
+        for file_path in todo:
+            if len(pending_paths) >= max_pending:
+                done, _ = wait(set(pending_paths), return_when=FIRST_COMPLETED)
+                drain(done, log)
+            future = pool.submit(fetch_pdf, client, file_path, todo[file_path].get("pdf_sha256"))
+            pending_paths[future] = (file_path, ZIP_DIR + pdf_name(file_path))
+        drain(wait(set(pending_paths)).done, log)
+    elapsed = time.perf_counter() - started
+
+    # The PDFs go in uncompressed (ZIP_STORED); only the manifests are deflated
+    tmp_out = out + ".tmp"
+    with zipfile.ZipFile(tmp_out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for row in rows:
+            result = results.get(row.get("pdf_file_path"), {})
+            if result.get("status") == "ok":
+                zf.write(work.file_path(result["zip_path"]), result["zip_path"])
+        zf.compression = zipfile.ZIP_DEFLATED
+        write_manifests(zf, rows, results, formats)
+    os.replace(tmp_out, out)
+
+    incomplete = sum(1 for row in rows if results.get(row.get("pdf_file_path"), {}).get("status") != "ok")
+    if not incomplete:
+        work.remove()
+    return {
+        "submissions": len(rows),
+        "downloaded": downloaded,
+        "failed": failed,
+        "incomplete": incomplete,
+        "megabytes": round(downloaded_bytes / 1e6, 2),
+        "seconds": round(elapsed, 3),
+        "files_per_second": round((downloaded + failed) / elapsed, 1) if elapsed else 0.0,
+        "megabytes_per_second": round(downloaded_bytes / 1e6 / elapsed, 2) if elapsed else 0.0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export consent PDFs and a manifest into a ZIP")
+    parser.add_argument("--out", required=True, help="ZIP file to write")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="first submission date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="last submission date, inclusive")
+    parser.add_argument("--category", default=None, help="Case Category")
+    parser.add_argument("--department", default=None, help="Employee Department contains this text")
+    parser.add_argument("--mrn", default=None, help="Medical Record Number")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent downloads")
+    parser.add_argument("--max-pending", type=int, default=None, help="files in memory at once (default: 2 x workers)")
+    parser.add_argument("--manifest", choices=("csv", "parquet", "both"), default="both")
+    parser.add_argument("--restart", action="store_true", help="discard an interrupted export to --out instead of resuming it")
+    args = parser.parse_args(argv)
+
+    filters = {"mrn": args.mrn, "category": args.category, "department": args.department,
+               "start": args.since, "end": args.until}
+    formats = ("csv", "parquet") if args.manifest == "both" else (args.manifest,)
+    try:
+        stats = run_export(args.out, filters, workers=args.workers, max_pending=args.max_pending, formats=formats,
+                           restart=args.restart)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(
+        f"{stats['downloaded']} downloaded, {stats['failed']} failed of {stats['submissions']} submissions "
+        f"in {stats['seconds']}s ({stats['files_per_second']} files/s, {stats['megabytes_per_second']} MB/s)"
+    )
+    if stats["incomplete"]:
+        print(f"{stats['incomplete']} not exported; run the same command again to retry them")
+    return 1 if stats["incomplete"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
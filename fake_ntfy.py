@@ -0,0 +1,87 @@
+"""
+Local HTTP stand-in for ntfy.sh.
+
+Records every POST (title, priority and body) and keeps connections alive,
+so notifier.NtfyBackend can be pointed at it in tests and load runs.
+
+Usage:
+    with LocalNtfyServer() as server:
+        backend = NtfyBackend(server.url)
+        ...
+        server.messages  # [{"title": ..., "priority": ..., "body": ...}, ...]
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        server = self.server
+        with server.lock:
+            server.messages.append({
+                "topic": self.path.lstrip("/"),
+                "title": self.headers.get("Title"),
+                "priority": self.headers.get("Priority"),
+                "body": body,
+            })
+            server.connections.add(self.client_address)
+            status = server.status
+        payload = b'{"event":"message"}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class LocalNtfyServer:
+    def __init__(self, topic="gmeconsent", status=200):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.messages = []
+        self.httpd.connections = set()
+        self.httpd.status = status
+        self.topic = topic
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/{self.topic}"
+
+    @property
+    def messages(self):
+        with self.httpd.lock:
+            return list(self.httpd.messages)
+
+    @property
+    def connection_count(self):
+        """Distinct client connections seen (low when the session is pooled)"""
+        with self.httpd.lock:
+            return len(self.httpd.connections)
+
+    def set_status(self, status):
+        """Make subsequent requests fail (e.g. 503) or succeed again"""
+        with self.httpd.lock:
+            self.httpd.status = status
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-ntfy", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,131 @@
+"""
+Local SMTP stand-in.
+
+Speaks enough SMTP for smtplib (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET,
+NOOP, QUIT), records every message and counts connections, so
+mailer.SmtpBackend can be pointed at it in tests and load runs. It does not
+offer STARTTLS; use SmtpBackend(..., starttls=False).
+
+Usage:
+    with LocalSmtpServer() as server:
+        backend = SmtpBackend(server.host, server.port, starttls=False)
+        ...
+        server.messages  # [email.message.EmailMessage, ...]
+"""
+import email
+import email.policy
+import socketserver
+import threading
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connection_count += 1
+        self.reply("220 fake-smtp ready")
+        mail_from, rcpt_tos = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command == "HELO":
+                self.reply("250 fake-smtp")
+            elif command == "AUTH":
+                self.reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from, rcpt_tos = arg.partition(":")[2].strip().split(" ")[0].strip("<>"), []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                rcpt_tos.append(arg.partition(":")[2].strip().strip("<>"))
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                with server.lock:
+                    reply = server.replies.pop(0) if server.replies else None
+                    if reply is None:
+                        message = email.message_from_bytes(b"".join(lines), policy=email.policy.default)
+                        server.messages.append(message)
+                        server.envelopes.append((mail_from, list(rcpt_tos)))
+                self.reply(reply or "250 OK: queued")
+            elif command == "RSET":
+                mail_from, rcpt_tos = None, []
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class LocalSmtpServer:
+    def __init__(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.messages = []
+        self.server.envelopes = []
+        self.server.replies = []
+        self.server.connection_count = 0
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def messages(self):
+        with self.server.lock:
+            return list(self.server.messages)
+
+    @property
+    def envelopes(self):
+        """(MAIL FROM, [RCPT TO, ...]) of every accepted message"""
+        with self.server.lock:
+            return list(self.server.envelopes)
+
+    @property
+    def connection_count(self):
+        """Connections accepted (low when the backend reuses them)"""
+        with self.server.lock:
+            return self.server.connection_count
+
+    def fail_next(self, count=1, reply="451 Try again later"):
+        """Answer the next `count` DATA commands with reply instead of accepting them"""
+        with self.server.lock:
+            self.server.replies.extend([reply] * count)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
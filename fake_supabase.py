@@ -0,0 +1,247 @@
+"""
+In-process stand-in for the Supabase client used by main_case.py.
+
+Implements the small part of the supabase-py API the app calls (table
+select/filter/or_/order/range/insert/delete and storage upload/get_public_url/download) against
+in-memory tables and buckets. Inserted rows get a created_at timestamp, as
+the real table's column default does, and pdf_file_path is unique as the
+real table's index makes it; conflicts raise the same errors supabase-py
+does. Every network call sleeps for `latency` seconds so benchmarks and
+load tests see realistic round trips.
+
+Usage:
+    fake = FakeSupabase(latency=0.02)
+    main_case.init_supabase = lambda: fake
+"""
+import copy
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from postgrest.exceptions import APIError
+from storage3.utils import StorageException
+
+# Unique columns, as created in sql/consentsamc_results_indexes.sql
+UNIQUE = {"consentsamc_results": "pdf_file_path"}
+
+COMPARISONS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+
+def _parse_logic(text, pos=0):
+    """
+    Parse a PostgREST logic filter list ('a.eq.1,and(b.gt."x",c.lt.2)') from pos
+    Returns: tuple: (list of row predicates, position after the list)
+    """
+    predicates = []
+    while pos < len(text) and text[pos] != ")":
+        for combine, name in ((all, "and("), (any, "or(")):
+            if text.startswith(name, pos):
+                inner, pos = _parse_logic(text, pos + len(name))
+                predicates.append(lambda row, inner=inner, combine=combine: combine(p(row) for p in inner))
+                pos += 1  # the closing parenthesis
+                break
+        else:
+            column_end = text.index(".", pos)
+            operator_end = text.index(".", column_end + 1)
+            column, operator = text[pos:column_end], text[column_end + 1:operator_end]
+            pos = operator_end + 1
+            if text[pos] == '"':
+                end = pos + 1
+                value = ""
+                while text[end] != '"':
+                    if text[end] == "\\":
+                        end += 1
+                    value += text[end]
+                    end += 1
+                pos = end + 1
+            else:
+                end = pos
+                while end < len(text) and text[end] not in ",)":
+                    end += 1
+                value, pos = text[pos:end], end
+            compare = COMPARISONS[operator]
+            predicates.append(
+                lambda row, column=column, compare=compare, value=value:
+                    row.get(column) is not None and compare(str(row.get(column)), value)
+            )
+        if pos < len(text) and text[pos] == ",":
+            pos += 1
+    return predicates, pos
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.columns = None
+        self.filters = []
+        self.rows_to_insert = None
+        self.deleting = False
+        self.ordering = []
+        self.window = None
+        self.count = None
+
+    def select(self, columns="*", count=None, **kwargs):
+        if columns != "*":
+            self.columns = [c.strip().strip('"') for c in columns.split(",")]
+        self.count = count
+        return self
+
+    def filter(self, column, operator, value):
+        if operator != "eq":
+            raise NotImplementedError(f"FakeQuery.filter does not support {operator!r}")
+        return self.eq(column, value)
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def ilike(self, column, pattern):
+        # As in PostgREST, * stands for %; as in Postgres, a backslash escapes the next character
+        parts = []
+        chars = iter(pattern)
+        for c in chars:
+            if c == "\\":
+                parts.append(re.escape(next(chars, "")))
+            else:
+                parts.append(".*" if c in "%*" else "." if c == "_" else re.escape(c))
+        regex = re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+        self.filters.append(lambda row: regex.fullmatch(str(row.get(column) or "")) is not None)
+        return self
+
+    def or_(self, filters):
+        """PostgREST or=(...); values are compared as strings"""
+        predicates, _ = _parse_logic(filters)
+        self.filters.append(lambda row: any(p(row) for p in predicates))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self.ordering.append((column.strip('"'), desc))
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    def limit(self, size):
+        self.window = (0, size)
+        return self
+
+    def insert(self, rows):
+        self.rows_to_insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self):
+        self.deleting = True
+        return self
+
+    def execute(self):
+        self.client._round_trip()
+        with self.client.lock:
+            table = self.client.tables.setdefault(self.table, [])
+            if self.deleting:
+                deleted = [row for row in table if all(f(row) for f in self.filters)]
+                table[:] = [row for row in table if row not in deleted]
+                self.client.calls["delete"] += 1
+                return SimpleNamespace(data=deleted, count=None)
+            if self.rows_to_insert is not None:
+                inserted = [copy.deepcopy(row) for row in self.rows_to_insert]
+                unique = UNIQUE.get(self.table)
+                if unique:
+                    # Like Postgres, a conflicting row fails the whole insert
+                    taken = {row.get(unique) for row in table}
+                    for row in inserted:
+                        if row.get(unique) in taken:
+                            raise APIError({
+                                "code": "23505",
+                                "message": f'duplicate key value violates unique constraint "{self.table}_{unique}_key"',
+                                "details": f"Key ({unique})=({row.get(unique)}) already exists.",
+                                "hint": None,
+                            })
+                        taken.add(row.get(unique))
+                now = datetime.now(timezone.utc).isoformat(timespec="microseconds")
+                for row in inserted:
+                    row.setdefault("created_at", now)
+                table.extend(inserted)
+                self.client.calls["insert"] += 1
+                return SimpleNamespace(data=inserted, count=None)
+            rows = [row for row in table if all(f(row) for f in self.filters)]
+            self.client.calls["select"] += 1
+        # Like PostgREST, count is of every matching row and only when asked for
+        count = len(rows) if self.count else None
+        for column, desc in reversed(self.ordering):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column) or ""), reverse=desc)
+        if self.window:
+            rows = rows[self.window[0]:self.window[1]]
+        if self.columns:
+            rows = [{c: row.get(c) for c in self.columns} for row in rows]
+        return SimpleNamespace(data=copy.deepcopy(rows), count=count)
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def upload(self, file, path, file_options=None):
+        self.client._round_trip()
+        with self.client.lock:
+            objects = self.client.buckets.setdefault(self.name, {})
+            if path in objects:
+                raise StorageException({"statusCode": 409, "error": "Duplicate", "message": "The resource already exists"})
+            objects[path] = bytes(file)
+            self.client.calls["upload"] += 1
+        return SimpleNamespace(path=path, full_path=f"{self.name}/{path}")
+
+    def download(self, path):
+        self.client._round_trip()
+        with self.client.lock:
+            self.client.calls["download"] += 1
+            return self.client.buckets.get(self.name, {})[path]
+
+    def get_public_url(self, path):
+        # Computed locally by supabase-py, no round trip
+        return f"{self.client.url}/storage/v1/object/public/{self.name}/{path}"
+
+class FakeStorage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket):
+        return FakeBucket(self.client, bucket)
+
+class FakeSupabase:
+    def __init__(self, latency=0.0, url="http://fake-supabase.local"):
+        self.latency = latency
+        self.url = url
+        self.tables = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.calls = {"select": 0, "insert": 0, "delete": 0, "upload": 0, "download": 0}
+        self.storage = FakeStorage(self)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name):
+        return FakeQuery(self, name)
@@ -1,38 +1,212 @@
-import fitz  # PyMuPDF
-
-# Load the PDF
-pdf_path = "case_study_consent.pdf"
-doc = fitz.open(pdf_path)
-
-# Initialize a list to hold the results
-fields_coordinates = []
-
-# Define keywords for identifying fields
-keywords = [
-    "Patient Name:", "DOB:", "Address:", "City:", "State:", "Email:", "Phone:", "focus on","Signature of Patient", "Date", "Description of Authority", "Verbal Authority", "Name of Saint Agnes Medical"
-]
-
-# Loop through all the pages in the PDF
-for page_num in range(len(doc)):
-    page = doc[page_num]
-    
-    # Search for the keywords
-    for keyword in keywords:
-        results = page.search_for(keyword)
-        for rect in results:
-            # Adjusting the rectangle to cover the underline area (assume ~200 units for underline length)
-            underline_rect = fitz.Rect(rect.x1, rect.y0, rect.x1 + 200, rect.y1)
-            fields_coordinates.append({
-                "field": keyword,
-                "page": page_num + 1,
-                "coordinates": {
-                    "x0": underline_rect.x0,
-                    "y0": underline_rect.y0,
-                    "x1": underline_rect.x1,
-                    "y1": underline_rect.y1,
+"""
+Discover where the consent template's fields are.
+
+Each page is read with one word extraction and one drawing extraction.
+Blanks are the template's drawn rules and runs of underscores in the text.
+Each field is found from its label: either the first blank to the right of
+the label on the same line, or the rule directly above the label (for
+"Signature ... Date" style captions printed under the line).
+
+The result is a field map keyed by the template's sha256, so it only has to
+be rebuilt when the template bytes change:
+
+    {"<sha256>": {"fields": {"Patient Name": {"page": 0, "point": [x, y], "rect": [x0, y0, x1, y1]}, ...}}}
+
+Usage:
+    python get_pdf_coord.py                       # case_study_consent.pdf -> case_study_consent.fields.json
+    python get_pdf_coord.py other.pdf --out other.fields.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+
+# field -> (label text, where the blank is relative to the label)
+FIELD_ANCHORS = {
+    "Patient Name": ("Patient Name:", "right"),
+    "DOB": ("DOB:", "right"),
+    "Address": ("Address:", "right"),
+    "City": ("City:", "right"),
+    "State": ("State:", "right"),
+    "Zip Code": ("Zip:", "right"),
+    "Email": ("Email:", "right"),
+    "Phone": ("Phone:", "right"),
+    "Diagnosis Focus": ("focus on", "right"),
+    "Signature Date": ("Date", "above"),
+    "Authorized Person": ("Description of Authority", "above"),
+    "Verbal Authorization": ("Verbal Authorization Obtained:", "right"),
+    "Verbal Auth Date": ("Date", "right"),
+    "Employee Name": ("verbal authorization:", "right"),
+}
+
+# Text is written a little above the line and clear of its start
+TEXT_INSET = 3
+TEXT_LIFT = 3
+# Thickest drawn rectangle still treated as a rule
+MAX_RULE_HEIGHT = 2
+# How far below a rule its caption may start
+MAX_CAPTION_GAP = 4
+
+UNDERSCORES = re.compile(r"_{3,}")
+
+def template_hash(template_bytes):
+    return hashlib.sha256(template_bytes).hexdigest()
+
+def split_word(word):
+    """
+    Split one extracted word into label tokens and underscore blanks, e.g.
+    "on_____." -> text "on", blank, text ".". Horizontal extents are shared
+    out by character count.
+    Returns: list: (kind, text, (x0, y0, x1, y1)) with kind "text" or "blank"
+    """
+    x0, y0, x1, y1, text = word[:5]
+    per_char = (x1 - x0) / max(len(text), 1)
+    pieces, cursor = [], 0
+    for match in UNDERSCORES.finditer(text):
+        if match.start() > cursor:
+            pieces.append(("text", text[cursor:match.start()], cursor, match.start()))
+        pieces.append(("blank", match.group(), match.start(), match.end()))
+        cursor = match.end()
+    if cursor < len(text):
+        pieces.append(("text", text[cursor:], cursor, len(text)))
+    return [
+        (kind, piece, (x0 + start * per_char, y0, x0 + end * per_char, y1))
+        for kind, piece, start, end in pieces
+    ]
+
+def page_layout(page):
+    """
+    One pass over a page's words and drawings
+    Returns: tuple: (tokens, blanks). Tokens are (text, rect) label words in
+             reading order; blanks are (rect, line_y) with line_y the height
+             of the underline.
+    """
+    tokens, blanks = [], []
+    for word in page.get_text("words", sort=True):
+        for kind, text, rect in split_word(word):
+            if kind == "text":
+                tokens.append((text, rect))
+            else:
+                # The underscore glyph sits just below the baseline, about
+                # a tenth of the line height above the word's bottom
+                blanks.append((rect, rect[3] - 0.1 * (rect[3] - rect[1])))
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l" and abs(item[1].y - item[2].y) < 0.5:
+                start, end = sorted((item[1], item[2]), key=lambda p: p.x)
+                blanks.append(((start.x, start.y, end.x, end.y), start.y))
+            elif item[0] == "re" and item[1].height <= MAX_RULE_HEIGHT and item[1].width > item[1].height:
+                rect = item[1]
+                blanks.append(((rect.x0, rect.y0, rect.x1, rect.y1), (rect.y0 + rect.y1) / 2))
+    return tokens, blanks
+
+def find_labels(tokens, label):
+    """Yield the rect spanning each run of consecutive tokens that spells label"""
+    parts = label.split()
+    for i in range(len(tokens) - len(parts) + 1):
+        run = tokens[i:i + len(parts)]
+        if [text for text, _ in run] != parts:
+            continue
+        # All parts on one line
+        if max(rect[1] for _, rect in run) - min(rect[1] for _, rect in run) > 2:
+            continue
+        yield (run[0][1][0], min(r[1] for _, r in run), run[-1][1][2], max(r[3] for _, r in run))
+
+def blank_right_of(label_rect, blanks):
+    """Nearest blank that starts after the label on the same line"""
+    x0, y0, x1, y1 = label_rect
+    same_line = [
+        (rect, line_y) for rect, line_y in blanks
+        if rect[0] >= x1 - 1 and y0 <= line_y <= y1 + MAX_RULE_HEIGHT
+    ]
+    return min(same_line, key=lambda blank: blank[0][0], default=None)
+
+def rule_above(label_rect, blanks):
+    """Blank directly above the label and overlapping it horizontally"""
+    x0, y0, x1, y1 = label_rect
+    above = [
+        (rect, line_y) for rect, line_y in blanks
+        if rect[0] <= x0 + 1 and rect[2] > x0 and 0 <= y0 - line_y <= MAX_CAPTION_GAP
+    ]
+    return max(above, key=lambda blank: blank[1], default=None)
+
+def discover_fields(doc, anchors=FIELD_ANCHORS):
+    """
+    Locate every anchored field in an open document
+    Returns: dict: field -> {"page", "point", "rect"}; fields that are not found are left out
+    """
+    fields = {}
+    for page_number, page in enumerate(doc):
+        tokens, blanks = page_layout(page)
+        for field, (label, relation) in anchors.items():
+            if field in fields:
+                continue
+            locate = blank_right_of if relation == "right" else rule_above
+            for label_rect in find_labels(tokens, label):
+                blank = locate(label_rect, blanks)
+                if blank is None:
+                    continue
+                rect, line_y = blank
+                fields[field] = {
+                    "page": page_number,
+                    "point": [round(rect[0] + TEXT_INSET, 1), round(line_y - TEXT_LIFT, 1)],
+                    "rect": [round(v, 1) for v in rect],
                 }
-            })
+                break
+    return fields
+
+def build_field_map(template_bytes, anchors=FIELD_ANCHORS):
+    """Discover the fields of a template given as bytes"""
+    # Imported here so loading a saved map doesn't pay for PyMuPDF
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=template_bytes, filetype="pdf") as doc:
+        return {"fields": discover_fields(doc, anchors)}
+
+def load_field_map(template_bytes, map_path, anchors=FIELD_ANCHORS):
+    """
+    Field map for these template bytes, read from map_path when it has an
+    entry for the template's hash and discovered (and saved) otherwise.
+    Saving is best effort, so a read-only deployment still works.
+    """
+    key = template_hash(template_bytes)
+    maps = {}
+    try:
+        with open(map_path, encoding="utf-8") as f:
+            maps = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if key in maps:
+        return maps[key]
+
+    maps[key] = build_field_map(template_bytes, anchors)
+    try:
+        tmp_path = f"{map_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(maps, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, map_path)
+    except OSError:
+        pass
+    return maps[key]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discover the consent template's field positions")
+    parser.add_argument("template", nargs="?", default="case_study_consent.pdf")
+    parser.add_argument("--out", default=None, help="field map JSON (default: <template>.fields.json)")
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.splitext(args.template)[0] + ".fields.json"
+    with open(args.template, "rb") as f:
+        template_bytes = f.read()
+    field_map = load_field_map(template_bytes, out)
+    for field, entry in field_map["fields"].items():
+        print(f"Field: {field}, Page: {entry['page'] + 1}, Point: {entry['point']}, Blank: {entry['rect']}")
+    missing = sorted(set(FIELD_ANCHORS) - set(field_map["fields"]))
+    if missing:
+        print(f"Not found: {', '.join(missing)}")
+    print(f"Field map for {template_hash(template_bytes)[:12]} in {out}")
+    return 1 if missing else 0
 
-# Print the results
-for field in fields_coordinates:
-    print(f"Field: {field['field']}, Page: {field['page']}, Coordinates: {field['coordinates']}")
\ No newline at end of file
+if __name__ == "__main__":
+    raise SystemExit(main())
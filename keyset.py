@@ -0,0 +1,35 @@
+"""
+Keyset paging over PostgREST.
+
+OFFSET paging makes Postgres walk past every skipped row, so page N costs N
+pages of work. Keyset paging asks instead for the rows after the last row
+of the previous page in the sort order, which an index on the sort columns
+answers with one range scan whatever the page. The sort has to be unique;
+consentsamc_results is sorted by created_at with the (unique)
+pdf_file_path as tie-breaker.
+
+Usage:
+    order = (("created_at", True), ("pdf_file_path", True))
+    query = table.select("*").order("created_at", desc=True).order("pdf_file_path", desc=True).limit(50)
+    if last_row:
+        query = query.or_(after(last_row, order))
+"""
+
+def quote(value):
+    """A PostgREST filter value, double-quoted so commas, dots and parentheses are literal"""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+def after(row, order):
+    """
+    PostgREST or= filter for the rows that come after row
+    Args: row (dict): the last row already seen; must have every sort column
+          order (tuple): (column, descending) pairs, most significant first
+    Returns: str: e.g. 'created_at.lt."t",and(created_at.eq."t",pdf_file_path.lt."p")'
+    """
+    conditions = []
+    for i, (column, desc) in enumerate(order):
+        equal = [f"{c}.eq.{quote(row[c])}" for c, _ in order[:i]]
+        compare = f"{column}.{'lt' if desc else 'gt'}.{quote(row[column])}"
+        conditions.append(f"and({','.join(equal + [compare])})" if equal else compare)
+    return ",".join(conditions)
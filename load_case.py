@@ -0,0 +1,297 @@
+"""
+Concurrent-session load harness for the consent form.
+
+Drives N simultaneous Streamlit sessions through main() with AppTest. Each
+session fills in the form, submits it and checks its own result. Supabase is
+replaced by FakeSupabase with injected latency, ntfy by LocalNtfyServer and
+the SMTP server for patient copies by LocalSmtpServer.
+
+Reports p50/p95/p99 submit latency and throughput, and per-stage timings
+from metrics.REGISTRY (quantiles are histogram bucket bounds). It also checks for
+cross-session interference: every session must be offered its own PDF for
+download and every stored row must point at the PDF rendered for it.
+
+Usage:
+    python load_case.py --sessions 20 --submits 5 --latency-ms 50
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main_case.py")
+
+FORM_VALUES = {
+    "first_name": "Jane",
+    "last_name": "Doe",
+    "email": "jane.doe@example.com",
+    "phone": "559-555-0100",
+    "address": "1303 E Herndon Ave",
+    "city": "Fresno",
+    "zipcode": "93720",
+    "employee_first_name": "Phillip",
+    "employee_last_name": "Kim",
+    "employee_email": "phillip.kim@samc.com",
+    "employee_department": "Internal Medicine",
+    "case_study_diagnosis": "Takotsubo cardiomyopathy",
+}
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def download_names(at):
+    """File names of every st.download_button on the page (see install_shared_runtime)"""
+    from streamlit.runtime import Runtime
+
+    names = Runtime.instance().media_file_mgr._storage.names
+    return [names.get(element.proto.url.rsplit("/", 1)[-1].split(".", 1)[0]) for element in at.get("download_button")]
+
+def fill_and_submit(at, mrn, last_name, dob=datetime.date(1980, 1, 2)):
+    """Fill the form for one patient and press Submit; returns seconds taken"""
+    for key, value in FORM_VALUES.items():
+        at.text_input(key=key).input(value)
+    # A distinct email and phone per MRN, so the similar-patient check
+    # doesn't (rightly) flag the load patients as one person
+    at.text_input(key="email").input(f"patient.{mrn}@example.com")
+    at.text_input(key="phone").input(f"559-{mrn[-7:-4]}-{mrn[-4:]}")
+    at.text_input(key="last_name").input(last_name)
+    at.text_input(key="mrn").input(mrn)
+    at.date_input(key="dob").set_value(dob)
+    at.selectbox(key="state").select("CA")
+    at.selectbox(key="case_category").select("Cardiology")
+    at.checkbox(key="verbal_authorization").check()
+    submit = next(button for button in at.button if button.label == "Submit")
+    start = time.perf_counter()
+    submit.click().run()
+    return time.perf_counter() - start
+
+def install_shared_runtime(secrets):
+    """
+    Install one mock Streamlit runtime, the app secrets and the AppTest config
+    flag for the whole process. Stock AppTest sets these up and tears them
+    down around every run, so runs from different threads break each other.
+    """
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.secrets import Secrets
+
+    class NamedMediaFileStorage(MemoryMediaFileStorage):
+        # AppTest gives every session the same session id, so one session's
+        # rerun can delete another's media files; keep their names for checks
+        def __init__(self, endpoint):
+            super().__init__(endpoint)
+            self.names = {}
+
+        def load_and_get_id(self, path_or_data, mimetype, kind, filename=None):
+            file_id = super().load_and_get_id(path_or_data, mimetype, kind, filename)
+            self.names[file_id] = filename
+            return file_id
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(NamedMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+    shared_secrets = Secrets()
+    shared_secrets._secrets = dict(secrets)
+    st.secrets = shared_secrets
+    config.set_option("global.appTest", True)
+
+def concurrent_app_test():
+    """
+    AppTest subclass whose runs can overlap across threads, relying on
+    install_shared_runtime() instead of per-run setup (streamlit 1.41 internals)
+    """
+    from urllib import parse
+
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    # One cache for every session, as in a real server. Each stock runner
+    # compiles the script itself, and concurrent compiles can fail on
+    # CPython 3.11 ("AST constructor recursion depth mismatch").
+    script_cache = ScriptCache()
+
+    class ConcurrentAppTest(AppTest):
+        def _run(self, widget_state=None, timeout=None):
+            if timeout is None:
+                timeout = self.default_timeout
+            pages_manager = PagesManager(self._script_path, setup_watcher=False)
+            script_runner = LocalScriptRunner(
+                self._script_path, self.session_state, pages_manager, args=self.args, kwargs=self.kwargs
+            )
+            script_runner._script_cache = script_cache
+            self._tree = script_runner.run(widget_state, self.query_params, timeout, self._page_hash)
+            self._tree._runner = self
+            query_string = script_runner.event_data[-1]["client_state"].query_string
+            self.query_params = parse.parse_qs(query_string)
+            return self
+
+    return ConcurrentAppTest
+
+def run_session(app_test_class, session_id, submits, results, timeout):
+    # from_file() always builds a plain AppTest, so construct the subclass directly
+    at = app_test_class(APP_PATH, default_timeout=timeout)
+    at.run()
+    for n in range(submits):
+        mrn = f"{session_id:04d}{n:04d}"
+        # Last name carries the session so the stored PDF path identifies it
+        last_name = f"Load-{'abcdefghij'[session_id % 10]}{'abcdefghij'[n % 10]}"
+        try:
+            dob = datetime.date(1940, 1, 1) + datetime.timedelta(days=session_id * 100 + n)
+            elapsed = fill_and_submit(at, mrn, last_name, dob)
+        except Exception as e:
+            with results["lock"]:
+                results["errors"].append(f"session {session_id} submit {n}: {e!r}")
+            continue
+        successes = [s.value for s in at.success]
+        names = download_names(at)
+        with results["lock"]:
+            results["latencies"].append(elapsed)
+            if at.exception:
+                results["errors"].append(f"session {session_id} submit {n}: {at.exception[0].value}")
+            elif "Form submitted successfully!" not in successes:
+                results["errors"].append(f"session {session_id} submit {n}: no confirmation ({[e.value for e in at.error]})")
+            elif not any(f"_{mrn}_" in name for name in names):
+                results["interference"].append(f"session {session_id} MRN {mrn} was offered {names}")
+            results["expected"][mrn] = last_name
+        # The browser reruns once more after a confirmation, which clears the
+        # form and resets success_message; do the same before the next patient
+        at.run()
+
+def check_emails(messages, expected):
+    """Every patient must get exactly one copy, with their own PDF attached"""
+    problems = []
+    sent = {}
+    for message in messages:
+        sent.setdefault(message["To"], []).append(message)
+    for mrn, last_name in expected.items():
+        copies = sent.get(f"patient.{mrn}@example.com", [])
+        if len(copies) != 1:
+            problems.append(f"MRN {mrn} was emailed {len(copies)} copies")
+            continue
+        attachments = [part.get_filename() for part in copies[0].iter_attachments()]
+        if not any(name.startswith(f"{last_name}_Jane_{mrn}_") for name in attachments):
+            problems.append(f"email for MRN {mrn} has attachments {attachments}")
+    return problems
+
+def check_storage(fake, expected):
+    """Every row must belong to a submitted MRN and point at that patient's PDF"""
+    problems = []
+    rows = fake.tables.get("consentsamc_results", [])
+    objects = fake.buckets.get("completed_consent", {})
+    seen = {}
+    for row in rows:
+        mrn, path = row.get("Medical Record Number"), row.get("pdf_file_path", "")
+        seen[mrn] = seen.get(mrn, 0) + 1
+        if mrn not in expected:
+            problems.append(f"unexpected row for MRN {mrn}")
+        elif f"{expected[mrn]}_Jane_{mrn}_" not in path:
+            problems.append(f"row for MRN {mrn} points at {path}")
+        elif path not in objects:
+            problems.append(f"row for MRN {mrn} has no uploaded PDF {path}")
+    for mrn in expected:
+        if seen.get(mrn, 0) != 1:
+            problems.append(f"MRN {mrn} stored {seen.get(mrn, 0)} times")
+    return problems
+
+def notified_count(messages):
+    """Submissions announced, counting each coalesced digest by its title"""
+    total = 0
+    for message in messages:
+        count = (message["title"] or "").split(" ", 1)[0]
+        total += int(count) if count.isdigit() else 1
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the consent form with concurrent sessions")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--submits", type=int, default=3, help="submissions per session")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="fake Supabase round-trip latency")
+    parser.add_argument("--timeout", type=float, default=60.0, help="AppTest script run timeout in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for the outbox to drain")
+    args = parser.parse_args(argv)
+
+    # Point the app at local stand-ins before it is first imported by AppTest
+    os.environ["CONSENT_OUTBOX_DIR"] = tempfile.mkdtemp(prefix="load-outbox-")
+    from fake_ntfy import LocalNtfyServer
+    from fake_smtp import LocalSmtpServer
+    from fake_supabase import FakeSupabase
+    import supabase
+
+    fake = FakeSupabase(latency=args.latency_ms / 1000)
+    supabase.create_client = lambda url, key: fake
+    ntfy = LocalNtfyServer().start()
+    os.environ["CONSENT_NTFY_URL"] = ntfy.url
+    smtp = LocalSmtpServer().start()
+    os.environ.update({"CONSENT_SMTP_HOST": smtp.host, "CONSENT_SMTP_PORT": str(smtp.port), "CONSENT_SMTP_STARTTLS": "0"})
+    install_shared_runtime({"SUPABASE_URL": fake.url, "SERVICE_ROW": "load-test-key"})
+    app_test_class = concurrent_app_test()
+
+    results = {"lock": threading.Lock(), "latencies": [], "errors": [], "interference": [], "expected": {}}
+    threads = [
+        threading.Thread(target=run_session, args=(app_test_class, i, args.submits, results, args.timeout))
+        for i in range(args.sessions)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    # Let the outbox and the coalescing notifier deliver everything, then
+    # check what actually landed
+    expected = len(results["expected"])
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        if len(fake.tables.get("consentsamc_results", [])) >= expected and notified_count(ntfy.messages) >= expected \
+                and len(smtp.messages) >= expected:
+            break
+        time.sleep(0.2)
+    storage_problems = check_storage(fake, results["expected"]) + check_emails(smtp.messages, results["expected"])
+    ntfy.stop()
+    smtp.stop()
+    if notified_count(ntfy.messages) != expected:
+        storage_problems.append(f"ntfy announced {notified_count(ntfy.messages)} of {expected} submissions")
+
+    latencies = [s * 1000 for s in results["latencies"]]
+    print(f"sessions {args.sessions}, submits {len(latencies)}, fake latency {args.latency_ms:g} ms")
+    if latencies:
+        print(
+            f"submit latency  p50 {percentile(latencies, 50):.1f} ms  p95 {percentile(latencies, 95):.1f} ms  "
+            f"p99 {percentile(latencies, 99):.1f} ms  mean {statistics.mean(latencies):.1f} ms"
+        )
+        print(f"throughput      {len(latencies) / wall:.2f} submits/s over {wall:.1f} s")
+    print(f"supabase calls  {fake.calls}")
+    import metrics
+
+    for stage, s in metrics.REGISTRY.snapshot().items():
+        print(f"  {stage:<22} n {s['count']:>5}  mean {s['mean_ms']:>8.2f} ms  p95 <= {s['p95_ms']:g} ms  errors {s['errors']}")
+    messages = ntfy.messages
+    print(f"ntfy messages   {len(messages)} covering {notified_count(messages)} submissions")
+    print(f"patient emails  {len(smtp.messages)} over {smtp.connection_count} SMTP connections")
+    for line in results["errors"]:
+        print(f"ERROR {line}")
+    for line in results["interference"] + storage_problems:
+        print(f"INTERFERENCE {line}")
+    return 1 if results["errors"] or results["interference"] or storage_problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
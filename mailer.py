@@ -0,0 +1,224 @@
+"""
+Background email delivery for patient copies of the consent form.
+
+Messages are queued with Mailer.submit(), which returns at once, and sent by
+a small pool of worker threads. The queue is bounded: when it is full the
+message is dropped and logged rather than holding up a submission. Each
+send is retried with exponential backoff on connection errors and 4xx
+replies; 5xx replies (e.g. an unknown recipient) are not retried.
+
+SmtpBackend keeps up to `pool_size` logged-in SMTP connections open between
+messages and reuses them, reconnecting when the server has dropped one.
+
+Any object with send(message) taking an email.message.EmailMessage can be
+used as a backend; fake_smtp.LocalSmtpServer is a local SMTP stand-in for
+tests.
+
+Usage:
+    mailer = Mailer(SmtpBackend("smtp.example.org", 587, "user", "password"), sender="no-reply@example.org")
+    mailer.submit("patient@example.com", "Subject", "Body", attachments=[("form.pdf", pdf_bytes, "application/pdf")])
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class SmtpBackend:
+    def __init__(self, host, port=587, username=None, password=None, starttls=True,
+                 timeout=10, pool_size=2, idle_timeout=60.0):
+        """
+        Args: starttls (bool): upgrade the connection with STARTTLS before logging in
+              pool_size (int): idle connections kept open for reuse
+              idle_timeout (float): seconds an idle connection is reused for;
+                                    servers drop idle clients after a few minutes
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (connection, time it was returned)
+        self._lock = threading.Lock()
+        self.stats = {"connects": 0, "reused": 0}
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.ehlo()
+            if self.starttls:
+                connection.starttls()
+                connection.ehlo()
+            if self.username:
+                connection.login(self.username, self.password)
+        except Exception:
+            connection.close()
+            raise
+        with self._lock:
+            self.stats["connects"] += 1
+        return connection
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                connection, returned = self._idle.pop()
+                if now - returned < self.idle_timeout:
+                    self.stats["reused"] += 1
+                    return connection
+                connection.close()
+        return self._connect()
+
+    def _checkin(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self._quit(connection)
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+    def send(self, message):
+        connection = self._checkout()
+        try:
+            connection.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # A pooled connection the server has closed; one fresh attempt
+            connection.close()
+            connection = self._connect()
+            try:
+                connection.send_message(message)
+            except Exception:
+                connection.close()
+                raise
+        except smtplib.SMTPResponseException:
+            # The server refused this message; the connection is still usable
+            self._checkin(connection)
+            raise
+        except Exception:
+            connection.close()
+            raise
+        self._checkin(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._quit(connection)
+
+def _transient(error):
+    """Worth retrying: connection problems and 4xx replies, not 5xx rejections"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (OSError, smtplib.SMTPException))
+
+class Mailer:
+    def __init__(self, backend, sender, workers=2, max_queue=100, attempts=4, max_backoff=60.0):
+        """
+        Args: backend: object with send(EmailMessage)
+              sender (str): From address
+              workers (int): messages sent concurrently
+              max_queue (int): messages waiting to be sent (each holds its attachments)
+              attempts (int): tries per message, with exponential backoff in between
+        """
+        self.backend = backend
+        self.sender = sender
+        self.workers = workers
+        self.attempts = attempts
+        self.max_backoff = max_backoff
+        self.stats = {"submitted": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, to, subject, body, attachments=()):
+        """
+        Queue one message; never blocks on the network. The message itself is
+        built on a worker thread.
+        Args: attachments: (filename, bytes, content type) tuples
+        Returns: bool: False if the queue was full and the message was dropped
+        """
+        try:
+            self._queue.put_nowait((to, subject, body, tuple(attachments)))
+        except queue.Full:
+            logger.warning("Mail queue full, dropped message to %s", to)
+            with self._lock:
+                self.stats["dropped"] += 1
+            return False
+        with self._lock:
+            self.stats["submitted"] += 1
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"mailer-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return True
+
+    def build(self, to, subject, body, attachments=()):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+        for filename, data, content_type in attachments:
+            maintype, subtype = content_type.split("/", 1)
+            message.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+        return message
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._send(item)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, item):
+        # Imported here so the app can start before tenacity is loaded
+        from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential
+
+        to = item[0]
+        try:
+            message = self.build(*item)
+            for attempt in Retrying(
+                stop=stop_after_attempt(self.attempts),
+                wait=wait_exponential(multiplier=1, max=self.max_backoff),
+                retry=retry_if_exception(_transient),
+                reraise=True,
+            ):
+                if attempt.retry_state.attempt_number > 1:
+                    with self._lock:
+                        self.stats["retried"] += 1
+                with attempt, metrics.span("smtp_send"):
+                    self.backend.send(message)
+        except Exception as e:
+            logger.warning("Email to %s failed: %s", to, e)
+            with self._lock:
+                self.stats["failed"] += 1
+            return
+        with self._lock:
+            self.stats["sent"] += 1
+
+    def flush(self, timeout=None):
+        """Wait until every queued message is sent or has failed; returns False on timeout"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.01)
+        return True
@@ -1,20 +1,35 @@
 import streamlit as st
 import re
 from datetime import datetime, date, timedelta
-from streamlit_drawable_canvas import st_canvas
-from supabase import create_client, Client
-import requests
+import streamlit_drawable_canvas
 import numpy as np
 import PIL.Image as Image
 import io
 import os
-import fitz # PYMuPDF
 import base64
-import uuid
+import json
+import metrics
+from outbox import Outbox
+from duplicate_check import DuplicateChecker
+from notifier import Notifier, NtfyBackend
+from mailer import Mailer, SmtpBackend
+from get_pdf_coord import load_field_map, template_hash
+from overlay import (build_overlay, decode_overlay, encode_overlay, is_overlay_path,
+                     overlay_path, overlay_submission, pdf_name, template_path)
+import threading
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
+from types import SimpleNamespace
 
 today = date.today()
 today_str = today.strftime("%m/%d/%Y")
 
+logger = logging.getLogger(__name__)
+
 # List of US States Abbreviations
 STATES = [
     'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 
@@ -57,46 +72,187 @@ def init_supabase():
     """
     Initialize Supbase Client using Streamlit
     """
+    # Imported here: supabase is slow to import and only needed to submit
+    from supabase import create_client
+
     url = st.secrets["SUPABASE_URL"]
     key = st.secrets["SERVICE_ROW"]
-    supbase: Client = create_client(url, key)
+    supbase = create_client(url, key)
     return supbase
 
-# get global file path 
-path_context = {}
+# Process-wide objects are created through st.cache_resource: this file is
+# the Streamlit entry script, so module-level objects are rebuilt on every rerun.
+@st.cache_resource
+def init_io_pool():
+    """Bounded pool for post-submit network I/O, shared by all sessions"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="consent-io")
+
+# Per-call timeouts in seconds
+DUPLICATE_CHECK_TIMEOUT = 5
+NTFY_TIMEOUT = 5
+
+# How long the warmed MRN index may rule out duplicates without asking Supabase
+MRN_INDEX_TTL = 60
+
+@st.cache_resource
+def init_duplicate_checker():
+    """
+    MRN duplicate check with an in-process index of known MRNs,
+    warmed in the background
+    """
+    checker = DuplicateChecker(lambda: init_supabase(), ttl=MRN_INDEX_TTL, executor=init_io_pool())
+    checker.refresh_in_background()
+    return checker
+
+# Local outbox (SQLite + PDF spool) that submissions are written to before confirming
+OUTBOX_DIR = os.environ.get("CONSENT_OUTBOX_DIR", ".outbox")
+# "pdf" stores every rendered PDF; "overlay" stores only the field values,
+# signature and template version, and rebuilds the PDF when it is viewed
+STORAGE_MODE = os.environ.get("CONSENT_STORAGE_MODE", "pdf")
+
+@st.cache_resource
+def init_outbox():
+    """
+    Open the local outbox and start its background drainer, which uploads
+    PDFs and batch-inserts rows into Supabase with retry and backoff.
+    Uploads run on the outbox's own small pool, so a backlog of retried
+    uploads can't starve the duplicate lookups on init_io_pool.
+    """
+    return Outbox(OUTBOX_DIR, lambda: init_supabase()).start()
+
+# Per-stage timings (see metrics.py): served for Prometheus at
+# http://<host>:CONSENT_METRICS_PORT/metrics and/or written to CONSENT_METRICS_FILE
+METRICS_PORT = os.environ.get("CONSENT_METRICS_PORT")
+METRICS_FILE = os.environ.get("CONSENT_METRICS_FILE")
+
+@st.cache_resource
+def init_metrics():
+    """Start the metrics endpoint and file writer once per process, if configured"""
+    if METRICS_PORT:
+        metrics.start_http_server(int(METRICS_PORT))
+    if METRICS_FILE:
+        metrics.start_file_writer(METRICS_FILE)
+    return metrics.REGISTRY
+
+@dataclass
+class SubmissionResult:
+    """
+    Outcome of one submission attempt. Carries the rendered PDF and its storage
+    path so the rest of the flow never has to render it again.
+    """
+    success: bool
+    message: str
+    existing_records: list = None
+    similar_records: list = None
+    pdf_bytes: bytes = None
+    pdf_sha256: str = None
+    file_path: str = None
+    note: str = None  # shown with the outcome, e.g. when a duplicate check was skipped
+
+class SubmissionMemo:
+    """
+    Accepted submissions by idempotency key, shared by all sessions. A key
+    found here has already been rendered and queued in the outbox, so
+    submitting it again returns the stored result with no network work.
+    Keeps the `size` most recent outcomes: success, message and file path
+    only. The PDF is served from the outbox spool (or storage) on a replay.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        result = SubmissionResult(result.success, result.message, file_path=result.file_path)
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+@st.cache_resource
+def init_submission_memo():
+    return SubmissionMemo()
+
 # UPLOAD PDF and DATA to Supbase
+@metrics.timed("submit")
 def upload_and_submit_to_supabase(submitted_data, force_upload=False):
     """
     Unified function to upload PDF and submit data to Supabase with duplicate prevention
         Args: submitted_data (dict): Dictionary containing all form submission data
         force_upload (bool): If True, bypasses duplicate check and forces upload
 
-        Returns: tuple: (success_flag, message)
+        Returns: SubmissionResult
     """
     try:
+        # The same submission (a rerun, a double click) is only ever queued once
+        key = submission_key(submitted_data)
+        accepted = init_submission_memo().get(key)
+        if accepted is not None:
+            return accepted
+
         # Initialize Supabase client
         supabase = init_supabase()
         
-        # Generate unique identifiers
-        first_name = submitted_data.get('First Name', 'Unknown')
-        last_name = submitted_data.get('Last Name', 'Unnamed')
         mrn = submitted_data.get('Medical Record Number', 'NoMRN')
-        unique_id = str(uuid.uuid4())[:8]
         
-        # Check for existing records to prevent duplicates
-        existing_records = supabase.table("consentsamc_results").select("*").filter(
-            "Medical Record Number", "eq", mrn
-        ).execute()
+        outbox = init_outbox()
+
+        # Check for existing records to prevent duplicates, including ones
+        # still waiting in the outbox. If Supabase can't answer in time the
+        # submission is still accepted rather than lost. The same patient
+        # under another MRN (e.g. a typo) is looked up at the same time.
+        existing_records = SimpleNamespace(data=[])
+        similar_records = []
+        skipped = []
+        duplicate_checker = init_duplicate_checker()
+        if not force_upload:
+            lookup = init_io_pool().submit(duplicate_checker.find, mrn)
+            similar_lookup = init_io_pool().submit(duplicate_checker.find_similar, submitted_data, outbox.pending_rows)
+            try:
+                with metrics.span("duplicate_check"):
+                    existing_records.data = lookup.result(timeout=DUPLICATE_CHECK_TIMEOUT)
+            except Exception as e:
+                logger.warning("Duplicate check for MRN %s skipped: %s", mrn, e)
+                skipped.append("earlier submissions with this MRN")
+            try:
+                with metrics.span("similar_check"):
+                    similar_records = similar_lookup.result(timeout=DUPLICATE_CHECK_TIMEOUT)
+            except Exception as e:
+                logger.warning("Similar patient check for MRN %s skipped: %s", mrn, e)
+                skipped.append("the same patient under a different MRN")
+            # A row being drained right now can be in both places
+            seen = {record.get('pdf_file_path') for record in existing_records.data}
+            existing_records.data = existing_records.data + [
+                record for record in outbox.pending_rows(mrn) if record.get('pdf_file_path') not in seen
+            ]
+        note = None
+        if skipped:
+            note = (f"The database lookup failed or timed out, so this submission was not checked for "
+                    f"{' or '.join(skipped)}. Please check for an earlier submission before relying on it.")
         
-        if existing_records.data and len(existing_records.data) > 0 and not force_upload:
+        if (existing_records.data or similar_records) and not force_upload:
             
             # can insert a popup with existing data of the contact person if matching data exist later
             #return False, f"Record for MRN {mrn} already exists"
-            warning_message = f"""
+            if existing_records.data:
+                warning_message = f"""
                 **This case has already been submitted by the following SAMC employee(s).  Please coordinate further.**\n
                 Patient MRN: {mrn}
                 Previous Submission:
                 """
+            else:
+                warning_message = f"""
+                **This patient may have already been submitted under a different MRN.  Please check the MRN and coordinate further.**\n
+                Patient MRN: {mrn}
+                """
             # Helper function to get the submission date and type
             def get_submission_date_info(record):
                 signature_date = record.get('Signature Date')
@@ -125,147 +281,258 @@ def upload_and_submit_to_supabase(submitted_data, force_upload=False):
                 - Case Category: {record.get('Case Category', '')}
                 - Date Submitted: {submission_date}({auth_type} Authorization)
                 """
-            return True, warning_message, sorted_records
-        
-        # Generate PDF
-        pdf_bytes = create_pdf(**submitted_data)
-        
-        if not pdf_bytes:
-            return False, "Failed to generate PDF"
+
+            # Scored matches on last name sound + DOB, email and phone, best first
+            if similar_records:
+                warning_message += """
+                Possible matches under a different MRN:
+                """
+            for i, record in enumerate(similar_records, 1):
+                submission_date, auth_type = get_submission_date_info(record)
+                warning_message += f"""
+                Possible Match {i} ({record['match_score']:.0%}: {', '.join(record['match_reasons'])}):
+                - Patient MRN: {record.get('Medical Record Number', '')}
+                - Submitted by: {record.get('Employee First Name', '')} {record.get('Employee Last Name', '')}
+                - Dept: {record.get('Employee Department', '')}
+                - Case Category: {record.get('Case Category', '')}
+                - Date Submitted: {submission_date}({auth_type} Authorization)
+                """
+            return SubmissionResult(True, warning_message, existing_records=sorted_records,
+                                    similar_records=similar_records, note=note)
         
         # Create filename for PDF
-        filename = f"{last_name}_{first_name}_{mrn}_{unique_id}.pdf"
+        filename = pdf_filename(submitted_data, key)
         file_path = f"case_pdf_received/{filename}"
-        path_context["file_path"] = file_path
-        # Upload PDF to Supabase storage
-        pdf_upload = supabase.storage.from_('completed_consent').upload(
-            file=pdf_bytes,
-            path=file_path,
-            file_options={"content-type": "application/pdf"}
-        )
+
+        # Generate PDF. Overlays are rendered from the stored overlay itself,
+        # exactly as a later rebuild will be
+        if STORAGE_MODE == "overlay":
+            file_path = overlay_path(file_path)
+            with metrics.span("overlay_encode"):
+                stored_bytes = encode_overlay(submission_overlay(submitted_data))
+            pdf_bytes = render_overlay(stored_bytes)
+        else:
+            pdf_bytes = stored_bytes = create_pdf(**submitted_data)
         
+        if not pdf_bytes:
+            return SubmissionResult(False, "Failed to generate PDF")
+        # Hash what is stored, not the rendering: a rebuilt overlay's bytes
+        # change whenever PyMuPDF, the field map or the plan do
+        pdf_sha256 = hashlib.sha256(stored_bytes).hexdigest()
         # Create a copy of submitted data without signature and PDF path
         database_data = submitted_data.copy()
         database_data.pop('Signature', None)  # Remove signature data
+        database_data.pop('Signature Strokes', None)
         
-        # ADD the PDF file path to the database data
+        # ADD the PDF file path and the stored file's hash to the database data
         database_data['pdf_file_path'] = file_path
+        database_data['pdf_sha256'] = pdf_sha256
             
-        # Insert data into Supabase
-        supabase.table("consentsamc_results").insert(database_data).execute()
+        # Record locally; the outbox drainer uploads the PDF and inserts the row
+        with metrics.span("outbox_enqueue"):
+            queued = outbox.enqueue(file_path, database_data, stored_bytes)
+        duplicate_checker.add(mrn, database_data)
+        # The patient's copy goes out in the background, once per stored submission
+        if queued:
+            send_patient_copy(pdf_bytes, file_path, **submitted_data)
     
-        return True, "Data successfully submitted!", None
+        result = SubmissionResult(
+            True, "Data successfully submitted!",
+            pdf_bytes=pdf_bytes,
+            pdf_sha256=pdf_sha256,
+            file_path=file_path,
+            note=note,
+        )
+        init_submission_memo().put(key, result)
+        return result
     
     except Exception as e:
-        return False, f"Unexpected error: {e}", None
+        return SubmissionResult(False, f"Unexpected error: {e}")
+
+def submit_once(submitted_data, force_upload=False):
+    """
+    upload_and_submit_to_supabase, memoized in the session by idempotency
+    key. Every rerun while submitted_data is pending (including the ones
+    around the duplicate warning's buttons) reuses the outcome instead of
+    querying Supabase again. Failures are not kept, so the next run retries.
+        Returns: SubmissionResult
+    """
+    key = (submission_key(submitted_data), force_upload)
+    outcome = st.session_state.get('submission_outcome')
+    if outcome is not None and outcome[0] == key:
+        return outcome[1]
+    result = upload_and_submit_to_supabase(submitted_data, force_upload=force_upload)
+    if result.success:
+        st.session_state.submission_outcome = (key, result)
+    return result
 
 ##### FUNCTION TO GET PDF URL FROM SUPABASE ######
-def get_public_url():
+def get_public_url(file_path):
     """
     Get the public URL for a file in Supabase storage.Args:
-        supabase: Supabase client instance
         file_path: Path of the file in Supabase storage
     Returns:
         str: Public URL of the file"""
     supabase = init_supabase()
     try:
         # Get the public URL for the file
-        public_url = supabase.storage.from_('completed_consent').get_public_url(path_context["file_path"])
+        public_url = supabase.storage.from_('completed_consent').get_public_url(file_path)
         return public_url
     except Exception as e:
         st.error(f"Error getting PDF URL: {e}")
         return None
 ####################### VALIDATION FUNCTIONS #############################
 
-# Name validation function
-def validate_name(name, field_name="Name"):
-    if not name:
-        return False, f"{field_name} is required"
-    
-    if field_name == "Case Study Diagnosis":
-        # Allow letters, numbers, spaces, hyphens, and periods
-        # if not re.match(r'^[A-Za-z0-9\s.-]+$', name):
-        #     return False, f"{field_name} should only contain letters, numbers, spaces, periods, and hyphens"
-        if len(name) > 50:
-            return False, f"{field_name} should be less than 50 characters long"
-        return True, ""
-    
-    # Original validation for other name fields
-    if not re.match(r'^[A-Za-z\s-]+$', name):
-        return False, f"{field_name} should only contain letters, spaces, and hyphens"
-    if len(name) < 2:
-        return False, f"{field_name} should be at least 2 characters long"
-    
-    return True, ""
+# Form fields are validated from a declarative schema: each field lists its
+# checks in order and the first one that fails gives the field's message.
+# Patterns are compiled once here and shared by the single-submission and
+# bulk (DataFrame) paths.
+@dataclass(frozen=True)
+class Check:
+    kind: str      # "required", "pattern", "min_length", "max_length", "choices", "date" or "not_future"
+    arg: object
+    message: str
 
-# Email validation function
-def validate_email(email, field_name="Email"):
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    samc_pattern = re.compile(r'^[a-zA-Z0-9._%+-]+@samc\.com$', re.IGNORECASE)
-    if field_name == "Email":
-        if not re.match(pattern, email):
-            return False, f"Please enter a valid {field_name} address"
-    else:
-        if not re.match(samc_pattern, email):
-            return False, f"Please enter a valid {field_name} address"
-    
-    return True, ""
+    def fails(self, value):
+        if self.kind == "required":
+            return not value
+        if self.kind == "pattern":
+            return self.arg.fullmatch(str(value)) is None
+        if self.kind == "min_length":
+            return len(value) < self.arg
+        if self.kind == "max_length":
+            return len(value) > self.arg
+        if self.kind == "choices":
+            return value not in self.arg
+        if self.kind == "date":
+            return parse_date(value, self.arg) is None
+        if self.kind == "not_future":
+            parsed = parse_date(value, self.arg)
+            return parsed is not None and parsed > date.today()
+        raise ValueError(f"Unknown check kind {self.kind!r}")
 
-# Phone number validation function
-def validate_phone(phone):
-    pattern = r'^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$'
-    if not re.match(pattern, phone):
-        return False, "Please enter a valid phone number"
-    return True, ""
+def parse_date(value, fmt):
+    """date for a date picker value or a string in fmt, or None if it isn't one"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value), fmt).date()
+    except ValueError:
+        return None
 
-# Address validation function
-def validate_address(address):
-    if not address:
-        return False, "Address is required"
-    if len(address) < 5:
-        return False, "Please enter a valid address"
-    return True, ""
+def required(message):
+    return Check("required", None, message)
 
-# City validation function
-def validate_city(city):
-    if not city:
-        return False, "City is required"
-    pattern_city = r'^[A-Za-z]+(?:[ -][A-Za-z]+)*$'
-    if not re.match(pattern_city, city):
-        return False, "City should only contain letters, spaces, and hyphens"
-    return True, ""
+def matches(pattern, message, flags=0):
+    return Check("pattern", re.compile(pattern, flags), message)
 
-# State validation function
-def validate_state(state):
-    if not state or state not in STATES:
-        return False, "Please select a valid state"
-    return True, ""
+def min_length(length, message):
+    return Check("min_length", length, message)
 
-def validate_category(category):
-    if not category or category not in CASE_CATEGORIES:
-        return False, "Please select a valid case category"
-    return True, ""
+def max_length(length, message):
+    return Check("max_length", length, message)
 
-# Zip code validation function
-def validate_zipcode(zipcode):
-    pattern = r'^\d{5}(-\d{4})?$'
-    if not re.match(pattern, zipcode):
-        return False, "Please enter a valid 5-digit ZIP code (or 5+4 format)"
-    return True, ""
+def one_of(choices, message):
+    return Check("choices", frozenset(choices), message)
 
-# DOB validation function
-def validate_dob(dob):
-    if not dob:
-        return False, "Date of Birth is required"
-    return True, ""
+def valid_date(message, fmt="%m/%d/%Y"):
+    return Check("date", fmt, message)
 
-# MRN validation function
-def validate_mrn(mrn):
-    if not mrn:
-        return False, "Medical Record Number is required"
-    if not mrn.isdigit():
-        return False, "Medical Record Number should contain only numerical values"
-    return True, ""
+def not_future(message, fmt="%m/%d/%Y"):
+    return Check("not_future", fmt, message)
+
+def name_checks(label):
+    """Checks for person and department names"""
+    return (
+        required(f"{label} is required"),
+        matches(r'[A-Za-z\s-]+', f"{label} should only contain letters, spaces, and hyphens"),
+        min_length(2, f"{label} should be at least 2 characters long"),
+    )
+
+# (submitted_data key, checks) in form order
+FORM_SCHEMA = (
+    ("First Name", name_checks("First Name")),
+    ("Last Name", name_checks("Last Name")),
+    ("Date of Birth", (
+        required("Date of Birth is required"),
+        valid_date("Please enter a valid Date of Birth (MM/DD/YYYY)"),
+        not_future("Date of Birth cannot be in the future"),
+    )),
+    ("Medical Record Number", (
+        required("Medical Record Number is required"),
+        matches(r'\d+', "Medical Record Number should contain only numerical values"),
+    )),
+    ("Email", (
+        matches(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', "Please enter a valid Email address"),
+    )),
+    ("Phone", (
+        matches(r'\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})', "Please enter a valid phone number"),
+    )),
+    ("Address", (required("Address is required"), min_length(5, "Please enter a valid address"))),
+    ("State", (one_of(STATES, "Please select a valid state"),)),
+    ("City", (
+        required("City is required"),
+        matches(r'[A-Za-z]+(?:[ -][A-Za-z]+)*', "City should only contain letters, spaces, and hyphens"),
+    )),
+    ("ZIP Code", (
+        matches(r'\d{5}(-\d{4})?', "Please enter a valid 5-digit ZIP code (or 5+4 format)"),
+    )),
+    ("Employee First Name", name_checks("Employee First Name")),
+    ("Employee Last Name", name_checks("Employee Last Name")),
+    ("Employee Email", (
+        matches(r'[a-zA-Z0-9._%+-]+@samc\.com', "Please enter a valid Employee SAMC Email address", re.IGNORECASE),
+    )),
+    ("Employee Department", name_checks("Employee Department")),
+    ("Case Category", (one_of(CASE_CATEGORIES, "Please select a valid case category"),)),
+    ("Case Study Diagnosis", (
+        required("Case Study Diagnosis is required"),
+        max_length(50, "Case Study Diagnosis should be less than 50 characters long"),
+    )),
+)
+
+def field_error(checks, value):
+    """Message of the first failing check, or "" when the value is valid"""
+    if value is None:
+        value = ""
+    for check in checks:
+        if check.fails(value):
+            return check.message
+    return ""
+
+def validate_fields(fields, schema=FORM_SCHEMA):
+    """
+    Validate every field of one submission in a single pass
+    Args: fields (dict): form values keyed like submitted_data
+    Returns: list: (key, message) per field in form order; message is "" when valid
+    """
+    return [(key, field_error(checks, fields.get(key))) for key, checks in schema]
+
+def validate_frame(df, schema=FORM_SCHEMA):
+    """
+    Bulk mode: validate a DataFrame of submissions (columns named like
+    submitted_data keys) for imports and audits. Each distinct value of a
+    column is checked once and the messages are broadcast back to the rows,
+    so repeated values (states, categories, employees) cost nothing extra.
+    Returns: DataFrame: one message column per schema field ("" when valid)
+             plus a boolean "valid" column, indexed like df
+    """
+    import pandas as pd
+
+    errors = pd.DataFrame(index=df.index)
+    for key, checks in schema:
+        if key not in df:
+            errors[key] = field_error(checks, None)
+            continue
+        codes, uniques = pd.factorize(df[key], use_na_sentinel=False)
+        messages = np.array(
+            [field_error(checks, None if pd.isna(value) else value) for value in uniques],
+            dtype=object,
+        )
+        errors[key] = messages[codes]
+    errors["valid"] = (errors[[key for key, _ in schema]] == "").all(axis=1)
+    return errors
 
 # Signature validation function
 def validate_signature(canvas_result, verbal_authorization):
@@ -276,36 +543,493 @@ def validate_signature(canvas_result, verbal_authorization):
       # If not verbally authorized, perform standard signature validation
     if canvas_result is None:
         return False, "Signature is required"
+
+    # Drawn strokes are enough; the image only has to be decoded without them
+    if signature_strokes(getattr(canvas_result, "json_data", None)):
+        return True, ""
     
     # Check if canvas is empty or no drawing was made
-    if canvas_result.image_data is None:
+    image_data = canvas_result.image_data
+    if image_data is None:
         return False, "Signature is required"
     
-    # Convert canvas data to a PIL Image to check if it's truly drawn on
-    img = Image.fromarray(canvas_result.image_data)
-    
-    # Convert image to numpy array and check if any non-transparent pixels exist
-    img_array = np.array(img)
-    
-    # Check if there are any non-transparent pixels 
-    # (assuming alpha channel is the 4th channel in RGBA)
-    if img_array.shape[2] == 4:  # RGBA image
-        # Check if any pixel has opacity > 0
-        if np.max(img_array[:,:,3]) == 0:
+    # Check if there are any non-transparent pixels, reading the alpha
+    # channel of the canvas array in place rather than copying it
+    if image_data.ndim == 3 and image_data.shape[2] == 4:  # RGBA image
+        if not image_data[:, :, 3].any():
             return False, "Please provide a signature or verbal authorization"
     
     return True, ""
+
+@metrics.timed("validation")
+def collect_validations(fields, canvas_result, verbal_authorization):
+    """
+    Run every form validator over one submission
+    Args: fields (dict): form values keyed like submitted_data
+          canvas_result: SignatureCanvas, or any object exposing image_data
+          verbal_authorization (bool): whether verbal authorization was obtained
+    Returns: list: (valid, message) tuples in form order
+    """
+    validations = [(not message, message) for _, message in validate_fields(fields)]
+    #validate signatured based on verbal authorization status
+    validations.append(validate_signature(canvas_result, verbal_authorization))
+    return validations
+
+def submission_key(submitted_data):
+    """
+    Idempotency key of a validated submission: a hash of all of its values,
+    so resubmitting the same data gives the same key (and storage path)
+    while any edit gives a new one.
+    Returns: str: sha256 hex digest
+    """
+    def encode(value):
+        if isinstance(value, (bytes, np.ndarray)):
+            return hashlib.sha256(value).hexdigest()
+        return str(value)
+
+    canonical = json.dumps(submitted_data, sort_keys=True, default=encode)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def pdf_filename(submitted_data, key=None):
+    """Storage filename for a submission's PDF, unique per submission_key()"""
+    first_name = submitted_data.get('First Name', 'Unknown')
+    last_name = submitted_data.get('Last Name', 'Unnamed')
+    mrn = submitted_data.get('Medical Record Number', 'NoMRN')
+    unique_id = (key or submission_key(submitted_data))[:16]
+    return f"{last_name}_{first_name}_{mrn}_{unique_id}.pdf"
+
+def signature_strokes(json_data):
+    """
+    Extract freehand strokes from st_canvas json_data.
+    Returns: list: one fabric.js path command list per stroke, e.g. [["M", x, y], ["Q", x1, y1, x2, y2], ...]
+    """
+    if not json_data:
+        return []
+    return [
+        obj["path"] for obj in json_data.get("objects", [])
+        if obj.get("type") == "path" and obj.get("path")
+    ]
+
+@dataclass
+class SignatureCanvas:
+    """
+    Signature canvas value as sent by the browser. st_canvas decodes the
+    canvas PNG into an RGBA array on every rerun once anything is drawn;
+    this decodes it only when image_data is used, which with vector
+    signatures is normally never.
+    """
+    data_url: str = None
+    json_data: dict = None
+
+    @cached_property
+    def image_data(self):
+        if not self.data_url:
+            return None
+        _, encoded = self.data_url.split(";base64,", 1)
+        return np.asarray(Image.open(io.BytesIO(base64.b64decode(encoded))))
+
+def signature_canvas(key, height=150, width=600, stroke_width=2):
+    """
+    Freehand signature pad (the streamlit-drawable-canvas component).
+    Inside st.form the browser keeps the drawing as pending form state and
+    sends it once, with the other fields, on submit, so strokes don't rerun
+    the script. The component has to sync in real time
+    (realtimeUpdateStreamlit) for that state to exist at all: without it
+    the drawing is only sent by its toolbar button.
+    The raw value comes from the component's private _component_func
+    (streamlit-drawable-canvas 0.9.3, pinned in requirements.txt); if a
+    release drops it, the public st_canvas is used and decodes every rerun.
+    Returns: SignatureCanvas, or st_canvas's CanvasResult (same attributes)
+    """
+    component_func = getattr(streamlit_drawable_canvas, "_component_func", None)
+    if component_func is None:
+        return streamlit_drawable_canvas.st_canvas(
+            fill_color="rgba(255, 165, 0, 0.3)",
+            stroke_width=stroke_width,
+            stroke_color="#000000",
+            background_color="#00000000",
+            update_streamlit=True,
+            height=height,
+            width=width,
+            drawing_mode="freedraw",
+            point_display_radius=1,
+            key=key,
+        )
+    value = component_func(
+        fillColor="rgba(255, 165, 0, 0.3)",
+        strokeWidth=stroke_width,
+        strokeColor="#000000",
+        backgroundColor="#00000000",  # Transparent background color
+        backgroundImageURL=None,
+        realtimeUpdateStreamlit=True,
+        canvasHeight=height,
+        canvasWidth=width,
+        drawingMode="freedraw",
+        initialDrawing={"version": "4.4.0", "background": "#00000000"},
+        displayToolbar=True,
+        displayRadius=1,
+        key=key,
+        default=None,
+    )
+    if value is None:
+        return SignatureCanvas()
+    return SignatureCanvas(value["data"], value["raw"])
+
+def session_signature(canvas_result, verbal_authorization):
+    """
+    Signature values for submitted_data, which stays in session state until
+    the submission is processed (or, on a duplicate warning, until the user
+    decides). The canvas array (360 KB) is replaced by the cropped,
+    downsampled PNG that create_pdf embeds (a few KB), kept next to the
+    strokes so a vector signature that can't be drawn still has a fallback.
+    Returns: tuple: (signature, strokes) for "Signature" and "Signature Strokes"
+    """
+    if verbal_authorization:
+        return "Verbal Authorization", None
+    strokes = signature_strokes(canvas_result.json_data)
+    return encode_signature_png(canvas_result.image_data), strokes
+
 # Use session state to pass data into PDF with collected image
 
-def create_pdf(**kwargs):
+############# PDF TEMPLATE ###################
+TEMPLATE_PATH = "case_study_consent.pdf"
+# Field positions discovered from the template by get_pdf_coord.py, keyed by
+# the template's sha256 and rebuilt only when the template changes
+FIELD_MAP_PATH = "case_study_consent.fields.json"
+
+# Stamping plan: (field, PDF coordinates, submitted_data keys joined into the value).
+# The coordinates are fallbacks for fields missing from the field map.
+FIELD_PLAN = (
+    ("Patient Name", (118, 240), ("First Name", "Last Name")),
+    ("DOB", (450, 240), ("Date of Birth",)),
+    ("Address", (95, 258), ("Address",)),
+    ("City", (300, 258), ("City",)),
+    ("State", (435, 258), ("State",)),
+    ("Zip Code", (495, 258), ("ZIP Code",)),
+    ("Email", (90, 275), ("Email",)),
+    ("Phone", (355, 275), ("Phone",)),
+    ("Diagnosis Focus", (140, 400), ("Case Study Diagnosis",)),
+    ("Signature Date", (300, 615), ("Signature Date",)),
+    ("Authorized Person", (70, 650), ("Authorized Person",)),
+    ("Verbal Authorization", (200, 685), ("Verbal Authorization",)),
+    ("Verbal Auth Date", (265, 685), ("Verbal Auth Date",)),
+    ("Employee Name", (360, 720), ("Employee First Name", "Employee Last Name")),
+)
+
+SIGNATURE_RECT = (70, 600, 225, 630)
+# Signature image pixels per PDF point (4 = 288 dpi when printed)
+SIGNATURE_SCALE = 4
+# "vector" draws canvas strokes as PDF paths, "raster" embeds a PNG.
+# Raster is always used when no stroke data is available.
+SIGNATURE_MODE = "vector"
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """
+    How create_pdf writes a form. template_options compact the template once
+    per process (fitz.Document.write options); write_options are applied to
+    every form, so they should stay cheap.
+    """
+    template_options: dict
+    write_options: dict
+    subset_fonts: bool = False
+
+OUTPUT_PROFILES = {
+    # The template as-is and doc.write() defaults
+    "original": OutputProfile({}, {}),
+    # Template garbage-collected (duplicate objects and streams merged),
+    # cleaned and packed into object streams once; each form only deflates
+    # its new streams and images and packs its objects
+    "compact": OutputProfile(
+        dict(garbage=4, deflate=True, clean=True, use_objstms=1),
+        dict(garbage=1, deflate=True, deflate_images=True, use_objstms=1),
+    ),
+    # As compact, plus re-subset template fonts and a full garbage/clean pass
+    # per form; a few KB smaller for several more ms per form
+    "smallest": OutputProfile(
+        dict(garbage=4, deflate=True, clean=True, use_objstms=1),
+        dict(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True, use_objstms=1),
+        subset_fonts=True,
+    ),
+}
+OUTPUT_PROFILE = "compact"
+
+class ConsentTemplate:
+    """
+    Process-wide consent template. The template bytes are read from disk once
+    and every submission is stamped onto a fresh in-memory copy.
+    """
+    font_size = 10
+    text_color = (0, 0, 0)  # Black color
+
+    def __init__(self, path=TEMPLATE_PATH, fallback_plan=FIELD_PLAN, field_map_path=FIELD_MAP_PATH,
+                 template_bytes=None):
+        self.path = path
+        self.fallback_plan = fallback_plan
+        self.field_map_path = field_map_path
+        self._bytes = template_bytes
+        self._plan = None
+        self._base_bytes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def template_bytes(self):
+        if self._bytes is None:
+            with self._lock:
+                if self._bytes is None:
+                    with open(self.path, "rb") as f:
+                        self._bytes = f.read()
+        return self._bytes
+
+    @property
+    def plan(self):
+        """
+        The stamping plan with positions taken from the template's field map,
+        loaded on first use. Fields the map lacks keep their FIELD_PLAN position.
+        """
+        if self._plan is None:
+            template_bytes = self.template_bytes
+            with self._lock:
+                if self._plan is None:
+                    self._plan = self._build_plan(template_bytes)
+        return self._plan
+
+    def _build_plan(self, template_bytes):
+        try:
+            fields = load_field_map(template_bytes, self.field_map_path)["fields"]
+        except Exception as e:
+            logger.warning("Could not load the template field map, using FIELD_PLAN: %s", e)
+            fields = {}
+        plan = []
+        for field, position, keys in self.fallback_plan:
+            entry = fields.get(field)
+            # Text is stamped on the first page only
+            if entry and entry["page"] == 0:
+                position = tuple(entry["point"])
+            else:
+                logger.warning("Field %s not found in the template, using its FIELD_PLAN position", field)
+            plan.append((field, position, keys))
+        return tuple(plan)
+
+    @property
+    def version(self):
+        """sha256 of the template bytes; overlays record it to find their template"""
+        return template_hash(self.template_bytes)
+
+    def base_bytes(self, profile):
+        """Template bytes prepared for an output profile, built once per profile"""
+        base = self._base_bytes.get(profile)
+        if base is None:
+            template_bytes = self.template_bytes
+            options = OUTPUT_PROFILES[profile]
+            with self._lock:
+                base = self._base_bytes.get(profile)
+                if base is None:
+                    base = template_bytes
+                    if options.template_options or options.subset_fonts:
+                        import fitz  # PyMuPDF, imported on first use
+
+                        with fitz.open(stream=template_bytes, filetype="pdf") as doc:
+                            if options.subset_fonts:
+                                doc.subset_fonts()
+                            base = doc.write(**options.template_options)
+                    self._base_bytes[profile] = base
+        return base
+
+    def open(self, profile=OUTPUT_PROFILE):
+        """Open an in-memory copy of the template prepared for profile"""
+        import fitz  # PyMuPDF, imported on first use
+
+        return fitz.open(stream=self.base_bytes(profile), filetype="pdf")
+
+    def field_values(self, data):
+        """Yield (position, text) for every field in the stamping plan"""
+        for _, position, keys in self.plan:
+            value = " ".join(str(data.get(key) or "") for key in keys).strip()
+            yield position, value
+
+    def stamp(self, shape, data):
+        """
+        Write all plan fields into a page shape. The caller commits the shape
+        once so the page content stream is rewritten once, not once per field.
+        """
+        for position, value in self.field_values(data):
+            if value:
+                shape.insert_text(position, value, fontsize=self.font_size, color=self.text_color)
+
+@st.cache_resource
+def init_consent_template():
+    """The consent template shared by all sessions"""
+    return ConsentTemplate()
+
+@st.cache_resource(max_entries=8)
+def init_template_version(version):
+    """
+    The consent template for an overlay's template version. Versions other
+    than the current one are downloaded from storage once per process.
+    """
+    consent_template = init_consent_template()
+    if version == consent_template.version:
+        return consent_template
+    template_bytes = init_supabase().storage.from_('completed_consent').download(template_path(version))
+    if template_hash(template_bytes) != version:
+        raise ValueError(f"Stored template {version[:12]} does not match its hash")
+    return ConsentTemplate(template_bytes=template_bytes)
+
+@st.cache_resource
+def init_stored_template():
+    """
+    Queue the current template version for upload once per process, so
+    overlays made with it can be rebuilt after the template changes
+    Returns: str: the template version
+    """
+    consent_template = init_consent_template()
+    init_outbox().enqueue_upload(template_path(consent_template.version), consent_template.template_bytes)
+    return consent_template.version
+
+def submission_overlay(submitted_data):
+    """Overlay for overlay-only storage: stamped values, signature and template version"""
+    consent_template = init_consent_template()
+    keys = [key for _, _, field_keys in consent_template.plan for key in field_keys]
+    strokes = submitted_data.get('Signature Strokes')
+    signature = submitted_data.get('Signature')
+    signature_png = None
+    if not strokes and signature is not None and not isinstance(signature, str):
+        signature_png = signature if isinstance(signature, bytes) else encode_signature_png(signature)
+    return build_overlay(
+        {key: submitted_data.get(key) for key in keys},
+        init_stored_template(),
+        strokes=strokes,
+        signature_png=signature_png,
+    )
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def rebuild_pdf(file_path, pdf_sha256=None):
+    """
+    Rebuild the PDF for an overlay stored at file_path. Rebuilt PDFs are
+    cached in memory, not written back to storage.
+    Args: pdf_sha256 (str): the row's recorded hash of the stored overlay, checked when given
+    """
+    data = init_outbox().spooled_bytes(file_path)
+    if data is None:
+        data = init_supabase().storage.from_('completed_consent').download(file_path)
+    pdf_bytes = render_overlay(data, pdf_sha256)
+    if not pdf_bytes:
+        raise ValueError(f"Could not rebuild {file_path}")
+    return pdf_bytes
+
+def render_overlay(data, pdf_sha256=None):
+    """
+    PDF bytes for stored overlay bytes, rendered on the template version they were made for
+    Args: pdf_sha256 (str): hash of the stored overlay recorded with the row; if given the
+                            overlay bytes must match it (rows from before it was recorded have none)
+    """
+    if pdf_sha256 and hashlib.sha256(data).hexdigest() != pdf_sha256:
+        raise ValueError("Stored overlay does not match the pdf_sha256 recorded when it was submitted")
+    overlay = decode_overlay(data)
+    return create_pdf(consent_template=init_template_version(overlay["template"]), **overlay_submission(overlay))
+
+def encode_signature_png(signature, rect=SIGNATURE_RECT, scale=SIGNATURE_SCALE):
+    """
+    Encode the canvas RGBA array as a compact PNG for embedding.
+    The image is cropped to the inked (non-transparent) pixels, downsampled
+    to the resolution of the signature rect and stored as grayscale + alpha.
+    Returns None if nothing was drawn.
+    """
+    alpha = signature[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    cols = np.flatnonzero(alpha.any(axis=0))
+    if rows.size == 0:
+        return None
+    cropped = signature[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    sig_img = Image.fromarray(cropped, "RGBA").convert("LA")
+
+    # Shrink to fit the target rect at `scale` pixels per point, never enlarge
+    max_width = int((rect[2] - rect[0]) * scale)
+    max_height = int((rect[3] - rect[1]) * scale)
+    ratio = min(max_width / sig_img.width, max_height / sig_img.height, 1)
+    if ratio < 1:
+        size = (max(1, round(sig_img.width * ratio)), max(1, round(sig_img.height * ratio)))
+        sig_img = sig_img.resize(size, Image.LANCZOS)
+
+    img_byte_arr = io.BytesIO()
+    sig_img.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def draw_signature_vector(shape, strokes, rect=SIGNATURE_RECT, stroke_width=2):
+    """
+    Draw canvas strokes as vector paths scaled into rect, keeping proportions
+    and centering the signature like insert_image does.
+    Path operators are written straight into the shape's draw buffer; the
+    per-segment Shape.draw_* calls cost more than the rest of create_pdf.
+    Returns: bool: False if the strokes contain no drawable points
+    """
+    points = [
+        (cmd[i], cmd[i + 1])
+        for path in strokes for cmd in path
+        for i in range(1, len(cmd) - 1, 2)
+    ]
+    if not points:
+        return False
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    min_x, min_y = min(xs), min(ys)
+    width, height = max(max(xs) - min_x, 1), max(max(ys) - min_y, 1)
+    x0, y0, x1, y1 = rect
+    scale = min((x1 - x0) / width, (y1 - y0) / height)
+    offset_x = x0 + (x1 - x0 - width * scale) / 2
+    offset_y = y0 + (y1 - y0 - height * scale) / 2
+
+    # Canvas pixels -> page points -> PDF user space (y axis flipped)
+    m = shape.ipctm
+    def to_pdf(x, y):
+        px = offset_x + (x - min_x) * scale
+        py = offset_y + (y - min_y) * scale
+        return m.a * px + m.c * py + m.e, m.b * px + m.d * py + m.f
+
+    for path in strokes:
+        ops = []
+        current = None
+        for cmd in path:
+            op, args = cmd[0], cmd[1:]
+            if op == "M":
+                current = to_pdf(*args[:2])
+                ops.append("%g %g m" % current)
+            elif op == "L" and current is not None:
+                current = to_pdf(*args[:2])
+                ops.append("%g %g l" % current)
+            elif op == "Q" and current is not None:
+                # Quadratic to cubic: control points 2/3 of the way to the quad control
+                (cx, cy), (ex, ey) = to_pdf(*args[:2]), to_pdf(*args[2:4])
+                sx, sy = current
+                ops.append("%g %g %g %g %g %g c" % (
+                    sx + (cx - sx) * 2 / 3, sy + (cy - sy) * 2 / 3,
+                    ex + (cx - ex) * 2 / 3, ey + (cy - ey) * 2 / 3,
+                    ex, ey,
+                ))
+                current = (ex, ey)
+            elif op == "C" and current is not None:
+                current = to_pdf(*args[4:6])
+                ops.append("%g %g %g %g %g %g c" % (*to_pdf(*args[:2]), *to_pdf(*args[2:4]), *current))
+        if ops:
+            shape.draw_cont += "\n".join(ops) + "\n"
+            shape.finish(color=(0, 0, 0), width=max(stroke_width * scale, 0.6), closePath=False, lineCap=1, lineJoin=1)
+    return True
+
+@metrics.timed("create_pdf")
+def create_pdf(output_profile=OUTPUT_PROFILE, consent_template=None, **kwargs):
     """
     Generate a PDF with embedded form data based on the case study consent template
-    Args: **kwargs: Dictionary of form data to be embedded into the PDF
+    Args: output_profile (str): key of OUTPUT_PROFILES used to write the PDF
+          consent_template (ConsentTemplate): template version to use (default: the current one)
+          **kwargs: Dictionary of form data to be embedded into the PDF.
+                    'Signature' may be a canvas RGBA array or PNG bytes.
     Returns: bytes: PDF document with embedded data
     """
-    # Load the original PDF template
+    # Load an in-memory copy of the PDF template
     try:
-        doc = fitz.open("case_study_consent.pdf")
+        consent_template = consent_template or init_consent_template()
+        with metrics.span("pdf_open"):
+            doc = consent_template.open(output_profile)
     except Exception as e:
         st.error(f"Error opening PDF template: {e}")
         return None
@@ -313,123 +1037,105 @@ def create_pdf(**kwargs):
     # First page of the document
     page = doc[0]
 
-    # Define text insertion parameters 
-    font_size = 10
-    text_color = (0, 0, 0)  # Black color
-    
-    # Mapping of form fields to PDF coordinates
-    field_positions = {
-        "Patient Name": (118, 240),
-        "DOB": (450, 240),
-        "Address": (95, 258),
-        "City": (300, 258),
-        "State": (435, 258),
-        "Zip Code": (495, 258),
-        "Email": (90, 275),
-        "Phone": (355, 275),
-        "Diagnosis Focus": (140, 400),
-        "Signature Date": (300, 615),
-        "Authorized Person": (70, 650),
-        "Verbal Authorization": (200, 685),
-        "Verbal Auth Date": (265, 685),
-    }
-
     # Insert collected data into appropriate locations
-    for field, position in field_positions.items():
-        value = ""
-        if field == "Patient Name":
-            value = f"{kwargs.get('First Name', '')} {kwargs.get('Last Name', '')}".strip()
-        elif field == "DOB":
-            value = kwargs.get('Date of Birth', '')
-        elif field == "Address":
-            value = kwargs.get('Address', '')
-        elif field == "City":
-            value = kwargs.get('City', '')
-        elif field == "State":
-            value = kwargs.get('State', '')
-        elif field == "Zip Code":
-            value = kwargs.get('ZIP Code', '')
-        elif field == "Email":
-            value = kwargs.get('Email', '')
-        elif field == "Phone":
-            value = kwargs.get('Phone', '')
-        elif field == "Diagnosis Focus":
-            value = kwargs.get('Case Study Diagnosis', '')
-        elif field == "Signature Date":
-            value = kwargs.get('Signature Date', '')
-        elif field == "Authorized Person":
-            value = kwargs.get('Authorized Person', '')
-        elif field == "Verbal Authorization":
-            value = kwargs.get('Verbal Authorization', '')
-        elif field == "Verbal Auth Date":
-            value = kwargs.get('Verbal Auth Date', '')
-
-        # Insert text at specified position
-        page.insert_text(position, value, fontsize=font_size, color=text_color)
-
-    # Add signature
+    shape = page.new_shape()
+    with metrics.span("pdf_stamp"):
+        consent_template.stamp(shape, kwargs)
+
+    # Add signature, as vector paths when stroke data is available
     signature = kwargs.get('Signature')
-    if signature is not None and not isinstance(signature, str):
+    strokes = kwargs.get('Signature Strokes')
+    has_image = signature is not None and not isinstance(signature, str)
+    drawn = False
+    # Strokes are also drawn when they are all there is (overlays store one or the other)
+    if strokes and (SIGNATURE_MODE == "vector" or not has_image):
         try:
-            # Convert numpy array to PIL Image
-            from PIL import Image
-            sig_img = Image.fromarray(signature)
-            
-            # Convert image to bytes
-            img_byte_arr = io.BytesIO()
-            sig_img.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-
-            # Add signature to PDF
-            sig_rect = fitz.Rect(70, 600, 225, 630)  # Adjust rectangle as needed
-            page.insert_image(sig_rect, stream=img_byte_arr)
+            with metrics.span("pdf_signature_vector"):
+                drawn = draw_signature_vector(shape, strokes)
         except Exception as e:
-            st.warning(f"Could not add signature: {e}")
+            shape.draw_cont = ""
+            if has_image:
+                st.warning(f"Could not draw vector signature, using image: {e}")
+            else:
+                st.error(f"Could not draw signature: {e}")
+        # A form must not go out unsigned
+        if not drawn and not has_image:
+            doc.close()
+            return None
+    shape.commit()
 
-    # Add verbal authorization details
-    # verbal_auth = "Yes" if kwargs.get('Verbal Authorization', False) else ""
-    # verbal_auth_date = kwargs.get('Verbal Authorization Date', '') if kwargs.get('Verbal Authorization', False) else ''# Using today's date if not specified
-    
-    # Construct employee name for verbal authorization
-    employee_name = f"{kwargs.get('Employee First Name', '')} {kwargs.get('Employee Last Name', '')}".strip()
-    
-    # Insert verbal authorization details
-    # page.insert_text((200, 685), f"{verbal_auth}", fontsize=font_size, color=text_color)
-    # page.insert_text((260, 685), f"{verbal_auth_date}", fontsize=font_size, color=text_color)
-    page.insert_text((360, 720), f"{employee_name}", fontsize=font_size, color=text_color)
+    if not drawn and has_image:
+        try:
+            with metrics.span("pdf_signature_image"):
+                # Convert numpy array to PNG bytes
+                img_byte_arr = signature if isinstance(signature, bytes) else encode_signature_png(signature)
 
-    # Save the modified PDF to a bytes buffer
-    pdf_bytes = doc.write()
+                # Add signature to PDF
+                if img_byte_arr:
+                    page.insert_image(SIGNATURE_RECT, stream=img_byte_arr)
+        except Exception as e:
+            st.warning(f"Could not add signature: {e}")
+
+    # Save the modified PDF to a bytes buffer. Keeping the template's document
+    # ID makes the output depend only on the inputs
+    with metrics.span("pdf_write"):
+        pdf_bytes = doc.write(no_new_id=True, **OUTPUT_PROFILES[output_profile].write_options)
     doc.close()
 
     return pdf_bytes
 
-def display_pdf_download():
+@metrics.timed("display_pdf_download")
+def display_pdf_download(file_path, pdf_bytes=None):
     """
-    Create download button link using Supabase public URL
+    Offer the completed form for download. Until the outbox has uploaded it
+    the storage URL is dead, so the PDF is served from memory (or from the
+    outbox spool); the public URL is only linked once it has been delivered.
     Args:
-    submitted_data:  Dict containing form submission data
+    file_path: Storage path of the uploaded PDF or overlay
+    pdf_bytes: the rendered PDF, if already at hand
     """
     try:
-   
+        if pdf_bytes is None:
+            if is_overlay_path(file_path):
+                # Overlay-only storage has no PDF to link to, so rebuild it
+                pdf_bytes = rebuild_pdf(file_path)
+            else:
+                pdf_bytes = init_outbox().spooled_bytes(file_path)
+        if pdf_bytes is not None:
+            st.download_button(
+                "View Completed Form",
+                data=pdf_bytes,
+                file_name=pdf_name(file_path),
+                mime="application/pdf",
+            )
+            return
 
-        # Get the public URL for the PDF file
-        file_path = get_public_url()
-        if not file_path:
+        # No longer spooled, so the outbox has uploaded it
+        public_url = get_public_url(file_path)
+        if not public_url:
             st.error("PDF file path not found in submission data.")
             return
-
-        # Get the public URL for the PDF file
-        else:
-            st.link_button("View Completed Form", file_path)
+        st.link_button("View Completed Form", public_url)
                 
     except Exception as e:
-        st.error(f"Error getting PDF URL: {e}")
+        st.error(f"Error getting PDF: {e}")
   
 ##### NTFY notification function ####
+NTFY_URL = os.environ.get("CONSENT_NTFY_URL", "https://ntfy.sh/gmeconsent")
+# Submissions within this many seconds of each other are sent as one digest
+NTFY_COALESCE_WINDOW = 10
+
+@st.cache_resource
+def init_notifier():
+    """Shared notifier with a pooled HTTP session to ntfy.sh"""
+    return Notifier(NtfyBackend(NTFY_URL, timeout=NTFY_TIMEOUT), window=NTFY_COALESCE_WINDOW)
+
+@metrics.timed("ntfy_queue")
 def send_ntfy_mssg(**kwargs):
     """
-    Send notification to ntfy.sh channel about new case study consent form submission
+    Send notification to ntfy.sh channel about new case study consent form submission.
+    Sent in the background by the shared notifier, coalesced with other
+    submissions arriving within NTFY_COALESCE_WINDOW seconds
     
     Args:
         **kwargs: Dictionary containing form submission data including:
@@ -455,19 +1161,110 @@ def send_ntfy_mssg(**kwargs):
         f"Category: {category}"
     )
     
-    # Send notification
-    response = requests.post(
-        "https://ntfy.sh/gmeconsent",
-        data=message,
-        headers={
-            "Title": "Case Consent Form Submission",
-            "Priority": "urgent",
-        },
+    # Queue notification; never blocks or fails the submission
+    init_notifier().submit(message)
+
+##### PATIENT COPY EMAIL #####
+# SMTP server used to email patients their signed form; nothing is sent when
+# CONSENT_SMTP_HOST is unset. The login is read from SMTP_USERNAME and
+# SMTP_PASSWORD in the app secrets.
+SMTP_HOST = os.environ.get("CONSENT_SMTP_HOST")
+SMTP_PORT = int(os.environ.get("CONSENT_SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("CONSENT_SMTP_STARTTLS", "1") == "1"
+SMTP_SENDER = os.environ.get("CONSENT_SMTP_SENDER", "no-reply@samc.com")
+SMTP_TIMEOUT = 10
+
+@st.cache_resource
+def init_mailer():
+    """Shared background mail queue with pooled SMTP connections, or None if SMTP isn't configured"""
+    if not SMTP_HOST:
+        return None
+    backend = SmtpBackend(
+        SMTP_HOST, SMTP_PORT,
+        username=st.secrets.get("SMTP_USERNAME"),
+        password=st.secrets.get("SMTP_PASSWORD"),
+        starttls=SMTP_STARTTLS,
+        timeout=SMTP_TIMEOUT,
+    )
+    return Mailer(backend, sender=SMTP_SENDER)
+
+@metrics.timed("mail_queue")
+def send_patient_copy(pdf_bytes, file_path, **kwargs):
+    """
+    Email the patient a copy of their signed form, with the PDF rendered by
+    create_pdf attached. Queued for the mailer's worker threads, so it never
+    waits on SMTP.
+        Returns: bool: True if queued; False with no patient email, no SMTP
+                 server configured or a full queue
+    """
+    mailer = init_mailer()
+    patient_email = (kwargs.get('Email') or '').strip()
+    if mailer is None or not patient_email or not pdf_bytes:
+        return False
+    patient_name = f"{kwargs.get('First Name', '')} {kwargs.get('Last Name', '')}".strip()
+    body = (
+        f"Dear {patient_name},\n\n"
+        "Attached is your copy of the Authorization for Medical Case Study and "
+        "Publication of De-identified Medical Information you completed with "
+        f"{kwargs.get('Employee First Name', '')} {kwargs.get('Employee Last Name', '')} "
+        f"on {kwargs.get('Signature Date') or kwargs.get('Verbal Auth Date') or today_str}.\n\n"
+        "Please keep it for your records.\n"
     )
+    return mailer.submit(
+        patient_email,
+        "Your signed case study authorization",
+        body,
+        attachments=[(pdf_name(file_path), pdf_bytes, "application/pdf")],
+    )
+
+##### WARM-UP #####
+# Throwaway form rendered once at start: loads fonts and PyMuPDF's drawing
+# and image code, which would otherwise be paid by the first submission
+WARMUP_FORM = {
+    "Patient Name": "Warm Up",
+    "Signature Strokes": [[["M", 10, 10], ["L", 50, 30]]],
+}
+
+def warm_up():
+    """
+    Create the clients, template and background workers the first
+    submission needs. Failures are only logged; whatever is still cold is
+    then created on first use, as before.
+    """
+    try:
+        init_supabase()
+        init_duplicate_checker()
+        consent_template = init_consent_template()
+        consent_template.plan
+        consent_template.base_bytes(OUTPUT_PROFILE)
+        # Throwaway renders; keep them out of the create_pdf and pdf_* histograms
+        with metrics.unrecorded():
+            create_pdf(**WARMUP_FORM)
+            signature = np.zeros((4, 4, 4), dtype=np.uint8)
+            signature[1:3, 1:3, 3] = 255
+            create_pdf(**{**WARMUP_FORM, "Signature Strokes": None, "Signature": signature})
+        init_outbox()
+        init_notifier()
+        init_mailer()
+    except Exception:
+        logger.exception("Warm-up failed")
+
+@st.cache_resource
+def init_warmup():
+    """
+    Start warm_up() in the background once per process, on the first page
+    load, so neither that page nor the first submission waits for it
+    """
+    return init_io_pool().submit(warm_up)
 
 
 ######### MAIN FUNCTION ##########
 def main():
+    # Start warming clients, the template and the MRN index before the
+    # first submission needs them
+    init_warmup()
+    init_metrics()
+
     st.subheader("AUTHORIZATION FOR MEDICAL CASE STUDY AND PUBLICATION OF DE-IDENTIFIED MEDICAL INFORMATION")
     st.markdown("""
                 ## Purpose of Authorization
@@ -487,7 +1284,7 @@ def main():
             'employee_last_name', 'employee_email', 'employee_department', 
             'case_category', 'case_study_diagnosis', 
             'submitted', 'submitted_data',
-            'proceed_clicked', 'success_message'
+            'proceed_clicked', 'success_message', 'submission_outcome'
         ]
         
         # Clear each key individually
@@ -533,6 +1330,7 @@ def main():
                     st.session_state[key] = False
                 else:
                     st.session_state[key] = ''
+        st.session_state.pop('submission_outcome', None)
     
     # Display success message if needed
     if st.session_state.success_message:
@@ -543,25 +1341,31 @@ def main():
 
     # Check if we have submitted data to process
     if st.session_state.submitted_data and not st.session_state.proceed_clicked:
-        success, message, existing_data = upload_and_submit_to_supabase(st.session_state.submitted_data)
+        result = submit_once(st.session_state.submitted_data)
+        if result.note:
+            st.warning(result.note)
+        existing_data = result.existing_records
+        similar_data = result.similar_records
         
-        if existing_data:
+        if existing_data or similar_data:
             # Display warning with multiple submissions
-            st.warning(message)
-            num_submissions = len(existing_data) if isinstance(existing_data, list) else 1
-            st.info(f"Found {num_submissions} previous submission(s) with this MRN.")
+            st.warning(result.message)
+            if existing_data:
+                num_submissions = len(existing_data) if isinstance(existing_data, list) else 1
+                st.info(f"Found {num_submissions} previous submission(s) with this MRN.")
+            if similar_data:
+                st.info(f"Found {len(similar_data)} possible match(es) for this patient under a different MRN.")
 
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Proceed Submission ANYWAY", on_click=disable_button, disabled=st.session_state.disable_button):
                     
-                    success, message, _ = upload_and_submit_to_supabase(st.session_state.submitted_data, force_upload=True)
-                    if success:
-                        pdf_bytes = create_pdf(**st.session_state.submitted_data)
-                        if pdf_bytes:
+                    forced = submit_once(st.session_state.submitted_data, force_upload=True)
+                    if forced.success:
+                        if forced.file_path:
                             st.success("Form submitted successfully!")
                             st.session_state.proceed_clicked = True
-                            display_pdf_download()
+                            display_pdf_download(forced.file_path, forced.pdf_bytes)
                             send_ntfy_mssg(**st.session_state.submitted_data)
                             
                            
@@ -575,11 +1379,10 @@ def main():
                     st.rerun()
         else:
            # No duplicates found, use the result from the initial upload attempt
-            if success:  # Use the result from the first upload attempt
-                pdf_bytes = create_pdf(**st.session_state.submitted_data)
-                if pdf_bytes:
+            if result.success:  # Use the result from the first upload attempt
+                if result.file_path:
                     st.success("Form submitted successfully!")
-                    display_pdf_download()
+                    display_pdf_download(result.file_path, result.pdf_bytes)
                     send_ntfy_mssg(**st.session_state.submitted_data)
                     
                 st.session_state.success_message = True
@@ -667,17 +1470,7 @@ def main():
         )
         st.text("Please sign below using touch or mouse(Patient/Representative Signature)*")
         # EMBEDD SIGNATURE CANVAS
-        canvas_result = st_canvas(
-            fill_color="rgba(255, 165, 0, 0.3)",  # Fixed fill color with some opacity
-            stroke_width=2,
-            stroke_color="#000000",
-            background_color="#00000000",  # Transparent background color
-            update_streamlit=True,
-            height=150,
-            drawing_mode="freedraw",
-            point_display_radius=1,
-            key="canvas",
-            )
+        canvas_result = signature_canvas(key="canvas")
 
         # Authorized Person Information
         auth_person = st.text_input(
@@ -727,29 +1520,28 @@ def main():
         submitted = st.form_submit_button("Submit")
         if submitted:
             # form validation
-            validations = [
-                validate_name(first_name, "First Name"),
-                validate_name(last_name, "Last Name"),
-                validate_dob(dob),
-                validate_mrn(mrn),
-                validate_email(email),
-                validate_phone(phone),
-                validate_address(address),
-                validate_state(state),
-                validate_city(city),
-                validate_zipcode(zipcode),
-               
-                # Employee Information
-                validate_name(employee_first_name, "Employee First Name"),
-                validate_name(employee_last_name, "Employee Last Name"),
-                validate_email(employee_email, "Employee SAMC Email"),
-                validate_name(employee_department, "Employee Department"),
-                validate_category(case_category),
-                validate_name(case_study_diagnosis, "Case Study Diagnosis"),
-            ]
-            #validate signatured based on verbal authorization status
-            validations.append(validate_signature(canvas_result, verbal_authorization))
+            validations = collect_validations({
+                "First Name": first_name,
+                "Last Name": last_name,
+                "Date of Birth": dob,
+                "Medical Record Number": mrn,
+                "Email": email,
+                "Phone": phone,
+                "Address": address,
+                "State": state,
+                "City": city,
+                "ZIP Code": zipcode,
+                "Employee First Name": employee_first_name,
+                "Employee Last Name": employee_last_name,
+                "Employee Email": employee_email,
+                "Employee Department": employee_department,
+                "Case Category": case_category,
+                "Case Study Diagnosis": case_study_diagnosis,
+            }, canvas_result, verbal_authorization)
             if all(v[0] for v in validations):
+                # Vector signatures are drawn from the strokes, so the canvas
+                # image is only decoded when there are none
+                signature, strokes = session_signature(canvas_result, verbal_authorization)
                 # Prepare submitted data
                 submitted_data = {
                     "First Name": first_name,
@@ -767,7 +1559,8 @@ def main():
                     # Handling signature for both verbal and non-verbal authorization
                     "Verbal Auth Date": today_str if verbal_authorization else None,
             
-                    "Signature": ("Verbal Authorization" if verbal_authorization else (canvas_result.image_data if canvas_result and not verbal_authorization else None)),
+                    "Signature": signature,
+                    "Signature Strokes": strokes,
                     "Signature Date": None if verbal_authorization else today_str,
 
                     "Employee First Name": employee_first_name,
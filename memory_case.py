@@ -0,0 +1,171 @@
+"""
+tracemalloc memory report for the consent form.
+
+Two measurements, both of Python allocations (tracemalloc), against
+FakeSupabase:
+
+  submission     peak and retained memory for one signed submission, from
+                 the canvas value the browser sends to a confirmed
+                 submission: validation, session_signature(),
+                 upload_and_submit_to_supabase() and the notification,
+                 as main() runs them. Retained memory includes the
+                 outcome (without the PDF) kept by the process-wide
+                 SubmissionMemo, which holds at most SubmissionMemo.size
+  idle sessions  memory held per open session, for N AppTest sessions left
+                 on the empty form, and N left on the duplicate warning
+                 (where submitted_data stays in session state until the
+                 user decides)
+
+Usage:
+    python memory_case.py --sessions 20
+    python memory_case.py --signature raster     # canvas image instead of strokes
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main_case.py")
+
+# The stand-ins keep what they are sent (uploaded PDFs, inserted rows); that
+# is the fake server's memory, not the app's, so it's left out of "retained"
+APP_ONLY = (
+    tracemalloc.Filter(False, "*fake_supabase.py"),
+    tracemalloc.Filter(False, "*fake_ntfy.py"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+def kib(size):
+    return f"{size / 1024:,.1f} KiB"
+
+def traced(filters=APP_ONLY):
+    gc.collect()
+    return sum(stat.size for stat in tracemalloc.take_snapshot().filter_traces(filters).statistics("filename"))
+
+def measure_submission(main_case, canvas_value, submitted_fields, forget_uploads):
+    """
+    Args: canvas_value (dict): what the canvas component returns ("data", "raw")
+          forget_uploads: drops the PDFs the fake bucket is holding
+    Returns: dict: peak and retained bytes of one submission, and the bytes
+             of the submitted_data that would sit in session state
+    """
+    import pickle
+
+    before = traced()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    canvas_result = main_case.SignatureCanvas(canvas_value["data"], canvas_value["raw"])
+    validations = main_case.collect_validations(submitted_fields, canvas_result, False)
+    assert all(valid for valid, _ in validations), validations
+    signature, strokes = main_case.session_signature(canvas_result, False)
+    submitted_data = dict(submitted_fields, **{"Signature": signature, "Signature Strokes": strokes})
+    session_bytes = len(pickle.dumps(submitted_data))
+    result = main_case.upload_and_submit_to_supabase(submitted_data)
+    assert result.success and result.pdf_bytes, result.message
+    main_case.send_ntfy_mssg(**submitted_data)
+    peak = tracemalloc.get_traced_memory()[1] - start
+    del canvas_result, validations, submitted_data, result, signature, strokes
+    # Let the outbox upload and the notification go out, as they would between submissions
+    while main_case.init_outbox().drain_once():
+        pass
+    main_case.init_notifier().flush(timeout=30)
+    forget_uploads()
+    retained = traced() - before
+    return {"peak": peak, "retained": retained, "session_bytes": session_bytes}
+
+def patient(fields, n):
+    """
+    The sample submission as a distinct patient, so the duplicate and
+    similar-patient checks let every measured submission through
+    """
+    return dict(fields, **{
+        "Medical Record Number": f"77{n:05d}",
+        "Date of Birth": (date(1940, 1, 1) + timedelta(days=n)).strftime("%m/%d/%Y"),
+        "Email": f"patient.{n}@example.com",
+        "Phone": f"559-{n // 10000 % 1000:03d}-{n % 10000:04d}",
+    })
+
+def measure_sessions(app_test_class, count, setup=None, timeout=60):
+    """
+    Traced memory held per AppTest session after its first run. AppTest keeps
+    each session's element tree and widget arguments, so this is an upper
+    bound on what a browser session holds on the server.
+    """
+    before = traced()
+    sessions = []
+    for n in range(count):
+        at = app_test_class(APP_PATH, default_timeout=timeout)
+        if setup:
+            setup(at, n)
+        at.run()
+        sessions.append(at)
+    held = traced() - before
+    return held / count, sessions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="tracemalloc report per submission and per idle session")
+    parser.add_argument("--sessions", type=int, default=20, help="idle sessions per state")
+    parser.add_argument("--submissions", type=int, default=5, help="submissions to measure")
+    parser.add_argument("--signature", choices=("vector", "raster"), default="vector",
+                        help="measure with stroke data (vector) or the canvas image only (raster)")
+    args = parser.parse_args(argv)
+
+    os.environ["CONSENT_OUTBOX_DIR"] = tempfile.mkdtemp(prefix="memory-outbox-")
+    from fake_ntfy import LocalNtfyServer
+    from fake_supabase import FakeSupabase
+    import supabase
+
+    fake = FakeSupabase()
+    supabase.create_client = lambda url, key: fake
+    ntfy = LocalNtfyServer().start()
+    os.environ["CONSENT_NTFY_URL"] = ntfy.url
+
+    import bench_case
+    import main_case
+    from load_case import concurrent_app_test, install_shared_runtime
+
+    install_shared_runtime({"SUPABASE_URL": fake.url, "SERVICE_ROW": "memory-test-key"})
+    canvas_value = bench_case.sample_canvas_value()
+    if args.signature == "raster":
+        canvas_value["raw"] = {"version": "4.4.0", "objects": []}
+    fields = bench_case.sample_submission()
+    fields.update({"Verbal Authorization": None, "Verbal Auth Date": None, "Signature Date": main_case.today_str})
+
+    # Warm every process-wide resource first so it isn't counted
+    main_case.init_warmup().result()
+    tracemalloc.start()
+    main_case.upload_and_submit_to_supabase(dict(patient(fields, 99999), **{"Signature": "Verbal Authorization"}))
+
+    print(f"signature {args.signature}, canvas value {len(canvas_value['data']) + len(str(canvas_value['raw'])):,} chars")
+    for n in range(args.submissions):
+        r = measure_submission(main_case, canvas_value, patient(fields, n), fake.buckets.clear)
+        print(f"submission {n + 1}: peak {kib(r['peak'])}, retained {kib(r['retained'])}, "
+              f"submitted_data in session {kib(r['session_bytes'])}")
+
+    app_test_class = concurrent_app_test()
+    # The first session compiles the script and imports what it renders with
+    measure_sessions(app_test_class, 1)
+    per_session, idle = measure_sessions(app_test_class, args.sessions)
+    print(f"idle form:        {kib(per_session)} per session ({args.sessions} sessions)")
+
+    # Pending duplicate: the MRN is already stored, so main() shows the
+    # warning and keeps submitted_data until Proceed or Cancel
+    canvas_result = main_case.SignatureCanvas(canvas_value["data"], canvas_value["raw"])
+    signature, strokes = main_case.session_signature(canvas_result, False)
+    pending = dict(fields, **{"Medical Record Number": "7700000", "Signature": signature, "Signature Strokes": strokes})
+
+    def setup(at, n):
+        at.session_state["submitted_data"] = dict(pending)
+        at.session_state["proceed_clicked"] = False
+
+    per_session, waiting = measure_sessions(app_test_class, args.sessions, setup)
+    assert all(at.warning for at in waiting), "expected the duplicate warning"
+    print(f"duplicate warning: {kib(per_session)} per session ({args.sessions} sessions)")
+    ntfy.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
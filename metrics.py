@@ -0,0 +1,215 @@
+"""
+Per-stage latency histograms for the consent app.
+
+Code is timed with spans:
+
+    with metrics.span("pdf_write"):
+        ...
+
+    @metrics.timed("create_pdf")
+    def create_pdf(...):
+
+Each span adds its duration to the histogram for its stage, and counts an
+error if the block raised. There is one registry per process (REGISTRY), so
+the Streamlit script, the outbox drainer and the notifier thread all report
+into it. A span costs two perf_counter() calls and one short lock.
+
+Work that isn't a real submission, such as the start-up warm-up, runs
+inside metrics.unrecorded() so its spans don't skew the histograms:
+
+    with metrics.unrecorded():
+        create_pdf(**WARMUP_FORM)
+
+The histograms are rendered in the Prometheus text format. They can be
+served over HTTP for scraping, or written to a file every few seconds (for
+node_exporter's textfile collector, or just to read):
+
+    metrics.start_http_server(9464)        # GET /metrics
+    metrics.start_file_writer("metrics.prom", interval=15)
+"""
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds, from sub-millisecond local work to network timeouts
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Threads currently inside unrecorded()
+_local = threading.local()
+
+METRIC = "consent_stage_seconds"
+ERRORS = "consent_stage_errors_total"
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        # Called with the registry lock held
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Estimate of the q quantile: the upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Span:
+    __slots__ = ("registry", "stage", "started")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if getattr(_local, "unrecorded", False):
+            return False
+        self.registry.observe(self.stage, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds, error)
+
+    def span(self, stage):
+        return Span(self, stage)
+
+    def snapshot(self):
+        """
+        Returns: dict: stage -> {"count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms"},
+                 quantiles as bucket upper bounds
+        """
+        with self._lock:
+            histograms = {stage: (h.count, h.errors, h.sum, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                          for stage, h in self._histograms.items()}
+        return {
+            stage: {
+                "count": count, "errors": errors, "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+                "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000,
+            }
+            for stage, (count, errors, total, p50, p95, p99) in sorted(histograms.items())
+        }
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.sum, h.count, h.errors) for stage, h in self._histograms.items()}
+        lines = [
+            f"# HELP {METRIC} Time spent in each stage of a consent submission.",
+            f"# TYPE {METRIC} histogram",
+        ]
+        for stage, (counts, total, count, _) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{METRIC}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC}_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'{METRIC}_count{{stage="{stage}"}} {count}')
+        lines.append(f"# HELP {ERRORS} Stage runs that raised an exception.")
+        lines.append(f"# TYPE {ERRORS} counter")
+        for stage, (_, _, _, errors) in sorted(histograms.items()):
+            lines.append(f'{ERRORS}{{stage="{stage}"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def span(stage):
+    """Time a block of code into the process-wide registry"""
+    return Span(REGISTRY, stage)
+
+@contextlib.contextmanager
+def unrecorded():
+    """Spans on this thread inside the block are not recorded"""
+    previous = getattr(_local, "unrecorded", False)
+    _local.unrecorded = True
+    try:
+        yield
+    finally:
+        _local.unrecorded = previous
+
+def timed(stage):
+    """Decorator that times every call of a function as a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(REGISTRY, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def start_http_server(port, host="0.0.0.0", registry=REGISTRY):
+    """Serve registry.render() at /metrics from a daemon thread. Returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def write_file(path, registry=REGISTRY):
+    """Write registry.render() to path atomically"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+def start_file_writer(path, interval=15.0, registry=REGISTRY):
+    """Rewrite the metrics file every interval seconds from a daemon thread"""
+    def run():
+        while True:
+            try:
+                write_file(path, registry)
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", path, e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
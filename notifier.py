@@ -0,0 +1,125 @@
+"""
+Coalescing ntfy notifier.
+
+Submissions are queued with Notifier.submit() and sent from a background
+thread. Messages that arrive within `window` seconds of the first queued one
+go out as a single digest, so a burst of submissions becomes one
+notification instead of a flood. The HTTP backend keeps one pooled
+requests.Session, so connections to ntfy are reused.
+
+Any object with send(title, message, priority) can be used as a backend;
+fake_ntfy.LocalNtfyServer is a local HTTP stand-in for tests.
+"""
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class NtfyBackend:
+    def __init__(self, url, timeout=5, session=None):
+        self.url = url
+        self.timeout = timeout
+        if session is None:
+            # Imported here so the app can start before requests is loaded
+            import requests
+
+            session = requests.Session()
+        self.session = session
+
+    def send(self, title, message, priority):
+        response = self.session.post(
+            self.url,
+            data=message.encode("utf-8"),
+            headers={"Title": title, "Priority": priority},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+class Notifier:
+    def __init__(self, backend, window=10.0, max_batch=20,
+                 title="Case Consent Form Submission", priority="urgent"):
+        """
+        Args: backend: object with send(title, message, priority)
+              window (float): seconds to wait for more messages before sending; 0 sends each one
+              max_batch (int): send at once when this many messages are queued
+        """
+        self.backend = backend
+        self.window = window
+        self.max_batch = max_batch
+        self.title = title
+        self.priority = priority
+        self.stats = {"submitted": 0, "sent": 0, "coalesced": 0, "failed": 0}
+        self._pending = []
+        self._deadline = None
+        self._cond = threading.Condition()
+        self._sending = False
+        self._thread = None
+
+    def submit(self, message):
+        """Queue a message; never blocks on the network"""
+        with self._cond:
+            if not self._pending:
+                self._deadline = time.monotonic() + self.window
+            self._pending.append(message)
+            self.stats["submitted"] += 1
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ntfy-notifier", daemon=True)
+                self._thread.start()
+
+    def _take_batch(self):
+        # Called with the condition held
+        while True:
+            if self._pending:
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0 or len(self._pending) >= self.max_batch:
+                    batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                    self._deadline = time.monotonic() + self.window if self._pending else None
+                    self._sending = True
+                    return batch
+                self._cond.wait(remaining)
+            else:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            self._send(batch)
+            with self._cond:
+                self._sending = False
+                self._cond.notify_all()
+
+    def _send(self, batch):
+        if len(batch) == 1:
+            title, message = self.title, batch[0]
+        else:
+            title = f"{len(batch)} Case Consent Form Submissions"
+            message = "\n\n".join(batch)
+        try:
+            with metrics.span("ntfy_post"):
+                self.backend.send(title, message, self.priority)
+        except Exception as e:
+            logger.warning("ntfy notification failed: %s", e)
+            with self._cond:
+                self.stats["failed"] += len(batch)
+            return
+        with self._cond:
+            self.stats["sent"] += 1
+            self.stats["coalesced"] += len(batch) - 1
+
+    def flush(self, timeout=None):
+        """Send everything queued now and wait for it; returns False on timeout"""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._deadline = time.monotonic()
+            self._cond.notify_all()
+            while self._pending or self._sending:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
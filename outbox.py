@@ -0,0 +1,396 @@
+"""
+Durable local outbox for consent submissions.
+
+Each validated submission is recorded in a SQLite table and its rendered PDF
+in a spool directory before the user sees a confirmation. A background
+drainer thread uploads the spooled PDFs to Supabase storage and inserts the
+rows into consentsamc_results in batches, retrying with exponential backoff
+while Supabase is slow or unreachable.
+
+Each item that fails is retried on its own schedule (next_attempt_at), so a
+submission Supabase keeps rejecting can't hold back the ones behind it.
+After max_attempts failures it is dead-lettered: kept on disk with its last
+error but no longer retried, until retry_dead() puts it back in the queue.
+
+Usage:
+    box = Outbox(".outbox", init_supabase)
+    box.start()
+    box.enqueue(file_path, database_row, pdf_bytes)
+    box.enqueue_upload(path, data)  # storage object with no table row
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TABLE = "consentsamc_results"
+BUCKET = "completed_consent"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL UNIQUE,
+    mrn TEXT,
+    row_json TEXT NOT NULL,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Columns added since the first release; older outbox files get them on open
+ADDED_COLUMNS = (
+    ("next_attempt_at", "REAL NOT NULL DEFAULT 0"),
+    ("dead", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+# What a conflicting insert reports: SQLSTATE unique_violation on the unique
+# index over pdf_file_path (sql/consentsamc_results_indexes.sql)
+UNIQUE_VIOLATION = "23505"
+PDF_PATH_KEY = "consentsamc_results_pdf_file_path_key"
+
+# Storage content type by path suffix
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".gz": "application/gzip",
+}
+
+def _content_type(file_path):
+    for suffix, content_type in CONTENT_TYPES.items():
+        if file_path.endswith(suffix):
+            return content_type
+    return "application/octet-stream"
+
+def _row_exists(error):
+    """The insert hit the unique pdf_file_path index, so the row is already in the table"""
+    return getattr(error, "code", None) == UNIQUE_VIOLATION and PDF_PATH_KEY in str(error)
+
+def _object_exists(error):
+    """The storage upload found the object already there"""
+    return "already exists" in str(error).lower()
+
+class Outbox:
+    def __init__(self, directory, client_factory, executor=None, batch_size=50,
+                 poll_interval=5.0, max_backoff=60.0, call_attempts=3,
+                 max_attempts=20, max_item_backoff=600.0, clock=time.time):
+        """
+        Args: directory (str): where the SQLite file and PDF spool live
+              client_factory (callable): returns a Supabase client
+              executor: thread pool used for concurrent uploads (one is created if None)
+              batch_size (int): rows per insert round trip
+              max_attempts (int): failed drains before an item is dead-lettered
+                                  (about two hours of retries with the default backoff)
+              max_item_backoff (float): longest wait before retrying one failed item
+        """
+        self.directory = directory
+        self.spool_dir = os.path.join(directory, "spool")
+        self.db_path = os.path.join(directory, "outbox.sqlite3")
+        self.client_factory = client_factory
+        self.executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="outbox-upload")
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.call_attempts = call_attempts
+        self.max_attempts = max_attempts
+        self.max_item_backoff = max_item_backoff
+        self.clock = clock
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._drain_lock = threading.Lock()
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, definition in ADDED_COLUMNS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {definition}")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _spool_path(self, file_path):
+        return os.path.join(self.spool_dir, file_path.replace("/", "__"))
+
+    ############# PRODUCER ###################
+    def _spool(self, file_path, data):
+        spool_path = self._spool_path(file_path)
+        tmp_path = spool_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, spool_path)
+
+    def enqueue(self, file_path, row, pdf_bytes):
+        """
+        Durably record one submission. Returns once the PDF (or overlay) is on
+        disk and the row is committed, then wakes the drainer. File paths are
+        per submission, so queuing a path that is already pending is a no-op.
+        Returns: bool: False if file_path was already queued
+        """
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM outbox WHERE file_path = ?", (file_path,)).fetchone():
+                return False
+        self._spool(file_path, pdf_bytes)
+        with self._connect() as conn:
+            queued = conn.execute(
+                "INSERT OR IGNORE INTO outbox (file_path, mrn, row_json, created_at) VALUES (?, ?, ?, ?)",
+                (file_path, row.get("Medical Record Number"), json.dumps(row, default=str), time.time()),
+            ).rowcount
+        self._wake.set()
+        return bool(queued)
+
+    def enqueue_upload(self, file_path, data):
+        """
+        Durably queue a storage object that has no table row (e.g. a template
+        version). Queuing a path that is already pending is a no-op.
+        """
+        self._spool(file_path, data)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox (file_path, mrn, row_json, created_at) VALUES (?, NULL, 'null', ?)",
+                (file_path, time.time()),
+            )
+        self._wake.set()
+
+    def spooled_bytes(self, file_path):
+        """Bytes of an object still waiting to be uploaded, or None"""
+        try:
+            with open(self._spool_path(file_path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def pending_count(self):
+        """Items still being retried (dead-lettered ones are not counted)"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0").fetchone()[0]
+
+    def dead_letters(self):
+        """
+        Items given up on after max_attempts failures
+        Returns: list: (file_path, attempts, last_error) tuples, oldest first
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT file_path, attempts, last_error FROM outbox WHERE dead = 1 ORDER BY id").fetchall()
+
+    def retry_dead(self):
+        """Put every dead-lettered item back in the queue; returns how many"""
+        with self._connect() as conn:
+            count = conn.execute("UPDATE outbox SET dead = 0, attempts = 0, next_attempt_at = 0 WHERE dead = 1").rowcount
+        self._wake.set()
+        return count
+
+    def pending_rows(self, mrn):
+        """Rows for this MRN that are accepted locally but not yet in Supabase"""
+        with self._connect() as conn:
+            return [json.loads(r[0]) for r in conn.execute(
+                "SELECT row_json FROM outbox WHERE mrn = ? ORDER BY id", (mrn,)
+            )]
+
+    ############# DRAINER ###################
+    def _retrying(self):
+        # Imported on first drain rather than at app start
+        from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+        return Retrying(
+            stop=stop_after_attempt(self.call_attempts),
+            wait=wait_exponential(multiplier=0.5, max=5),
+            reraise=True,
+        )
+
+    def _upload(self, client, file_path):
+        with open(self._spool_path(file_path), "rb") as f:
+            pdf_bytes = f.read()
+        try:
+            for attempt in self._retrying():
+                with attempt, metrics.span("storage_upload"):
+                    client.storage.from_(BUCKET).upload(
+                        file=pdf_bytes,
+                        path=file_path,
+                        file_options={"content-type": _content_type(file_path)},
+                    )
+        except Exception as e:
+            # A previous drain uploaded it but stopped before recording that
+            if not _object_exists(e):
+                raise
+
+    def _record_failure(self, ids, error):
+        """Schedule the items' next attempt with exponential backoff, dead-lettering them at max_attempts"""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?,"
+                " next_attempt_at = ? + MIN(?, 1 << MIN(attempts + 1, 30)), dead = attempts + 1 >= ?"
+                " WHERE id = ?",
+                [(str(error), self.clock(), self.max_item_backoff, self.max_attempts, i) for i in ids],
+            )
+            dead = conn.execute(
+                f"SELECT file_path FROM outbox WHERE dead = 1 AND id IN ({','.join('?' * len(ids))})", list(ids)
+            ).fetchall()
+        for (file_path,) in dead:
+            logger.error("Outbox gave up on %s after %d attempts: %s", file_path, self.max_attempts, error)
+
+    def _insert_rows(self, client, rows):
+        """
+        Insert rows in one round trip, falling back to one row at a time so a
+        single bad row can't hold back the rest of the batch. A row rejected
+        by the unique pdf_file_path index counts as inserted.
+        Returns: dict: file_path -> error for rows that were not inserted
+        """
+        if not rows:
+            return {}
+        try:
+            for attempt in self._retrying():
+                with attempt, metrics.span("table_insert"):
+                    client.table(TABLE).insert(list(rows.values())).execute()
+            return {}
+        except Exception as e:
+            if len(rows) == 1:
+                return {} if _row_exists(e) else {path: e for path in rows}
+        failed = {}
+        for path, row in rows.items():
+            try:
+                with metrics.span("table_insert_row"):
+                    client.table(TABLE).insert(row).execute()
+            except Exception as e:
+                # pdf_file_path is unique, so the row is already there from an earlier attempt
+                if not _row_exists(e):
+                    failed[path] = e
+        return failed
+
+    def drain_once(self):
+        """
+        Upload and insert one batch of the submissions due for an attempt,
+        those never tried first.
+        Returns: int: number of rows delivered to Supabase
+        """
+        with self._drain_lock:
+            with self._connect() as conn:
+                items = conn.execute(
+                    "SELECT id, file_path, row_json, uploaded, attempts FROM outbox"
+                    " WHERE dead = 0 AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (self.clock(), self.batch_size),
+                ).fetchall()
+            if not items:
+                return 0
+            client = self.client_factory()
+
+            # Upload spooled objects concurrently
+            to_upload = {i: path for i, path, _, uploaded, _ in items if not uploaded}
+            futures = {self.executor.submit(self._upload, client, path): i for i, path in to_upload.items()}
+            uploaded_ids = []
+            for future, i in futures.items():
+                try:
+                    future.result()
+                    uploaded_ids.append(i)
+                except Exception as e:
+                    logger.warning("Outbox upload of %s failed: %s", to_upload[i], e)
+                    self._record_failure([i], e)
+            if uploaded_ids:
+                with self._connect() as conn:
+                    conn.executemany("UPDATE outbox SET uploaded = 1 WHERE id = ?", [(i,) for i in uploaded_ids])
+
+            ready = {item[1]: item for item in items if item[3] or item[0] in uploaded_ids}
+            if not ready:
+                return 0
+
+            rows = {path: json.loads(item[2]) for path, item in ready.items()}
+            # Upload-only items are done once uploaded
+            rows = {path: row for path, row in rows.items() if row is not None}
+            try:
+                # Rows retried after an unknown outcome may already be in the table
+                if rows and any(item[4] for item in ready.values()):
+                    existing = client.table(TABLE).select("pdf_file_path").in_("pdf_file_path", list(rows)).execute()
+                    for record in existing.data or []:
+                        rows.pop(record.get("pdf_file_path"), None)
+            except Exception as e:
+                logger.warning("Outbox lookup of %d rows failed: %s", len(rows), e)
+                self._record_failure([item[0] for item in ready.values()], e)
+                return 0
+
+            failed = self._insert_rows(client, rows)
+            for path, error in failed.items():
+                logger.warning("Outbox insert of %s failed: %s", path, error)
+                self._record_failure([ready.pop(path)[0]], error)
+            ready = list(ready.values())
+            if not ready:
+                return 0
+
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM outbox WHERE id = ?", [(item[0],) for item in ready])
+            for item in ready:
+                try:
+                    os.remove(self._spool_path(item[1]))
+                except FileNotFoundError:
+                    pass
+            return len(ready)
+
+    def _due_in(self):
+        """Seconds until the next live item is due (<= 0 if one is due now), None if there are none"""
+        with self._connect() as conn:
+            due = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE dead = 0").fetchone()[0]
+        return None if due is None else due - self.clock()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                with metrics.span("outbox_drain"):
+                    delivered = self.drain_once()
+                pending = self.pending_count()
+            except RuntimeError as e:
+                # The upload pool is shut down at interpreter exit; anything
+                # left is still spooled and is delivered on the next start
+                if "after shutdown" in str(e):
+                    return
+                logger.exception("Outbox drain failed")
+                delivered, pending = 0, 1
+            except Exception:
+                logger.exception("Outbox drain failed")
+                delivered, pending = 0, 1
+            if not pending:
+                failures = 0
+                self._wake.wait(self.poll_interval)
+            elif delivered:
+                # Keep draining the backlog
+                failures = 0
+            else:
+                # Back off while Supabase is unreachable, waking early when the
+                # next failed item is due or a new submission comes in
+                failures += 1
+                delay = min(self.max_backoff, 2 ** failures)
+                try:
+                    due_in = self._due_in()
+                except Exception:
+                    due_in = None
+                if due_in is not None and 0 < due_in < delay:
+                    delay = due_in
+                self._wake.wait(delay)
+
+    def start(self):
+        """Start the background drainer thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox-drainer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,88 @@
+"""
+Overlay-only storage format for consent forms.
+
+Instead of a full PDF, a submission can be stored as its overlay: the values
+stamped onto the template, the signature (canvas strokes, or a small PNG
+when there are none) and the sha256 of the template version it was made
+for. The PDF is rebuilt from the overlay and that template version when
+someone views it. Template versions are stored once under TEMPLATE_PREFIX.
+
+Overlays are gzipped JSON:
+
+    {"version": 1, "template": "<sha256>", "fields": {...},
+     "signature": {"strokes": [...]} | {"png": "<base64>"} | null}
+"""
+import base64
+import gzip
+import json
+
+OVERLAY_VERSION = 1
+OVERLAY_SUFFIX = ".overlay.json.gz"
+TEMPLATE_PREFIX = "templates/"
+
+def is_overlay_path(path):
+    return bool(path) and path.endswith(OVERLAY_SUFFIX)
+
+def overlay_path(pdf_path):
+    """Storage path of the overlay for a PDF path ("x/y.pdf" -> "x/y.overlay.json.gz")"""
+    stem = pdf_path[:-4] if pdf_path.endswith(".pdf") else pdf_path
+    return stem + OVERLAY_SUFFIX
+
+def pdf_name(path):
+    """PDF filename for a stored PDF or overlay path"""
+    name = path.rsplit("/", 1)[-1]
+    return name[:-len(OVERLAY_SUFFIX)] + ".pdf" if is_overlay_path(name) else name
+
+def template_path(template_version):
+    return f"{TEMPLATE_PREFIX}{template_version}.pdf"
+
+def _round_strokes(strokes, digits=1):
+    # Canvas coordinates are in CSS pixels; a tenth of a pixel is plenty
+    return [
+        [[command[0]] + [round(v, digits) for v in command[1:]] for command in path]
+        for path in strokes
+    ]
+
+def build_overlay(fields, template_version, strokes=None, signature_png=None):
+    """
+    Args: fields (dict): submitted_data values stamped onto the template
+          template_version (str): sha256 of the template bytes
+          strokes (list): canvas strokes as from main_case.signature_strokes
+          signature_png (bytes): signature image, used when there are no strokes
+    Returns: dict: overlay
+    """
+    signature = None
+    if strokes:
+        signature = {"strokes": _round_strokes(strokes)}
+    elif signature_png:
+        signature = {"png": base64.b64encode(signature_png).decode("ascii")}
+    return {
+        "version": OVERLAY_VERSION,
+        "template": template_version,
+        "fields": {key: value for key, value in fields.items() if value not in (None, "")},
+        "signature": signature,
+    }
+
+def encode_overlay(overlay):
+    """Compact, deterministic bytes for storage"""
+    text = json.dumps(overlay, separators=(",", ":"), sort_keys=True, default=str)
+    return gzip.compress(text.encode("utf-8"), mtime=0)
+
+def decode_overlay(data):
+    overlay = json.loads(gzip.decompress(data))
+    if overlay.get("version") != OVERLAY_VERSION:
+        raise ValueError(f"Unsupported overlay version {overlay.get('version')!r}")
+    return overlay
+
+def overlay_submission(overlay):
+    """
+    submitted_data-style dict for main_case.create_pdf; a PNG signature is
+    returned as bytes under "Signature"
+    """
+    data = dict(overlay["fields"])
+    signature = overlay.get("signature") or {}
+    if "strokes" in signature:
+        data["Signature Strokes"] = signature["strokes"]
+    if "png" in signature:
+        data["Signature"] = base64.b64decode(signature["png"])
+    return data
@@ -0,0 +1,248 @@
+"""
+Incremental Parquet mirror of consentsamc_results with monthly rollups.
+
+Each sync fetches only the rows created since the last one, using created_at
+as a high-water mark. It appends them to a Parquet dataset partitioned by
+month and adds their counts to the rollups: submissions per month, case
+category, employee department and authorization type (Signed or Verbal).
+Reports read the rollups (a few hundred rows) instead of the table.
+
+Layout:
+    mirror/
+      state.json                                  high-water mark and sync number
+      rows/month=2026-10/part-000012-00003.parquet  rows from page 3 of sync 12
+      rollups-000012.parquet
+
+A sync only becomes visible once state.json is replaced. Files left behind
+by a sync that failed before that are removed by the next one, so a crash
+never double-counts. The mirror is append-only: rows deleted from Supabase
+stay in it.
+
+Usage:
+    python parquet_mirror.py sync
+    python parquet_mirror.py report --by "Case Category"
+    python parquet_mirror.py report --by "Employee Department" --dir /data/mirror
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import keyset
+
+TABLE = "consentsamc_results"
+MIRROR_DIR = os.environ.get("CONSENT_MIRROR_DIR", "mirror")
+PAGE_SIZE = 1000
+# Sync order; pdf_file_path is unique, so it makes the keyset unique
+SYNC_ORDER = (("created_at", False), ("pdf_file_path", False))
+
+# Rows are re-read this far behind the high-water mark: created_at is taken
+# when the inserting transaction starts, so a slow insert can commit after a
+# later row has already been mirrored. Re-read rows are skipped by path.
+LOOKBACK = timedelta(minutes=10)
+
+ROLLUP_KEYS = ("month", "Case Category", "Employee Department", "Authorization")
+
+def _state_path(directory):
+    return os.path.join(directory, "state.json")
+
+def _part_path(directory, month, sync_id, page):
+    return os.path.join(directory, "rows", f"month={month}", f"part-{sync_id:06d}-{page:05d}.parquet")
+
+def _rollup_path(directory, sync_id):
+    return os.path.join(directory, f"rollups-{sync_id:06d}.parquet")
+
+def _sync_id(filename):
+    # "part-000012-00003.parquet" / "rollups-000012.parquet" -> 12
+    return int(filename.split("-")[1].split(".", 1)[0])
+
+def read_state(directory):
+    try:
+        with open(_state_path(directory), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"sync_id": 0, "high_water": None, "recent": {}, "rows": 0}
+
+def _write_state(directory, state):
+    tmp_path = _state_path(directory) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _state_path(directory))
+
+def _remove_uncommitted(directory, sync_id):
+    """Delete part and rollup files written by syncs after sync_id, or superseded rollups"""
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(".parquet"):
+                continue
+            if _sync_id(name) > sync_id or (name.startswith("rollups-") and _sync_id(name) != sync_id):
+                os.remove(os.path.join(root, name))
+
+def month_of(row):
+    return (row.get("created_at") or "")[:7] or "unknown"
+
+def authorization_type(row):
+    return "Verbal" if row.get("Verbal Authorization") == "Yes" else "Signed"
+
+def rollup_key(row):
+    return (month_of(row), row.get("Case Category") or "", row.get("Employee Department") or "", authorization_type(row))
+
+def fetch_since(client, since=None, page_size=PAGE_SIZE):
+    """
+    Yield pages of rows with created_at >= since (all rows if None), oldest
+    first, keyset-paged on SYNC_ORDER so a first sync of a large table costs
+    one index range scan per page
+    """
+    last = None
+    while True:
+        query = client.table(TABLE).select("*")
+        if last is not None:
+            query = query.or_(keyset.after(last, SYNC_ORDER))
+        elif since:
+            query = query.gte("created_at", since)
+        for column, desc in SYNC_ORDER:
+            query = query.order(column, desc=desc)
+        rows = query.limit(page_size).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+
+def _write_parts(directory, rows, sync_id, page):
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_of(row), []).append(row)
+    for month, month_rows in by_month.items():
+        columns = sorted({key for row in month_rows for key in row})
+        # Every column as text, so parts written from different syncs share a schema
+        table = pa.table({
+            column: pa.array([None if row.get(column) is None else str(row.get(column)) for row in month_rows], pa.string())
+            for column in columns
+        })
+        path = _part_path(directory, month, sync_id, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path, compression="zstd")
+
+def _read_rollup_counts(path):
+    if not path or not os.path.exists(path):
+        return Counter()
+    table = pq.read_table(path).to_pydict()
+    keys = zip(*(table[key] for key in ROLLUP_KEYS))
+    return Counter(dict(zip(keys, table["count"])))
+
+def _write_rollups(path, counts):
+    items = sorted(counts.items())
+    table = pa.table({
+        **{key: pa.array([k[i] for k, _ in items], pa.string()) for i, key in enumerate(ROLLUP_KEYS)},
+        "count": pa.array([count for _, count in items], pa.int64()),
+    })
+    pq.write_table(table, path)
+
+def sync(client, directory=MIRROR_DIR, page_size=PAGE_SIZE):
+    """
+    Mirror rows created since the last sync and update the rollups
+    Returns: dict: sync_id, new rows, total rows and the new high-water mark
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = read_state(directory)
+    _remove_uncommitted(directory, state["sync_id"])
+
+    since = high_water = None
+    if state["high_water"]:
+        high_water = datetime.fromisoformat(state["high_water"])
+        since = (high_water - LOOKBACK).isoformat()
+    sync_id = state["sync_id"] + 1
+    recent = state["recent"]
+    counts = None
+    new_rows = 0
+    # Each page is written as its own part, so only one page is held in memory
+    for page, rows in enumerate(fetch_since(client, since, page_size)):
+        rows = [row for row in rows if row.get("pdf_file_path") not in recent]
+        if not rows:
+            continue
+        _write_parts(directory, rows, sync_id, page)
+        if counts is None:
+            counts = _read_rollup_counts(_rollup_path(directory, state["sync_id"]))
+        counts.update(rollup_key(row) for row in rows)
+        new_rows += len(rows)
+        # Pages come oldest first, so only paths inside the look-back window
+        # of the running high-water mark can be read again
+        newest = max(datetime.fromisoformat(row["created_at"]) for row in rows)
+        high_water = newest if high_water is None else max(high_water, newest)
+        recent.update({row["pdf_file_path"]: row["created_at"] for row in rows})
+        recent = {path: created for path, created in recent.items() if datetime.fromisoformat(created) >= high_water - LOOKBACK}
+    if not new_rows:
+        return {"sync_id": state["sync_id"], "new_rows": 0, "rows": state["rows"], "high_water": state["high_water"]}
+
+    _write_rollups(_rollup_path(directory, sync_id), counts)
+    state = {"sync_id": sync_id, "high_water": high_water.isoformat(), "recent": recent, "rows": state["rows"] + new_rows}
+    _write_state(directory, state)
+    _remove_uncommitted(directory, sync_id)
+    return {"sync_id": sync_id, "new_rows": new_rows, "rows": state["rows"], "high_water": state["high_water"]}
+
+def load_rollups(directory=MIRROR_DIR):
+    """
+    Rollups of the last committed sync as a DataFrame with ROLLUP_KEYS and count,
+    or None if nothing has been mirrored yet
+    """
+    state = read_state(directory)
+    path = _rollup_path(directory, state["sync_id"])
+    if not state["sync_id"] or not os.path.exists(path):
+        return None
+    return pq.read_table(path).to_pandas()
+
+def monthly_volume(rollups, by):
+    """Submissions per month (rows) and value of `by` (columns), e.g. by="Case Category" """
+    return rollups.pivot_table(index="month", columns=by, values="count", aggfunc="sum", fill_value=0).sort_index()
+
+def read_rows(directory=MIRROR_DIR, columns=None, filter=None):
+    """
+    Mirrored rows of committed syncs as a pyarrow Table, for ad hoc analysis
+    Args: columns (list): columns to read; filter: pyarrow.dataset expression,
+          e.g. ds.field("month") == "2026-10" reads only that partition
+    """
+    committed = read_state(directory)["sync_id"]
+    files = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(os.path.join(directory, "rows"))
+        for name in names if name.endswith(".parquet") and _sync_id(name) <= committed
+    ]
+    if not files:
+        return pa.table({})
+    schema = pa.unify_schemas([pq.read_schema(path) for path in files] + [pa.schema([("month", pa.string())])])
+    dataset = ds.dataset(files, schema=schema, partitioning="hive", partition_base_dir=os.path.join(directory, "rows"))
+    return dataset.to_table(columns=columns, filter=filter)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mirror consentsamc_results to Parquet and report monthly volume")
+    parser.add_argument("command", choices=("sync", "report"))
+    parser.add_argument("--dir", default=MIRROR_DIR, help="mirror directory")
+    parser.add_argument("--by", default="Case Category", choices=ROLLUP_KEYS[1:], help="report breakdown")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        import main_case
+
+        result = sync(main_case.init_supabase(), args.dir)
+        print(f"sync {result['sync_id']}: {result['new_rows']} new rows, {result['rows']} mirrored, "
+              f"high-water mark {result['high_water']}")
+        return 0
+
+    rollups = load_rollups(args.dir)
+    if rollups is None:
+        print(f"Nothing mirrored in {args.dir} yet; run the sync command first")
+        return 1
+    print(monthly_volume(rollups, args.by).to_string())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+-- Columns added to consentsamc_results after it was created.
+-- Run once in the Supabase SQL editor, before deploying the app version
+-- that writes them; safe to run again.
+
+-- sha256 of the stored object: the PDF, or for overlay-only submissions
+-- the overlay it is rebuilt from (main_case.render_overlay checks it before
+-- rebuilding). Overlays are encoded deterministically; rebuilt PDFs are not
+-- hashed because their bytes change with PyMuPDF and the field map. Older
+-- rows have none and are not checked.
+alter table consentsamc_results add column if not exists pdf_sha256 text;
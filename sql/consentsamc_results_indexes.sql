@@ -0,0 +1,35 @@
+-- Indexes for the admin dashboard (admin_dashboard.py) and the form.
+-- Run once in the Supabase SQL editor; safe to run again.
+--
+-- The dashboard lists rows newest first, ordered by created_at with
+-- pdf_file_path as a tie-breaker, and pages by keyset: each page asks for
+-- the rows after the previous page's last (created_at, pdf_file_path),
+-- which these indexes answer with one range scan. It filters by
+-- MRN, case category, department (case-insensitive substring) and a
+-- created_at range.
+
+-- Unfiltered and date-range listing: read in index order, no sort. The
+-- duplicate check's incremental refresh reads it backward (oldest first).
+create index if not exists consentsamc_results_created_at_idx
+    on consentsamc_results (created_at desc, pdf_file_path desc);
+
+-- MRN lookups (also used by the form's duplicate check)
+create index if not exists consentsamc_results_mrn_idx
+    on consentsamc_results ("Medical Record Number");
+
+-- Category listing, newest first
+create index if not exists consentsamc_results_category_created_at_idx
+    on consentsamc_results ("Case Category", created_at desc, pdf_file_path desc);
+
+-- One row per stored PDF. Storage paths are derived from each submission's
+-- idempotency key, so a retried insert of the same submission is rejected
+-- here instead of creating a second row (the app treats that as delivered).
+create unique index if not exists consentsamc_results_pdf_file_path_key
+    on consentsamc_results (pdf_file_path);
+
+-- Department ILIKE '%...%' cannot use a btree index; trigrams can
+create extension if not exists pg_trgm;
+create index if not exists consentsamc_results_department_trgm_idx
+    on consentsamc_results using gin ("Employee Department" gin_trgm_ops);
+
+analyze consentsamc_results;
@@ -0,0 +1,46 @@
+import admin_dashboard
+import main_case
+from fake_supabase import FakeSupabase
+
+TABLE = "consentsamc_results"
+
+def make_fake(monkeypatch, departments):
+    fake = FakeSupabase()
+    rows = [
+        {"Medical Record Number": f"{i:07d}", "Employee Department": department,
+         "pdf_file_path": f"case_pdf_received/{i:07d}.pdf"}
+        for i, department in enumerate(departments)
+    ]
+    # Two insert statements, so rows share created_at within each
+    fake.table(TABLE).insert(rows[:len(rows) // 2]).execute()
+    fake.table(TABLE).insert(rows[len(rows) // 2:]).execute()
+    monkeypatch.setattr(main_case, "init_supabase", lambda: fake)
+    admin_dashboard.fetch_page.clear()
+    return fake
+
+def all_pages(filters, page_size):
+    pages, cursor = [], None
+    while True:
+        rows, has_more, total = admin_dashboard.fetch_page(filters, ("Medical Record Number",), cursor, page_size)
+        assert (total is not None) == (cursor is None)
+        pages.append([row["Medical Record Number"] for row in rows])
+        if not has_more:
+            return pages
+        cursor = (rows[-1]["created_at"], rows[-1]["pdf_file_path"])
+
+def test_keyset_pages_cover_every_row_once_newest_first(monkeypatch):
+    make_fake(monkeypatch, ["Cardiology"] * 23)
+    pages = all_pages({}, 5)
+
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    mrns = [mrn for page in pages for mrn in page]
+    assert sorted(mrns) == [f"{i:07d}" for i in range(23)]
+    # The second insert is newer; within one created_at, pdf_file_path descending
+    assert mrns[:3] == ["0000022", "0000021", "0000020"]
+
+def test_department_filter_matches_wildcards_literally(monkeypatch):
+    make_fake(monkeypatch, ["Cardiology", "100% Care", "1000 Care", "ICU_North", "ICU-North"])
+
+    assert all_pages({"department": "100%"}, 10) == [["0000001"]]
+    assert all_pages({"department": "icu_"}, 10) == [["0000003"]]
+    assert all_pages({"department": "cardio"}, 10) == [["0000000"]]
@@ -0,0 +1,69 @@
+import io
+import json
+
+import batch_consent
+
+RECORD = {
+    "First Name": "Jane",
+    "Last Name": "Doe",
+    "Email": "jane.doe@example.com",
+    "Phone": "559-555-0100",
+    "Medical Record Number": "1234567",
+    "Date of Birth": "1980-01-02",
+    "Address": "1303 E Herndon Ave",
+    "City": "Fresno",
+    "State": "CA",
+    "ZIP Code": "93720",
+    "Employee First Name": "Phillip",
+    "Employee Last Name": "Kim",
+    "Employee Email": "phillip.kim@samc.com",
+    "Employee Department": "Internal Medicine",
+    "Case Category": "Cardiology",
+    "Case Study Diagnosis": "Takotsubo cardiomyopathy",
+}
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+    return str(path)
+
+def test_validate_file_with_mixed_type_columns(tmp_path):
+    # JSONL numbers and nulls next to padded strings in the same columns
+    path = write_jsonl(tmp_path / "mixed.jsonl", [
+        dict(RECORD, **{"First Name": " Jane ", "Medical Record Number": 1234567, "ZIP Code": 93720, "Authorized Person": None}),
+        dict(RECORD, **{"Medical Record Number": "7654321", "Phone": 5595550101}),
+        dict(RECORD, **{"Medical Record Number": 12, "Email": "not an email"}),
+    ])
+    report = io.StringIO()
+
+    assert batch_consent.validate_file(path, report=report) == {"records": 3, "valid": 2, "invalid": 1}
+    assert report.getvalue().startswith("row 3: ")
+
+def test_bad_and_future_dates_are_rejected(tmp_path):
+    path = write_jsonl(tmp_path / "dates.jsonl", [
+        dict(RECORD, **{"Date of Birth": "banana"}),
+        dict(RECORD, **{"Date of Birth": "13/45/2020", "Medical Record Number": "2"}),
+        dict(RECORD, **{"Date of Birth": "2999-01-01", "Medical Record Number": "3"}),
+        dict(RECORD, **{"Date of Birth": "01/02/1980", "Medical Record Number": "4"}),
+    ])
+    report = io.StringIO()
+
+    assert batch_consent.validate_file(path, report=report) == {"records": 4, "valid": 1, "invalid": 3}
+    assert "row 3: Date of Birth cannot be in the future" in report.getvalue()
+    assert batch_consent.build_submission(dict(RECORD, **{"Date of Birth": "banana", "Verbal Authorization": "Yes"}))[1] == [
+        "Please enter a valid Date of Birth (MM/DD/YYYY)"
+    ]
+
+def test_duplicate_records_are_reported(tmp_path):
+    verbal = dict(RECORD, **{"Verbal Authorization": "Yes"})
+    path = write_jsonl(tmp_path / "dupes.jsonl", [
+        verbal, dict(verbal, **{"First Name": " Jane"}), dict(verbal, **{"Case Study Diagnosis": "Myocarditis"}),
+    ])
+    report = io.StringIO()
+
+    assert batch_consent.validate_file(path, report=report) == {"records": 3, "valid": 2, "invalid": 1}
+    assert report.getvalue() == "row 2: same record as row 1\n"
+
+    stats = batch_consent.run_batch(path, str(tmp_path / "out.zip"), workers=1, report=report)
+    assert (stats["rendered"], stats["failed"]) == (2, 1)
+    # Rows finish in any order; whichever of 1 and 2 comes second is reported
+    assert "same record as row" in report.getvalue().splitlines()[-1]
@@ -0,0 +1,160 @@
+from duplicate_check import DuplicateChecker
+from fake_supabase import FakeSupabase
+
+TABLE = "consentsamc_results"
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class HeldExecutor:
+    """Holds submitted refreshes until run() is called, like a busy pool"""
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn):
+        self.tasks.append(fn)
+
+    def run(self):
+        tasks, self.tasks = self.tasks, []
+        for fn in tasks:
+            fn()
+
+def patient(mrn, last_name="Doe", dob="01/02/1980"):
+    return {
+        "Medical Record Number": mrn,
+        "First Name": "Jane",
+        "Last Name": last_name,
+        "Date of Birth": dob,
+        "Email": f"patient.{mrn}@example.com",
+        "Phone": f"559-555-{mrn[-4:]}",
+        "pdf_file_path": f"case_pdf_received/{last_name}_Jane_{mrn}.pdf",
+    }
+
+def insert(fake, *rows):
+    fake.table(TABLE).insert(list(rows)).execute()
+
+def make_checker(fake, clock, **kwargs):
+    return DuplicateChecker(lambda: fake, ttl=60, clock=clock, **kwargs)
+
+def test_fresh_index_skips_new_mrns():
+    fake, clock = FakeSupabase(), Clock()
+    insert(fake, patient("1000001"))
+    checker = make_checker(fake, clock)
+    checker.warm()
+
+    assert checker.find("2000002") == []
+    assert checker.stats["skipped"] == 1
+    assert [row["Medical Record Number"] for row in checker.find("1000001")] == ["1000001"]
+
+def test_still_warming_index_falls_back_to_query():
+    fake, clock, executor = FakeSupabase(), Clock(), HeldExecutor()
+    insert(fake, patient("1000001"))
+    checker = make_checker(fake, clock, executor=executor)
+    checker.refresh_in_background()
+
+    assert not checker.is_fresh
+    assert [row["Medical Record Number"] for row in checker.find("1000001")] == ["1000001"]
+    assert checker.stats["queried"] == 1
+
+    executor.run()
+    assert checker.is_fresh
+    assert checker.find("2000002") == []
+
+def test_stale_index_falls_back_to_query():
+    fake, clock, executor = FakeSupabase(), Clock(), HeldExecutor()
+    checker = make_checker(fake, clock, executor=executor)
+    checker.warm()
+    insert(fake, patient("1000001"))
+    clock.now += 61
+
+    # The refresh hasn't run yet, so the stale index must not be trusted
+    assert [row["Medical Record Number"] for row in checker.find("1000001")] == ["1000001"]
+    assert checker.stats["skipped"] == 0
+
+def test_add_makes_an_mrn_visible():
+    fake, clock = FakeSupabase(), Clock()
+    checker = make_checker(fake, clock)
+    checker.warm()
+    assert not checker.might_exist("1000001")
+
+    checker.add("1000001", patient("1000001"))
+    assert checker.might_exist("1000001")
+    assert checker.similar_mrns(patient("3000003")) == ["1000001"]
+
+def test_row_inserted_elsewhere_is_found_after_ttl():
+    fake, clock = FakeSupabase(), Clock()
+    checker = make_checker(fake, clock)
+    checker.warm()
+    # Another app process submits after the snapshot
+    insert(fake, patient("1000001"))
+
+    # Within the TTL the index is trusted
+    assert checker.find("1000001") == []
+    clock.now += 61
+    assert [row["Medical Record Number"] for row in checker.find("1000001")] == ["1000001"]
+    assert checker.is_fresh
+    assert checker.might_exist("1000001")
+
+def test_refresh_reads_only_new_rows():
+    fake, clock = FakeSupabase(), Clock()
+    insert(fake, *(patient(f"1{i:06d}") for i in range(25)))
+    checker = make_checker(fake, clock, page_size=10)
+    assert checker.warm() == 25
+
+    insert(fake, patient("2000002"))
+    # Rows created within REFRESH_OVERLAP of the newest one are read again
+    assert checker.warm() == 26
+    for row in fake.tables[TABLE][:25]:
+        row["created_at"] = "2020-01-01T00:00:00.000000+00:00"
+    insert(fake, patient("3000003"))
+    assert checker.warm() == 2
+    assert checker.stats["rows_read"] == 53
+    assert checker.might_exist("3000003")
+
+def test_keyset_paging_keeps_rows_sharing_a_created_at():
+    fake, clock = FakeSupabase(), Clock()
+    # One insert statement, so every row gets the same created_at
+    insert(fake, *(patient(f"1{i:06d}") for i in range(25)))
+    checker = make_checker(fake, clock, page_size=4)
+
+    assert checker.warm() == 25
+    assert all(checker.might_exist(f"1{i:06d}") for i in range(25))
+
+def test_index_holds_no_patient_details():
+    fake, clock = FakeSupabase(), Clock()
+    insert(fake, patient("1000001"))
+    checker = make_checker(fake, clock)
+    checker.warm()
+
+    assert checker._blocks
+    assert all(isinstance(key, bytes) and len(key) == 8 for key in checker._blocks)
+    assert set(checker._blocks.values()) == {"1000001"}
+
+def test_best_matches_are_scored_before_truncating():
+    fake, clock = FakeSupabase(), Clock()
+    submission = patient("5000005")
+    # A household sharing the submission's email and phone under low MRNs
+    household = [
+        dict(patient(f"1{i:06d}", last_name=f"Other{'abcdefghijklmnopqrstuvwxyz'[i]}", dob="03/04/1950"),
+             Email=submission["Email"], Phone=submission["Phone"])
+        for i in range(25)
+    ]
+    # The same patient under a typo'd MRN that sorts last
+    typo = dict(patient("9999999"), Email="other@example.com", Phone="")
+    # Only the phone in common: can't reach MATCH_THRESHOLD
+    neighbour = dict(patient("2000002", last_name="Smith", dob="05/06/1960"), Phone=submission["Phone"], Email="")
+    insert(fake, *household, typo, neighbour)
+    checker = make_checker(fake, clock)
+    checker.warm()
+
+    assert checker.similar_mrns(submission)[0] == "9999999"
+    assert "2000002" not in checker.similar_mrns(submission)
+    matches = checker.find_similar(submission)
+    assert len(matches) == 20
+    assert matches[0]["Medical Record Number"] == "9999999"
+    assert matches[0]["match_score"] == 0.7
+    assert all(match["match_score"] == 0.6 for match in matches[1:])
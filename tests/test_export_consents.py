@@ -0,0 +1,66 @@
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+
+import export_consents
+import main_case
+from fake_supabase import FakeSupabase
+from overlay import build_overlay, encode_overlay
+
+def make_fake(monkeypatch):
+    fake = FakeSupabase()
+    rows = []
+    for i, category in enumerate(["Cardiology", "Cardiology", "Oncology"]):
+        path = f"case_pdf_received/{category}_{i}.pdf"
+        rows.append({"Medical Record Number": f"{i:07d}", "Case Category": category, "pdf_file_path": path})
+        fake.storage.from_("completed_consent").upload(f"%PDF-{i}".encode(), path)
+    fake.table("consentsamc_results").insert(rows).execute()
+    monkeypatch.setattr(main_case, "init_supabase", lambda: fake)
+    return fake
+
+def filters(category):
+    return {"mrn": None, "category": category, "department": None, "start": None, "end": None}
+
+def zip_names(out):
+    with zipfile.ZipFile(out) as zf:
+        return sorted(name for name in zf.namelist() if name.startswith(export_consents.ZIP_DIR))
+
+def test_resume_with_other_filters_is_refused(monkeypatch, tmp_path):
+    make_fake(monkeypatch)
+    out = str(tmp_path / "export.zip")
+    # An export interrupted after listing its rows
+    list(export_consents.ExportWork(out).list_rows(main_case.init_supabase(), filters("Cardiology")))
+
+    with pytest.raises(ValueError, match="other filters"):
+        export_consents.run_export(out, filters("Oncology"), report=io.StringIO())
+    assert os.path.exists(out + ".parts")
+
+    stats = export_consents.run_export(out, filters("Oncology"), report=io.StringIO(), restart=True)
+    assert stats["submissions"] == 1
+    assert zip_names(out) == ["consents/Oncology_2.pdf"]
+
+def test_resume_with_the_same_filters_continues(monkeypatch, tmp_path):
+    make_fake(monkeypatch)
+    out = str(tmp_path / "export.zip")
+    list(export_consents.ExportWork(out).list_rows(main_case.init_supabase(), filters("Cardiology")))
+
+    stats = export_consents.run_export(out, filters("Cardiology"), report=io.StringIO())
+    assert stats["submissions"] == 2
+    assert zip_names(out) == ["consents/Cardiology_0.pdf", "consents/Cardiology_1.pdf"]
+    assert not os.path.exists(out + ".parts")
+
+def test_overlay_is_checked_against_its_stored_bytes(monkeypatch):
+    fake = make_fake(monkeypatch)
+    path = "case_pdf_received/Overlay_0.overlay.json.gz"
+    version = main_case.init_consent_template().version
+    stored = encode_overlay(build_overlay({"Medical Record Number": "0000009"}, version))
+    fake.storage.from_("completed_consent").upload(stored, path)
+    # A PyMuPDF upgrade or a moved field changes the rebuilt bytes, not the overlay
+    monkeypatch.setattr(main_case, "create_pdf", lambda **kwargs: b"%PDF-rendered-differently")
+
+    assert export_consents.fetch_pdf(fake, path, hashlib.sha256(stored).hexdigest()) == b"%PDF-rendered-differently"
+    with pytest.raises(ValueError):
+        export_consents.fetch_pdf(fake, path, "0" * 64)
@@ -0,0 +1,20 @@
+import threading
+
+import metrics
+
+def test_unrecorded_spans_are_dropped_on_that_thread_only():
+    registry = metrics.Registry()
+
+    def render():
+        with registry.span("create_pdf"):
+            pass
+
+    with metrics.unrecorded():
+        render()
+        # A submission on another thread while the warm-up runs still counts
+        other = threading.Thread(target=render)
+        other.start()
+        other.join()
+    render()
+
+    assert registry.snapshot()["create_pdf"]["count"] == 2
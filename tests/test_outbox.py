@@ -0,0 +1,79 @@
+from postgrest.exceptions import APIError
+
+from fake_supabase import FakeSupabase
+from outbox import Outbox, _row_exists
+
+TABLE = "consentsamc_results"
+
+def unique_violation(constraint):
+    return APIError({
+        "code": "23505",
+        "message": f'duplicate key value violates unique constraint "{constraint}"',
+        "details": None,
+        "hint": None,
+    })
+
+class RejectingSupabase(FakeSupabase):
+    """Rejects every insert with a row for MRN "poison", as a check constraint would"""
+    def table(self, name):
+        query = super().table(name)
+        execute = query.execute
+
+        def checked():
+            if any(row.get("Medical Record Number") == "poison" for row in query.rows_to_insert or ()):
+                raise APIError({"code": "23514", "message": "new row violates check constraint", "details": None, "hint": None})
+            return execute()
+
+        query.execute = checked
+        return query
+
+def make_outbox(tmp_path, fake, now, **kwargs):
+    return Outbox(str(tmp_path), lambda: fake, clock=lambda: now[0], **kwargs)
+
+def enqueue(box, mrn):
+    path = f"case_pdf_received/{mrn}.pdf"
+    box.enqueue(path, {"Medical Record Number": mrn, "pdf_file_path": path}, b"%PDF-1.7")
+    return path
+
+def test_failing_item_does_not_hold_back_later_ones(tmp_path):
+    fake, now = RejectingSupabase(), [1000.0]
+    box = make_outbox(tmp_path, fake, now, batch_size=1)
+    enqueue(box, "poison")
+    enqueue(box, "1234567")
+
+    assert box.drain_once() == 0
+    assert box.drain_once() == 1
+    assert [row["Medical Record Number"] for row in fake.tables[TABLE]] == ["1234567"]
+    assert box.pending_count() == 1
+
+def test_item_is_dead_lettered_after_max_attempts(tmp_path):
+    fake, now = RejectingSupabase(), [1000.0]
+    box = make_outbox(tmp_path, fake, now, max_attempts=3)
+    path = enqueue(box, "poison")
+
+    for _ in range(10):
+        box.drain_once()
+        now[0] += 3600
+    assert box.pending_count() == 0
+    assert [(p, attempts) for p, attempts, _ in box.dead_letters()] == [(path, 3)]
+    assert box.spooled_bytes(path) == b"%PDF-1.7"
+
+    assert box.retry_dead() == 1
+    assert box.pending_count() == 1
+    assert box.dead_letters() == []
+
+def test_row_already_inserted_counts_as_delivered(tmp_path):
+    fake, now = FakeSupabase(), [1000.0]
+    box = make_outbox(tmp_path, fake, now)
+    path = enqueue(box, "1234567")
+    fake.tables[TABLE] = [{"Medical Record Number": "1234567", "pdf_file_path": path}]
+
+    assert box.drain_once() == 1
+    assert box.pending_count() == 0
+    assert len(fake.tables[TABLE]) == 1
+
+def test_only_the_pdf_path_unique_violation_means_already_inserted():
+    assert _row_exists(unique_violation("consentsamc_results_pdf_file_path_key"))
+    assert not _row_exists(unique_violation("consentsamc_results_other_key"))
+    assert not _row_exists(Exception('duplicate key value violates unique constraint "consentsamc_results_pdf_file_path_key"'))
+    assert not _row_exists(Exception("The resource already exists"))
@@ -0,0 +1,38 @@
+import os
+
+import parquet_mirror
+from fake_supabase import FakeSupabase
+
+TABLE = "consentsamc_results"
+
+def row(i, category="Cardiology"):
+    return {"Medical Record Number": f"{i:07d}", "Case Category": category,
+            "pdf_file_path": f"case_pdf_received/{i:07d}.pdf"}
+
+def part_files(directory):
+    return sorted(name for _, _, names in os.walk(os.path.join(directory, "rows")) for name in names)
+
+def test_first_sync_writes_a_part_per_page(tmp_path):
+    fake = FakeSupabase()
+    # One insert statement, so every row shares a created_at
+    fake.table(TABLE).insert([row(i) for i in range(25)]).execute()
+
+    result = parquet_mirror.sync(fake, str(tmp_path), page_size=10)
+
+    assert result["new_rows"] == 25
+    assert len(part_files(tmp_path)) == 3
+    assert parquet_mirror.read_rows(str(tmp_path)).num_rows == 25
+    assert parquet_mirror.load_rollups(str(tmp_path))["count"].sum() == 25
+
+def test_resync_reads_only_new_rows(tmp_path):
+    fake = FakeSupabase()
+    fake.table(TABLE).insert([row(i) for i in range(5)]).execute()
+    parquet_mirror.sync(fake, str(tmp_path), page_size=2)
+    fake.table(TABLE).insert([row(5, "Oncology")]).execute()
+
+    result = parquet_mirror.sync(fake, str(tmp_path), page_size=2)
+
+    assert (result["sync_id"], result["new_rows"], result["rows"]) == (2, 1, 6)
+    assert parquet_mirror.read_rows(str(tmp_path)).num_rows == 6
+    rollups = parquet_mirror.load_rollups(str(tmp_path))
+    assert dict(zip(rollups["Case Category"], rollups["count"])) == {"Cardiology": 5, "Oncology": 1}
@@ -0,0 +1,20 @@
+import main_case
+from main_case import SubmissionMemo, SubmissionResult
+
+def test_memo_keeps_only_the_outcome():
+    memo = SubmissionMemo(size=2)
+    memo.put("a", SubmissionResult(True, "ok", pdf_bytes=b"%PDF" * 1000, pdf_sha256="0" * 64,
+                                   file_path="case_pdf_received/a.pdf", note="checked"))
+
+    assert memo.get("a") == SubmissionResult(True, "ok", file_path="case_pdf_received/a.pdf")
+
+def test_memo_drops_the_least_recently_used():
+    memo = SubmissionMemo(size=2)
+    for key in "abc":
+        memo.put(key, SubmissionResult(True, key))
+        if key == "b":
+            memo.get("a")
+
+    assert memo.get("a") is not None
+    assert memo.get("b") is None
+    assert memo.get("c") is not None